@@ -0,0 +1,77 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.table import timestamp
+from lstore.transaction import Transaction
+
+# Checks that aborted transactions leave no trace: records, versions, time-travel reads, RIDs and
+# secondary indexes are the same as before the transaction ran.
+# Usage: python abort_tester.py
+
+db = Database()
+grades_table = db.create_table('Grades', 3, 0)
+query = Query(grades_table)
+grades_table.index.create_index(1)
+for key in range(10):
+    query.insert(key, key * 10, 0)
+query.update(4, None, 44, None)
+rids = {key: query.select(key, 0, [1, 1, 1])[0].rid for key in range(10)}
+before = timestamp()
+
+transaction = Transaction()
+transaction.add_query(query.update, grades_table, 1, None, 111, 5)
+transaction.add_query(query.update, grades_table, 4, None, 444, 4)
+transaction.add_query(query.delete, grades_table, 2)
+transaction.add_query(query.insert, grades_table, 50, 500, 0)
+transaction.add_query(query.update, grades_table, 3, 33, None, None)
+transaction.add_query(query.increment, grades_table, 5, 2)
+# Fails: no record has key 99
+transaction.add_query(query.update, grades_table, 99, None, 1, None)
+
+errors = []
+if transaction.run() is not False:
+    errors.append('transaction committed')
+expected = {key: [key, key * 10, 0] for key in range(10)}
+expected[4] = [4, 44, 0]
+for key, values in expected.items():
+    result = query.select(key, 0, [1, 1, 1])
+    if not result or result[0].columns != values:
+        errors.append('select %d returned %s instead of %s' % (key, result and result[0].columns, values))
+    elif result[0].rid != rids[key]:
+        errors.append('record %d has RID %d instead of %d' % (key, result[0].rid, rids[key]))
+    result = query.select_as_of(key, 0, [1, 1, 1], timestamp())
+    if not result or result[0].columns != values:
+        errors.append('select_as_of %d returned %s instead of %s' % (key, result and result[0].columns, values))
+for key in (33, 50):
+    if query.select(key, 0, [1, 1, 1]):
+        errors.append('record %d of the aborted transaction is visible' % key)
+for key, previous in ((1, [1, 10, 0]), (4, [4, 40, 0])):
+    result = query.select_version(key, 0, [1, 1, 1], -1)[0].columns
+    if result != previous:
+        errors.append('version -1 of %d is %s instead of %s' % (key, result, previous))
+result = query.select_as_of(4, 0, [1, 1, 1], before)[0].columns
+if result != [4, 44, 0]:
+    errors.append('select_as_of 4 before the transaction returned %s' % result)
+for value, keys in ((111, []), (10, [1]), (20, [2]), (44, [4]), (444, [])):
+    found = sorted(record.columns[0] for record in query.select(value, 1, [1, 1, 1]) or [])
+    if found != keys:
+        errors.append('secondary index finds %s for %d instead of %s' % (found, value, keys))
+
+# A function passed to apply that raises fails its query, which aborts the transaction
+def fail(value):
+    raise ValueError(value)
+
+
+transaction = Transaction()
+transaction.add_query(query.increment, grades_table, 6, 2)
+transaction.add_query(query.apply, grades_table, 7, 2, fail)
+if transaction.run() is not False:
+    errors.append('transaction with a failing apply committed')
+for key in (6, 7):
+    result = query.select(key, 0, [1, 1, 1])[0].columns
+    if result != [key, key * 10, 0]:
+        errors.append('select %d after a failing apply returned %s' % (key, result))
+
+for error in errors:
+    print(error)
+print('Aborted transactions', 'passed' if not errors else 'failed')
+exit(1 if errors else 0)
@@ -0,0 +1,124 @@
+from lstore.db import Database
+from lstore.query import Query
+
+from random import randint, seed
+import os
+import shutil
+import subprocess
+import sys
+
+# Crashes a database while it writes and checks that reopening it recovers every record.
+# Each scenario runs in a child process that loads a table, writes pages back while the last log
+# records may still sit in the log's buffer, then exits without closing the database. The parent
+# reopens the database and compares selects and sums with what the child wrote.
+# Usage: python crash_tester.py
+
+path = './CRASH'
+number_of_records = 20000
+number_of_updates = 29
+
+
+"""
+# Returns the records of a scenario, key -> every version of the record in order, and the updates
+"""
+def expected_records(records):
+    seed(4417)
+    versions = {}
+    for i in range(records):
+        key = 92106429 + i
+        versions[key] = [[key, randint(0, 20), randint(0, 20), randint(0, 20), randint(0, 20)]]
+    updates = []
+    for _ in range(number_of_updates):
+        key = 92106429 + randint(0, records - 1)
+        column = randint(1, 4)
+        value = randint(0, 20)
+        latest = list(versions[key][-1])
+        latest[column] = value
+        versions[key].append(latest)
+        updates.append((key, column, value))
+    return versions, updates
+
+
+"""
+# Runs in the child process: writes then crashes
+# :param scenario: str     #'flush': pages written back by BufferPool.flush, 'evict': by evictions
+#                          #of a small pool, 'flusher': by the background flusher thread
+"""
+def crash(scenario):
+    records = 100 if scenario == 'flush' else number_of_records
+    versions, updates = expected_records(records)
+    keys = sorted(versions)
+    db = Database()
+    db.open(path)
+    if scenario != 'flush':
+        db.bufferpool.capacity = 64
+    table = db.create_table('Grades', 5, 0)
+    query = Query(table)
+    for key in keys[:records // 2]:
+        query.insert(*versions[key][0])
+    db.checkpoint()
+    for key in keys[records // 2:]:
+        query.insert(*versions[key][0])
+    for key, column, value in updates:
+        columns = [None] * 5
+        columns[column] = value
+        query.update(key, *columns)
+    if scenario == 'flush':
+        db.bufferpool.flush()
+    elif scenario == 'flusher':
+        db.bufferpool.resize(16)
+        db.bufferpool.stopping.wait(0.5)
+    os._exit(0)
+
+
+def check(scenario):
+    records = 100 if scenario == 'flush' else number_of_records
+    versions, _ = expected_records(records)
+    shutil.rmtree(path, ignore_errors=True)
+    subprocess.run([sys.executable, __file__, scenario], check=True)
+    db = Database()
+    db.open(path)
+    query = Query(db.get_table('Grades'))
+    # Writes are recovered in log order up to some point: every record inserted before the
+    # checkpoint, then an insert order prefix of the others, each as of one of its versions. Pages
+    # flushed by BufferPool.flush force the whole log, so nothing may be missing there.
+    errors = 0
+    recovered = 0
+    missing = None
+    for key in sorted(versions):
+        try:
+            result = query.select(key, 0, [1, 1, 1, 1, 1])
+        except Exception as e:
+            print('select', key, 'raised', repr(e))
+            errors += 1
+            continue
+        if not result:
+            missing = key if missing is None else missing
+            continue
+        recovered += 1
+        if missing is not None:
+            print('select', key, 'found a record inserted after', missing, 'which is missing')
+            errors += 1
+        elif result[0].columns not in versions[key]:
+            print('select', key, 'returned', result[0].columns, 'instead of one of', versions[key])
+            errors += 1
+    if recovered < records // 2 or (scenario == 'flush' and recovered < records):
+        print('only', recovered, 'records recovered')
+        errors += 1
+    try:
+        query.sum(min(versions), max(versions), 1)
+    except Exception as e:
+        print('sum raised', repr(e))
+        errors += 1
+    db.close()
+    shutil.rmtree(path, ignore_errors=True)
+    print('%s: %d of %d records recovered, %d errors' % (scenario, recovered, records, errors))
+    return errors
+
+
+if len(sys.argv) > 1:
+    crash(sys.argv[1])
+else:
+    failed = sum(check(scenario) for scenario in ('flush', 'evict', 'flusher'))
+    print('Crash recovery', 'passed' if not failed else 'failed')
+    sys.exit(1 if failed else 0)
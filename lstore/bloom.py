@@ -0,0 +1,88 @@
+from lstore.config import BLOOM_BITS_PER_VALUE, BLOOM_HASHES, BLOOM_MIN_CAPACITY, BLOOM_REBUILD_RATE
+
+
+class BloomFilter:
+
+    """
+    # Set of column values that answers "maybe" or "definitely not" in constant time and space.
+    # The filter is scalable: once capacity values were added, a layer of twice the capacity is added
+    # and lookups check every layer, which keeps the false positive rate bounded as the table grows.
+    # Values cannot be removed, so values that left the column keep their bits set; the owner rebuilds
+    # the filter once its bits are so full that lookups often answer "maybe" (see Index.refresh_filters).
+    """
+    def __init__(self, capacity=BLOOM_MIN_CAPACITY):
+        # [bit array, number of bits, values it was sized for, values added, bits set] of each layer
+        self.layers = []
+        self.count = 0
+        self._add_layer(max(capacity, BLOOM_MIN_CAPACITY))
+
+    """
+    # Returns a filter made of the given layers (see self.layers), as stored by Index.write_images
+    """
+    @classmethod
+    def from_layers(cls, layers, count):
+        bloom = cls.__new__(cls)
+        bloom.layers = layers
+        bloom.count = count
+        return bloom
+
+    def _add_layer(self, capacity):
+        bits = capacity * BLOOM_BITS_PER_VALUE
+        self.layers.append([bytearray((bits + 7) // 8), bits, capacity, 0, 0])
+
+    """
+    # Returns the two base hashes the bit positions of value are derived from (double hashing): the
+    # halves of one 64-bit hash, salted so that small integers (which hash to themselves) are mixed
+    """
+    @staticmethod
+    def _hashes(value):
+        h = hash((value, 0x5bd1e995))
+        return h & 0xffffffff, (h >> 32 & 0xffffffff) | 1
+
+    def add(self, value):
+        layer = self.layers[-1]
+        if layer[3] >= layer[2]:
+            self._add_layer(layer[2] * 2)
+            layer = self.layers[-1]
+        h1, h2 = self._hashes(value)
+        array, bits = layer[0], layer[1]
+        set_bits = 0
+        for i in range(BLOOM_HASHES):
+            position = (h1 + i * h2) % bits
+            mask = 1 << (position & 7)
+            if not array[position >> 3] & mask:
+                array[position >> 3] |= mask
+                set_bits += 1
+        # Values the layer already holds (or seems to) do not fill it any further
+        if set_bits:
+            layer[3] += 1
+            layer[4] += set_bits
+            self.count += 1
+
+    def might_contain(self, value):
+        h1, h2 = self._hashes(value)
+        for array, bits, _, _, _ in self.layers:
+            for i in range(BLOOM_HASHES):
+                position = (h1 + i * h2) % bits
+                if not array[position >> 3] & (1 << (position & 7)):
+                    break
+            else:
+                return True
+        return False
+
+    """
+    # Returns the probability that a value never added is reported as maybe present
+    """
+    def false_positive_rate(self):
+        missed = 1.0
+        for _, bits, _, _, set_bits in self.layers:
+            missed *= 1 - (set_bits / bits) ** BLOOM_HASHES
+        return 1 - missed
+
+    """
+    # Returns True if a filter built from the current values would answer "definitely not" noticeably
+    # more often. Reaching the rate takes a number of new values proportional to the filter's size,
+    # which bounds the amortized cost of rebuilding.
+    """
+    def needs_rebuild(self):
+        return self.false_positive_rate() > BLOOM_REBUILD_RATE
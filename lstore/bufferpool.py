@@ -0,0 +1,450 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+from lstore.config import PAGE_SIZE, RECORDS_PER_PAGE, BUFFERPOOL_SIZE, SEQUENTIAL_TRIGGER, READ_AHEAD_PAGES, READ_AHEAD_STREAMS
+from lstore.config import FLUSH_DIRTY_RATIO, FLUSH_INTERVAL, FLUSH_BATCH_PAGES, FLUSH_RUN_PAGES
+from lstore.page import Page
+from lstore import trace
+
+
+"""
+# Writes buffers to fd at offset, in one vectored write where the platform has them
+"""
+def _write_run(fd, offset, buffers):
+    if hasattr(os, 'pwritev'):
+        written = os.pwritev(fd, buffers, offset)
+        if written == len(buffers) * PAGE_SIZE:
+            return
+    else:
+        written = 0
+    data = b''.join(buffers)
+    while written < len(data):
+        written += os.pwrite(fd, data[written:], offset + written)
+
+
+class BufferPool:
+
+    """
+    # Caches the pages of every table of a database.
+    # Each table keeps its pages in <path>/<table>.pages, page i at byte offset i * PAGE_SIZE.
+    # Pages are evicted once more than capacity pages are cached; dirty pages are written back on
+    # eviction and when flushed.
+    # A flusher thread writes dirty pages back in the background, coldest first, whenever more than
+    # FLUSH_DIRTY_RATIO of the capacity is dirty, so evictions seldom have to write a page on the
+    # query thread that needs the frame. Pages are copied under the lock and written without it,
+    # sorted by file offset, each run of contiguous pages in one vectored write.
+    # Frames are split in two segments: hot pages in LRU order, and pages loaded by sequential scans
+    # or read-ahead in FIFO order. Scan pages are evicted first and are only promoted to the hot
+    # segment by a non-sequential access, so a large scan cannot push the point-lookup working set
+    # out of the cache.
+    # With a redo log, a page is never written back before the log records of its writes are on disk
+    # (write-ahead logging): each dirty page remembers the last LSN appended when it was written, and
+    # the log is forced up to it first.
+    # Without a path the pool is purely in memory and never evicts.
+    # With a MemoryBudget, capacity follows what the budget leaves over (see resize).
+    """
+    def __init__(self, path=None, capacity=BUFFERPOOL_SIZE):
+        self.path = path
+        self.capacity = capacity
+        # (table name, page id) -> Page, least recently used first
+        self.frames = OrderedDict()
+        # (table name, page id) -> Page, loaded by scans and read-ahead, oldest first
+        self.scan_frames = OrderedDict()
+        # (table name, page id) -> LSN the log must be forced to before the page is written back
+        self.dirty = {}
+        # Redo log of the database, if any (see Log.flush)
+        self.log = None
+        # table name -> file descriptor
+        self.files = {}
+        self.lock = threading.RLock()
+        trace.register_lock(self, 'lock', 'bufferpool')
+        # (table name, column, thread id) -> [last position, run length, read-ahead issued up to], least
+        # recently used first. New streams are added under streams_lock.
+        self.streams = OrderedDict()
+        self.streams_lock = threading.Lock()
+        # (table name, page id) -> token of the pending read of the I/O thread. A page written back or
+        # freed meanwhile is dropped, so a read of a page id that was reused is never installed.
+        self.loading = {}
+        self.prefetch_queue = queue.Queue()
+        self.io_thread = None
+        # MemoryBudget of the database, if it has a memory limit
+        self.budget = None
+        # (table name, page id) -> bytes being written back without the lock: the latest contents of
+        # the page on disk once the write completes, which loads use meanwhile
+        self.writing = {}
+        # Held while pages are written without the lock, so files are not closed under the writes
+        self.io_lock = threading.Lock()
+        self.stopping = threading.Event()
+        # Set once more than FLUSH_DIRTY_RATIO of the capacity is dirty, wakes the flusher
+        self.flush_needed = threading.Event()
+        self.flusher = None
+        if path is not None:
+            self.flusher = threading.Thread(target=self._flush_worker, name='bufferpool flusher', daemon=True)
+            self.flusher.start()
+
+    def _file(self, table):
+        fd = self.files.get(table)
+        if fd is None:
+            fd = os.open(os.path.join(self.path, table + '.pages'), os.O_RDWR | os.O_CREAT, 0o644)
+            self.files[table] = fd
+        return fd
+
+    def _get(self, table, page_id, scan=False):
+        trace.page_accessed()
+        key = (table, page_id)
+        page = self.frames.get(key)
+        if page is not None:
+            if self.path is not None and not scan:
+                self.frames.move_to_end(key)
+            return page
+        page = self.scan_frames.get(key)
+        if page is not None:
+            if not scan:
+                del self.scan_frames[key]
+                self.frames[key] = page
+            return page
+        page = self._load(table, page_id)
+        self.loading.pop(key, None)
+        self._evict(1)
+        if scan:
+            self.scan_frames[key] = page
+        else:
+            self.frames[key] = page
+        return page
+
+    def _load(self, table, page_id):
+        page = Page()
+        data = self.writing.get((table, page_id))
+        if data is None:
+            with trace.span('page read', table=table, page=page_id):
+                data = os.pread(self._file(table), PAGE_SIZE, page_id * PAGE_SIZE)
+        page.data[:len(data)] = data
+        page.num_records = RECORDS_PER_PAGE
+        return page
+
+    """
+    # Evicts pages until incoming more pages fit. Pages are evicted before the new ones are added, so
+    # a page being read or written is never evicted under its caller.
+    """
+    def _evict(self, incoming=0):
+        if self.path is None:
+            return
+        while len(self.frames) + len(self.scan_frames) + incoming > self.capacity and (self.frames or self.scan_frames):
+            # Scan pages go first, but a read-ahead window of them is kept so they are not evicted before use
+            if len(self.scan_frames) > 2 * READ_AHEAD_PAGES or not self.frames:
+                key, page = self.scan_frames.popitem(last=False)
+            else:
+                key, page = self.frames.popitem(last=False)
+            if key in self.dirty:
+                self._write_back(key, page)
+
+    """
+    # LSN of the last record appended to the log: records are appended before the writes they
+    # describe, so it covers every write made to a page so far
+    """
+    def _lsn(self):
+        return self.log.next_lsn - 1 if self.log is not None else 0
+
+    def _write_back(self, key, page):
+        table, page_id = key
+        if self.log is not None:
+            self.log.flush(self.dirty[key])
+        with trace.span('page write', table=table, page=page_id):
+            os.pwrite(self._file(table), page.data, page_id * PAGE_SIZE)
+        if key in self.writing:
+            # The flusher's copy is older, it writes this one again once done
+            self.writing[key] = bytes(page.data)
+        del self.dirty[key]
+        self.loading.pop(key, None)
+
+    """
+    # Wakes the flusher if too many pages are dirty. Called under the lock after pages were dirtied.
+    """
+    def _dirtied(self):
+        if len(self.dirty) > self.capacity * FLUSH_DIRTY_RATIO and self.flusher is not None and not self.flush_needed.is_set():
+            self.flush_needed.set()
+
+    """
+    # Sets the number of pages cached, evicting pages right away if there are more
+    """
+    def resize(self, capacity):
+        with self.lock:
+            self.capacity = capacity
+            self._evict()
+            self._dirtied()
+
+    """
+    # Tells the memory budget, if any, that memory use outside of the pool grew
+    """
+    def signal_pressure(self):
+        if self.budget is not None:
+            self.budget.signal()
+
+    def read(self, table, page_id, slot, scan=False):
+        with self.lock:
+            return self._get(table, page_id, scan).read(slot)
+
+    def read_page(self, table, page_id, scan=False):
+        with self.lock:
+            return self._get(table, page_id, scan).read_all()
+
+    """
+    # Returns a read-only memoryview of the page's slots (see Page.view). The view stays valid after
+    # the page is evicted, it then no longer sees writes to the page.
+    """
+    def view_page(self, table, page_id, scan=False):
+        with self.lock:
+            return self._get(table, page_id, scan).view()
+
+    def write(self, table, page_id, slot, value):
+        with self.lock:
+            self._get(table, page_id).update(slot, value)
+            self.dirty[(table, page_id)] = self._lsn()
+            self._dirtied()
+
+    """
+    # Writes values[i] to slot of page page_ids[i] of table, taking the lock once for the whole record
+    """
+    def write_row(self, table, page_ids, slot, values):
+        with self.lock:
+            lsn = self._lsn()
+            for page_id, value in zip(page_ids, values):
+                self._get(table, page_id).update(slot, value)
+                self.dirty[(table, page_id)] = lsn
+            self._dirtied()
+
+    """
+    # Registers a freshly built page, overwriting whatever the file held at that id
+    """
+    def add_page(self, table, page_id, page):
+        with self.lock:
+            key = (table, page_id)
+            self.scan_frames.pop(key, None)
+            self.frames.pop(key, None)
+            self.loading.pop(key, None)
+            self._evict(1)
+            self.frames[key] = page
+            self.dirty[key] = self._lsn()
+            self._dirtied()
+
+    """
+    # Drops a page without writing it back
+    """
+    def free_page(self, table, page_id):
+        with self.lock:
+            key = (table, page_id)
+            self.frames.pop(key, None)
+            self.scan_frames.pop(key, None)
+            self.dirty.pop(key, None)
+            self.loading.pop(key, None)
+
+    """
+    # Tells the pool that a thread read the page at position (in scan order) of a table's column.
+    # Once SEQUENTIAL_TRIGGER consecutive positions were read, the next READ_AHEAD_PAGES pages of the
+    # column are handed to the I/O thread.
+    # :param table: Table     #Must provide upcoming_pages(column, position, count)
+    # Returns True if the access is part of a sequential scan
+    """
+    def note_access(self, table, column, position):
+        if self.path is None:
+            return False
+        stream = (table.name, column, threading.get_ident())
+        state = self.streams.get(stream)
+        if state is None:
+            with self.streams_lock:
+                self.streams[stream] = [position, 1, position]
+                while len(self.streams) > READ_AHEAD_STREAMS:
+                    self.streams.popitem(last=False)
+            return False
+        try:
+            self.streams.move_to_end(stream)
+        except KeyError:
+            # Forgotten by another thread meanwhile
+            pass
+        if position == state[0]:
+            return state[1] >= SEQUENTIAL_TRIGGER
+        if position == state[0] + 1:
+            state[1] += 1
+        else:
+            state[1] = 1
+            state[2] = position
+        state[0] = position
+        if state[1] < SEQUENTIAL_TRIGGER:
+            return False
+        # Keep at least half a window of pages in flight ahead of the reader
+        if state[2] < position + READ_AHEAD_PAGES // 2:
+            start = max(state[2], position)
+            state[2] = position + READ_AHEAD_PAGES
+            self.prefetch(table.name, table.upcoming_pages(column, start, state[2] - start))
+        return True
+
+    """
+    # Queues pages to be loaded into the scan segment by the I/O thread
+    """
+    def prefetch(self, table, page_ids):
+        if self.path is None or not page_ids:
+            return
+        with self.lock:
+            keys = []
+            for page_id in page_ids:
+                key = (table, page_id)
+                # Pages being written back are not read ahead, the file may still hold older contents
+                if key not in self.frames and key not in self.scan_frames and key not in self.loading and key not in self.writing:
+                    token = object()
+                    self.loading[key] = token
+                    keys.append((key, token))
+            if not keys:
+                return
+            if self.io_thread is None:
+                self.io_thread = threading.Thread(target=self._io_worker, daemon=True)
+                self.io_thread.start()
+        self.prefetch_queue.put(keys)
+
+    def _io_worker(self):
+        while True:
+            keys = self.prefetch_queue.get()
+            if keys is None:
+                return
+            for key, token in keys:
+                with self.lock:
+                    if self.loading.get(key) is not token:
+                        continue
+                    fd = self._file(key[0])
+                # The read itself runs without the lock so queries keep going
+                try:
+                    with trace.span('page read ahead', table=key[0], page=key[1]):
+                        data = os.pread(fd, PAGE_SIZE, key[1] * PAGE_SIZE)
+                except OSError:
+                    # The table was dropped meanwhile
+                    continue
+                with self.lock:
+                    # Skip pages loaded, rewritten or freed while they were being read
+                    if self.loading.get(key) is not token:
+                        continue
+                    del self.loading[key]
+                    page = Page()
+                    page.data[:len(data)] = data
+                    page.num_records = RECORDS_PER_PAGE
+                    self._evict(1)
+                    self.scan_frames[key] = page
+
+    """
+    # Writes the given pages back if they are dirty. They are copied and marked clean under the lock,
+    # then written without it in runs of contiguous pages, once the log is forced past all of them.
+    """
+    def _write_pages(self, keys):
+        with self.io_lock:
+            with self.lock:
+                batch = []
+                lsn = 0
+                for key in sorted(keys):
+                    page = self.frames.get(key) or self.scan_frames.get(key)
+                    if page is None or key not in self.dirty:
+                        continue
+                    data = bytes(page.data)
+                    self.writing[key] = data
+                    lsn = max(lsn, self.dirty.pop(key))
+                    self.loading.pop(key, None)
+                    batch.append((key, data))
+                files = {table: self._file(table) for table in {key[0] for key, _ in batch}}
+            if self.log is not None and batch:
+                self.log.flush(lsn)
+            start = 0
+            while start < len(batch):
+                (table, first), _ = batch[start]
+                end = start + 1
+                while end < len(batch) and end - start < FLUSH_RUN_PAGES and batch[end][0] == (table, first + end - start):
+                    end += 1
+                with trace.span('page write run', table=table, page=first, pages=end - start):
+                    _write_run(files[table], first * PAGE_SIZE, [data for _, data in batch[start:end]])
+                start = end
+            with self.lock:
+                for key, data in batch:
+                    latest = self.writing.pop(key)
+                    if latest is not data:
+                        os.pwrite(files[key[0]], latest, key[1] * PAGE_SIZE)
+
+    """
+    # Runs on the flusher thread: once woken, writes the coldest dirty pages back until few enough are
+    # dirty
+    """
+    def _flush_worker(self):
+        while True:
+            self.flush_needed.wait()
+            if self.stopping.is_set():
+                return
+            with self.lock:
+                dirty = len(self.dirty)
+                if dirty <= self.capacity * FLUSH_DIRTY_RATIO:
+                    # Sleep until a write dirties too many pages again
+                    self.flush_needed.clear()
+                    continue
+                wanted = min(FLUSH_BATCH_PAGES, dirty - int(self.capacity * FLUSH_DIRTY_RATIO / 2))
+                keys = []
+                for frames in (self.scan_frames, self.frames):
+                    for key in frames:
+                        if key in self.dirty:
+                            keys.append(key)
+                            if len(keys) == wanted:
+                                break
+                    if len(keys) == wanted:
+                        break
+            with trace.span('background flush', pages=len(keys)):
+                self._write_pages(keys)
+            # While pages keep being dirtied, rounds are paced by the interval rather than by writes, so
+            # a burst of misses does not keep the flusher competing with queries for the lock and the GIL
+            if self.stopping.wait(FLUSH_INTERVAL):
+                return
+
+    """
+    # Writes back the dirty pages of one table (or of every table when table is None)
+    """
+    def flush(self, table=None):
+        if self.path is None:
+            return
+        with self.lock:
+            keys = [key for key in self.dirty if table is None or key[0] == table]
+        self._write_pages(keys)
+        with self.lock:
+            for name, fd in self.files.items():
+                if table is None or name == table:
+                    os.fsync(fd)
+
+    """
+    # Forgets every page of a table and removes its file
+    """
+    def drop_table(self, table):
+        with self.io_lock, self.lock:
+            for frames in (self.frames, self.scan_frames):
+                for key in [key for key in frames if key[0] == table]:
+                    del frames[key]
+                    self.dirty.pop(key, None)
+            self.loading = {key: token for key, token in self.loading.items() if key[0] != table}
+            fd = self.files.pop(table, None)
+            if fd is not None:
+                os.close(fd)
+            if self.path is not None:
+                try:
+                    os.remove(os.path.join(self.path, table + '.pages'))
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        if self.flusher is not None:
+            self.stopping.set()
+            self.flush_needed.set()
+            self.flusher.join()
+            self.flusher = None
+        if self.io_thread is not None:
+            self.prefetch_queue.put(None)
+            self.io_thread.join()
+            self.io_thread = None
+        self.flush()
+        with self.lock:
+            for fd in self.files.values():
+                os.close(fd)
+            self.files = {}
+            self.frames.clear()
+            self.scan_frames.clear()
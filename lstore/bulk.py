@@ -0,0 +1,177 @@
+"""
+Streaming bulk import and export of tables, as CSV (one record per line, comma separated) or in a
+simple columnar binary format: MAGIC and the number of columns as a little-endian 64-bit integer,
+followed by blocks, each holding a record count and then, column after column, that many little-endian
+signed 64-bit values.
+Data moves one chunk (or one page range) at a time, so memory use does not depend on the size of the
+file or of the table. Imports write whole base pages through Table.insert_columns and exports read
+whole pages through Table.live_columns; neither creates a Record per row. Large CSV files are parsed
+by a pool of worker processes.
+Records whose key is already in the table are skipped. Imports and exports are not part of
+transactions.
+"""
+import collections
+import multiprocessing
+import os
+import struct
+import sys
+from array import array
+
+from lstore.config import BULK_CSV_CHUNK_BYTES, BULK_PARALLEL_BYTES, PROCESS_START_METHOD
+from lstore.shard import ShardedTable
+
+MAGIC = b'LSTORE\x00\x01'
+COUNT = struct.Struct('<q')
+
+
+"""
+# Inserts columnar data into a table or, for a sharded table, into the shards owning each key
+"""
+def _insert(table, columns):
+    if not isinstance(table, ShardedTable):
+        return table.insert_columns(columns)
+    parts = {}
+    for row, key in enumerate(columns[table.key]):
+        parts.setdefault(table.shard_of(key), []).append(row)
+    inserted = 0
+    for shard, rows in parts.items():
+        part = [array('q', (values[row] for row in rows)) for values in columns]
+        result = table.call(shard, 'table', 'insert_columns', part)
+        inserted += result or 0
+    return inserted
+
+
+"""
+# Yields the latest values of the live records of a table, as one array per column, page range by
+# page range
+"""
+def _chunks(table):
+    if isinstance(table, ShardedTable):
+        sources = [lambda index, shard=shard: table.call(shard, 'table', 'live_columns', index) for shard in range(len(table.shards))]
+    else:
+        sources = [table.live_columns]
+    for source in sources:
+        range_index = 0
+        while True:
+            columns = source(range_index)
+            if not columns:
+                break
+            yield columns
+            range_index += 1
+
+
+"""
+# Parses the lines of a CSV file starting in [start, end) into one array per column
+"""
+def _parse_csv(path, start, end, num_columns):
+    columns = [array('q') for _ in range(num_columns)]
+    with open(path, 'rb') as file:
+        if start:
+            # Skip the end of the line the previous chunk parsed
+            file.seek(start - 1)
+            file.readline()
+        position = file.tell()
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            fields = line.split(b',')
+            if len(fields) < num_columns:
+                # Blank line
+                continue
+            for values, field in zip(columns, fields):
+                values.append(int(field))
+    return columns
+
+
+"""
+# Imports a CSV file into table and returns the number of records inserted
+# :param header: bool     #Skip the first line
+# :param workers: int     #Processes parsing the file (all cores if None; files under
+#                         #BULK_PARALLEL_BYTES are parsed in the calling process)
+"""
+def import_csv(table, path, header=False, workers=None):
+    size = os.path.getsize(path)
+    first = 0
+    if header:
+        with open(path, 'rb') as file:
+            first = len(file.readline())
+    bounds = [(start, min(start + BULK_CSV_CHUNK_BYTES, size)) for start in range(first, size, BULK_CSV_CHUNK_BYTES)]
+    workers = workers or os.cpu_count() or 1
+    inserted = 0
+    if size < BULK_PARALLEL_BYTES or workers < 2:
+        for start, end in bounds:
+            inserted += _insert(table, _parse_csv(path, start, end, table.num_columns))
+        return inserted
+    with multiprocessing.get_context(PROCESS_START_METHOD).Pool(workers) as pool:
+        # At most two chunks per worker are parsed ahead of the inserts, which bounds memory use
+        pending = collections.deque()
+        for start, end in bounds:
+            pending.append(pool.apply_async(_parse_csv, (path, start, end, table.num_columns)))
+            if len(pending) >= 2 * workers:
+                inserted += _insert(table, pending.popleft().get())
+        while pending:
+            inserted += _insert(table, pending.popleft().get())
+    return inserted
+
+
+"""
+# Exports the latest version of every record of table to a CSV file and returns the number of records
+# :param header: bool     #Start with a line naming the columns (column0, column1, ...)
+"""
+def export_csv(table, path, header=False):
+    exported = 0
+    with open(path, 'w') as file:
+        if header:
+            file.write(','.join('column%d' % column for column in range(table.num_columns)) + '\n')
+        for columns in _chunks(table):
+            file.write(''.join(','.join(map(str, row)) + '\n' for row in zip(*columns)))
+            exported += len(columns[0])
+    return exported
+
+
+"""
+# Imports a file in the columnar binary format into table and returns the number of records inserted
+"""
+def import_binary(table, path):
+    inserted = 0
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a columnar table file' % path)
+        num_columns = COUNT.unpack(file.read(COUNT.size))[0]
+        if num_columns != table.num_columns:
+            raise ValueError('%s holds %d columns, the table has %d' % (path, num_columns, table.num_columns))
+        while True:
+            block = file.read(COUNT.size)
+            if not block:
+                break
+            count = COUNT.unpack(block)[0]
+            columns = []
+            for _ in range(num_columns):
+                values = array('q')
+                values.frombytes(file.read(count * 8))
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                columns.append(values)
+            inserted += _insert(table, columns)
+    return inserted
+
+
+"""
+# Exports the latest version of every record of table in the columnar binary format, one block per
+# page range, and returns the number of records
+"""
+def export_binary(table, path):
+    exported = 0
+    with open(path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(COUNT.pack(table.num_columns))
+        for columns in _chunks(table):
+            file.write(COUNT.pack(len(columns[0])))
+            for values in columns:
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                file.write(values.tobytes())
+            exported += len(columns[0])
+    return exported
@@ -0,0 +1,124 @@
+"""
+Tunable constants shared by the storage engine.
+"""
+
+# Every value is stored as a signed 64-bit integer
+PAGE_SIZE = 4096
+RECORD_SIZE = 8
+RECORDS_PER_PAGE = PAGE_SIZE // RECORD_SIZE
+
+# A page range holds this many base pages (per column) plus the tail pages for their updates
+BASE_PAGES_PER_RANGE = 16
+RANGE_CAPACITY = BASE_PAGES_PER_RANGE * RECORDS_PER_PAGE
+
+# Number of tail records + deletes in a page range before it is handed to the merge thread
+MERGE_THRESHOLD = 1024
+
+# Tail pages of a range are compacted once this fraction of its tail records belong to deleted records
+TAIL_COMPACTION_RATIO = 0.25
+
+# Fan-out of the B+ tree nodes used by the indexes
+INDEX_ORDER = 64
+
+# Pages cached by the bufferpool of a database opened on disk
+BUFFERPOOL_SIZE = 4096
+
+# A checkpoint is taken after this many log records, or every CHECKPOINT_INTERVAL seconds
+CHECKPOINT_LOG_RECORDS = 100000
+CHECKPOINT_INTERVAL = 60
+
+# Records written to a deferred secondary index before they are merged into its tree (or a quarter of
+# the tree's size if larger)
+INDEX_DELTA_BATCH = 4096
+
+# Pages of an index image written per hold of the table lock (see Index.write_images)
+INDEX_IMAGE_CHUNK_PAGES = 16
+
+# Adaptive indexing: a secondary index is built in the background once lookups on a column without
+# one scanned AUTO_INDEX_SCAN_ROWS rows, and an index built that way is dropped again once
+# AUTO_INDEX_DROP_WRITES updates of the column had to maintain it without a lookup reading it
+AUTO_INDEX = True
+AUTO_INDEX_SCAN_ROWS = 1000000
+AUTO_INDEX_DROP_WRITES = 100000
+
+# Bloom filters of indexed columns: bits per value, hash functions per value (about 1% false positives
+# when full), values the smallest filter is sized for, and false positive rate past which a filter is
+# rebuilt from the column
+BLOOM_BITS_PER_VALUE = 10
+BLOOM_HASHES = 7
+BLOOM_MIN_CAPACITY = 1024
+BLOOM_REBUILD_RATE = 0.02
+
+# Read-ahead: after SEQUENTIAL_TRIGGER consecutive pages of a column are read in order, the next
+# READ_AHEAD_PAGES pages of that column are loaded by the bufferpool's I/O thread. Accesses are tracked
+# per (table, column, thread); the least recently used of these streams are forgotten beyond
+# READ_AHEAD_STREAMS, so threads that come and go do not pile up.
+SEQUENTIAL_TRIGGER = 2
+READ_AHEAD_PAGES = 8
+READ_AHEAD_STREAMS = 256
+
+# Background flusher: once more than FLUSH_DIRTY_RATIO of the bufferpool's capacity is dirty, the
+# coldest dirty pages are written back (at most FLUSH_BATCH_PAGES per round) until half of that is.
+# It sleeps until a write crosses that ratio, then runs rounds FLUSH_INTERVAL seconds apart while it
+# holds. Contiguous pages go out in vectored writes of up to FLUSH_RUN_PAGES pages.
+FLUSH_DIRTY_RATIO = 0.25
+FLUSH_INTERVAL = 0.01
+FLUSH_BATCH_PAGES = 1024
+FLUSH_RUN_PAGES = 64
+
+# A transaction aborted by a lock conflict is retried after a random delay of up to RETRY_BACKOFF
+# seconds, doubling on every further abort up to MAX_RETRY_BACKOFF
+RETRY_BACKOFF = 0.001
+MAX_RETRY_BACKOFF = 0.05
+
+# Number of independently latched shards of each table's lock table
+LOCK_SHARDS = 16
+
+# Records Query.select_range reads per table lock acquisition
+SELECT_RANGE_BATCH = 256
+
+# Query planner (see lstore/planner.py): column statistics are sampled from up to STATS_SAMPLE_RANGES
+# page ranges into histograms of STATS_BUCKETS buckets, and sampled again once the table changed by
+# STATS_REFRESH_RATIO of its size (and at least STATS_REFRESH_ROWS records)
+STATS_SAMPLE_RANGES = 4
+STATS_BUCKETS = 32
+STATS_REFRESH_RATIO = 0.2
+STATS_REFRESH_ROWS = 1000
+
+# Estimated costs in microseconds: of an index probe, of reading a record found through an index plus
+# each of its columns, and of passing over one column of a record in a page scan (without and with
+# NumPy)
+PLAN_PROBE_COST = 5.0
+PLAN_FETCH_COST = 4.0
+PLAN_COLUMN_COST = 2.0
+PLAN_SCAN_COST = 0.1
+PLAN_SCAN_COST_NUMPY = 0.01
+
+# Bytes of CSV parsed per chunk by bulk imports (see lstore/bulk.py); chunks are parsed by a process
+# pool above BULK_PARALLEL_BYTES
+BULK_CSV_CHUNK_BYTES = 1 << 22
+BULK_PARALLEL_BYTES = 1 << 24
+
+# Shared memory snapshots (see lstore/shared.py): the table's merge thread publishes a new generation
+# at most once every SHARED_PUBLISH_INTERVAL seconds
+SHARED_PUBLISH_INTERVAL = 1.0
+
+# Start method of the processes lstore starts: shard processes and the worker pools of bulk imports
+# and shared snapshots. They are started while background threads (merges, flushes, checkpoints) may
+# hold locks, which a forked child would inherit held, so they come from a fork server instead. The
+# children import the caller's main module, whose code must then sit under if __name__ == '__main__'.
+PROCESS_START_METHOD = 'forkserver'
+
+# Spans kept by the tracer's ring buffer (see lstore/trace.py)
+TRACE_BUFFER_EVENTS = 100000
+
+# Memory budget of a database opened with a memory_limit (see lstore/memory.py): estimated bytes per
+# page directory entry, per index entry and per base record of a time-travel index (plus 8 per tail
+# record), bufferpool pages kept whatever the rest uses, seconds between periodic checks, and seconds
+# an index stays in memory after it was built or loaded before it may be evicted
+MEMORY_DIRECTORY_ENTRY = 180
+MEMORY_INDEX_ENTRY = 150
+MEMORY_VERSION_ENTRY = 190
+MEMORY_MIN_BUFFERPOOL_PAGES = 64
+MEMORY_CHECK_INTERVAL = 1.0
+MEMORY_INDEX_MIN_RESIDENCY = 10.0
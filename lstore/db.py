@@ -1,37 +1,318 @@
-from lstore.table import Table
+from lstore.table import Table, last_timestamp, observe_timestamp
+from lstore.index import index_file
+from lstore.shard import ShardedTable
+from lstore.bufferpool import BufferPool
+from lstore.log import Log
+from lstore.memory import MemoryBudget
+from lstore.config import CHECKPOINT_INTERVAL
+from lstore import bulk, trace
+import os
+import pickle
+import threading
+
+# Small file listing every table (name, num_columns, key, file locations), where the log starts and
+# the last timestamp handed out
+CATALOG_FILE = 'catalog'
 
 class Database:
     def __init__(self):
         # We use a dictionary to hold tables by name.
         self.tables = {}
+        # name -> catalog entry of every table in the database, loaded or not
+        self.catalog = {}
+        # name -> LSN of the last log record reflected in the loaded table
+        self.applied = {}
+        self.path = None
+        # In memory until open() is called
+        self.bufferpool = BufferPool()
+        self.log = None
+        # MemoryBudget when opened with a memory limit
+        self.budget = None
+        # Serializes checkpoints with each other and with create_table/drop_table
+        self.checkpoint_lock = threading.RLock()
+        self.checkpoint_event = threading.Event()
+        self.checkpoint_thread = None
+        self.closing = False
+
+    """
+    Opens (or creates) the database stored in path.
+    Only the catalog is read up front. A table's pages, page directory and indexes are loaded by
+    the first get_table() call for it, except for tables the log tail still has records for: those
+    are loaded here so the records can be replayed.
+    :param memory_limit: int    # Bytes the database may keep in memory, shared by its bufferpool,
+                                # indexes and caches (see lstore/memory.py); unbounded if None
+    """
+    def open(self, path, memory_limit=None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.bufferpool = BufferPool(path)
+        self.log = Log(path)
+        self.bufferpool.log = self.log
+        self.tables = {}
+        self.applied = {}
+        if memory_limit is not None:
+            self.budget = MemoryBudget(memory_limit, self.bufferpool, self.tables)
+            self.bufferpool.budget = self.budget
 
-    # Not required for milestone 1.
-    def open(self, path):
-        pass
+        catalog = self._read_file(CATALOG_FILE)
+        segment = 1
+        self.catalog = {}
+        if catalog is not None:
+            segment = catalog['segment']
+            self.log.next_lsn = catalog['lsn'] + 1
+            self.log.flushed_lsn = catalog['lsn']
+            self.catalog = catalog['tables']
+            # New versions must be newer than every recovered one, even if the clock went back
+            observe_timestamp(catalog.get('timestamp', 0))
+
+        # Tables loaded for the replay get their indexes once every record is applied
+        replayed = set()
+        for lsn, name, operation, args in self.log.read(segment):
+            if name is None:
+                # Catalog record: args[0] is the table name
+                name = args[0]
+                if name in self.catalog and lsn <= self.catalog[name]['lsn']:
+                    continue
+                if name in self.catalog or operation == 'drop':
+                    self._drop(name)
+                if operation == 'create':
+                    self._add_table(*args, lsn=lsn)
+                    if not self.catalog[name]['shard_bounds']:
+                        self.tables[name].replaying = True
+                        replayed.add(name)
+            elif name in self.catalog and lsn > self.catalog[name]['lsn']:
+                if name not in self.tables:
+                    self._load(name, build_indexes=False)
+                    self.tables[name].replaying = True
+                    replayed.add(name)
+                if lsn > self.applied[name]:
+                    self.tables[name].redo(operation, args)
+
+        for name in replayed:
+            if name in self.tables:
+                self.tables[name].end_replay()
+                self.tables[name].index.rebuild(self.catalog[name]['indexed'], self.catalog[name].get('deferred', []), self.catalog[name].get('auto', []), stored=True)
+
+        # Start from a fresh log segment so the next recovery never reads this log tail again
+        self.checkpoint()
+        self.closing = False
+        self.log.on_full = self.checkpoint_event.set
+        self.checkpoint_thread = threading.Thread(target=self._checkpoint_worker, daemon=True)
+        self.checkpoint_thread.start()
+        if self.budget is not None:
+            self.budget.rebalance()
 
     def close(self):
-        pass
+        for table in self.tables.values():
+            table.close()
+        if self.log is not None:
+            self.closing = True
+            self.checkpoint_event.set()
+            self.checkpoint_thread.join()
+            self.checkpoint()
+            if self.budget is not None:
+                self.budget.close()
+                self.budget = None
+            self.log.close()
+            self.bufferpool.close()
+            self.log = None
+
+    """
+    Takes a fuzzy checkpoint: queries keep running while it is taken.
+    Each loaded table is snapshotted under its own lock together with the LSN it reflects, its
+    changed indexes are written to images a page at a time (writes made meanwhile come after that
+    LSN, so recovery corrects their entries), its dirty pages are flushed and the snapshot is
+    written to the table's meta file. Tables that are not
+    loaded have not changed since their last snapshot. The catalog is written last; log segments
+    older than the checkpoint are then deleted.
+    """
+    def checkpoint(self):
+        if self.log is None:
+            return
+        with self.checkpoint_lock, trace.span('checkpoint'):
+            segment = self.log.rotate()
+            for name, table in list(self.tables.items()):
+                if isinstance(table, ShardedTable):
+                    # Every shard process checkpoints its own database
+                    continue
+                # A merge would free pages the snapshot still points to
+                with table.merge_lock:
+                    table.reclaim_pages()
+                    snapshot = table.snapshot()
+                    snapshot['index_file'] = table.index.write_images()
+                    self.bufferpool.flush(name)
+                    self.bufferpool.flush(table.index.file)
+                self._write_file(self.catalog[name]['meta'], snapshot)
+                # Pages this snapshot no longer points to can now be reused
+                table.recycle(snapshot['free_pages'])
+                self.catalog[name]['lsn'] = snapshot['lsn']
+                self.catalog[name]['indexed'] = snapshot['indexed']
+                self.catalog[name]['deferred'] = snapshot['deferred']
+                self.catalog[name]['auto'] = snapshot['auto']
+            self._write_file(CATALOG_FILE, {'segment': segment, 'lsn': self.log.last_lsn(), 'timestamp': last_timestamp(), 'tables': self.catalog})
+            self.log.truncate(segment)
+
+    def _read_file(self, name):
+        try:
+            with open(os.path.join(self.path, name), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    """
+    Writes data to a file atomically (write a temporary file, then rename it)
+    """
+    def _write_file(self, name, data):
+        temp = os.path.join(self.path, name + '.tmp')
+        with open(temp, 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, os.path.join(self.path, name))
+
+    """
+    Loads a table listed in the catalog from its meta file
+    """
+    def _load(self, name, build_indexes=True):
+        entry = self.catalog[name]
+        if entry['shard_bounds']:
+            table = ShardedTable(name, entry['num_columns'], entry['key'], entry['shard_bounds'], self.path, entry.get('cumulative', True), self._shard_limit(entry['shard_bounds']))
+            self.tables[name] = table
+            return table
+        snapshot = self._read_file(entry['meta'])
+        if snapshot is None:
+            # Created after the last checkpoint: everything is in the log
+            table = Table(name, entry['num_columns'], entry['key'], self.bufferpool, self.log, entry.get('cumulative', True))
+            self.applied[name] = entry['lsn']
+        else:
+            table = Table.restore(snapshot, self.bufferpool, self.log)
+            self.applied[name] = snapshot['lsn']
+        if build_indexes:
+            table.index.rebuild(entry['indexed'], entry.get('deferred', []), entry.get('auto', []), stored=True)
+        self.tables[name] = table
+        return table
+
+    def _add_table(self, name, num_columns, key_index, shard_bounds=None, cumulative=True, lsn=0):
+        self.catalog[name] = {
+            'num_columns': num_columns,
+            'key': key_index,
+            'pages': name + '.pages',
+            'meta': name + '.meta',
+            'indexed': [],
+            'deferred': [],
+            'auto': [],
+            'shard_bounds': shard_bounds,
+            'cumulative': cumulative,
+            'lsn': lsn,
+        }
+        if shard_bounds:
+            table = ShardedTable(name, num_columns, key_index, shard_bounds, self.path, cumulative, self._shard_limit(shard_bounds))
+        else:
+            table = Table(name, num_columns, key_index, self.bufferpool, self.log, cumulative)
+        self.tables[name] = table
+        self.applied[name] = lsn
+        return table
+
+    """
+    Returns the memory limit of each shard process of a sharded table, None without a memory limit
+    """
+    def _shard_limit(self, shard_bounds):
+        if self.budget is None:
+            return None
+        return self.budget.shard_limit(len(shard_bounds) + 1)
+
+    def _checkpoint_worker(self):
+        while True:
+            self.checkpoint_event.wait(CHECKPOINT_INTERVAL)
+            self.checkpoint_event.clear()
+            if self.closing:
+                return
+            if self.log.records_since_checkpoint:
+                self.checkpoint()
 
     """
     Creates a new table.
     :param name: string         # Table name
     :param num_columns: int     # Number of columns (user columns)
     :param key_index: int       # Index of table key in columns
+    :param shard_bounds: list   # Optional sorted primary keys splitting the table into
+                                # len(shard_bounds) + 1 shards, each served by its own process
+    :param cumulative: bool     # True (default) to copy every column updated since the last merge
+                                # into each tail record, making latest-version reads one hop; False
+                                # to only write the updated columns, saving tail space on
+                                # update-heavy tables
     """
-    def create_table(self, name, num_columns, key_index):
-        table = Table(name, num_columns, key_index)
-        self.tables[name] = table
-        return table
+    def create_table(self, name, num_columns, key_index, shard_bounds=None, cumulative=True):
+        if shard_bounds is not None and list(shard_bounds) != sorted(set(shard_bounds)):
+            raise ValueError('shard_bounds must be strictly increasing')
+        with self.checkpoint_lock:
+            self._drop(name)
+            lsn = 0
+            if self.log is not None:
+                lsn = self.log.append(None, 'create', name, num_columns, key_index, shard_bounds, cumulative)
+            return self._add_table(name, num_columns, key_index, shard_bounds, cumulative, lsn)
 
     """
     Deletes the specified table.
     """
     def drop_table(self, name):
-        if name in self.tables:
-            del self.tables[name]
+        with self.checkpoint_lock:
+            if name in self.catalog:
+                if self.log is not None:
+                    self.log.append(None, 'drop', name)
+                self._drop(name)
+
+    def _drop(self, name):
+        table = self.tables.pop(name, None)
+        if table is not None:
+            table.close()
+        self.applied.pop(name, None)
+        entry = self.catalog.pop(name, None)
+        if entry is not None and entry['shard_bounds']:
+            ShardedTable.remove_files(name, len(entry['shard_bounds']) + 1, self.path)
+        self.bufferpool.drop_table(name)
+        self.bufferpool.drop_table(index_file(name))
+        if entry is not None and self.path is not None:
+            try:
+                os.remove(os.path.join(self.path, entry['meta']))
+            except FileNotFoundError:
+                pass
 
     """
     Returns table with the passed name.
+    The table is loaded from disk the first time it is asked for.
     """
     def get_table(self, name):
-        return self.tables.get(name, None)
+        table = self.tables.get(name)
+        if table is not None or name not in self.catalog:
+            return table
+        with self.checkpoint_lock:
+            if name in self.tables:
+                return self.tables[name]
+            return self._load(name)
+
+    """
+    # Imports a CSV file or a columnar binary file (see lstore/bulk.py) into an existing table
+    # :param format: string     #'csv' or 'binary'
+    # :param header: bool       #The CSV file starts with a header line
+    # Returns the number of records inserted
+    """
+    def import_table(self, name, path, format='csv', header=False):
+        table = self.get_table(name)
+        if format == 'csv':
+            return bulk.import_csv(table, path, header)
+        if format == 'binary':
+            return bulk.import_binary(table, path)
+        raise ValueError('unknown format %r' % format)
+
+    """
+    # Exports the latest version of every record of a table to a CSV or columnar binary file
+    # Returns the number of records exported
+    """
+    def export_table(self, name, path, format='csv', header=False):
+        table = self.get_table(name)
+        if format == 'csv':
+            return bulk.export_csv(table, path, header)
+        if format == 'binary':
+            return bulk.export_binary(table, path)
+        raise ValueError('unknown format %r' % format)
@@ -0,0 +1,64 @@
+import threading
+from contextlib import contextmanager
+
+
+class EpochManager:
+
+    """
+    # Epoch-based reclamation of pages (or anything else) that readers may still be using.
+    # Readers pin the current epoch for the duration of a read; writers retire objects once they are
+    # unreachable for new readers, which starts a new epoch. Objects retired in an epoch are handed back
+    # by reclaim() once no reader pinned in that epoch or an older one is left.
+    # Pinning only stores the reader's epoch in a dict keyed by thread, so readers never take a lock.
+    """
+    def __init__(self):
+        self.epoch = 0
+        # thread id -> epoch the thread pinned, absent while the thread is not reading
+        self.active = {}
+        # (epoch, objects) retired in that epoch, oldest first
+        self.retired = []
+        # Serializes retire() and reclaim() with each other
+        self.lock = threading.Lock()
+
+    """
+    # Keeps every object retired from now on alive until the block exits. Pins nest.
+    """
+    @contextmanager
+    def pin(self):
+        ident = threading.get_ident()
+        if ident in self.active:
+            yield
+            return
+        self.active[ident] = self.epoch
+        try:
+            yield
+        finally:
+            del self.active[ident]
+
+    """
+    # Retires objects that new readers can no longer reach
+    """
+    def retire(self, objects):
+        with self.lock:
+            self.retired.append((self.epoch, list(objects)))
+            self.epoch += 1
+
+    """
+    # Returns the retired objects no pinned reader can still be using, and forgets them
+    """
+    def reclaim(self):
+        with self.lock:
+            # copy() is atomic, iterating the live dict is not while readers pin and unpin
+            pinned = self.active.copy().values()
+            oldest = min(pinned) if pinned else self.epoch
+            reclaimed = []
+            while self.retired and self.retired[0][0] < oldest:
+                reclaimed.extend(self.retired.pop(0)[1])
+            return reclaimed
+
+    """
+    # Returns every retired object not reclaimed yet
+    """
+    def pending(self):
+        with self.lock:
+            return [obj for _, objects in self.retired for obj in objects]
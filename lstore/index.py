@@ -1,38 +1,842 @@
 """
 A data strucutre holding indices for various columns of a table. Key column should be indexd by default, other columns can be indexed through this object. Indices are usually B-Trees, but other data structures can be used as well.
 """
+from array import array
+from bisect import bisect_left, bisect_right
+import heapq
+import sys
+import threading
+import time
+
+from lstore.bloom import BloomFilter
+from lstore.page import Page
+from lstore.config import INDEX_ORDER, INDEX_DELTA_BATCH, INDEX_IMAGE_CHUNK_PAGES, MEMORY_INDEX_ENTRY, PAGE_SIZE, RECORDS_PER_PAGE
+from lstore.config import AUTO_INDEX, AUTO_INDEX_SCAN_ROWS, AUTO_INDEX_DROP_WRITES, MEMORY_INDEX_MIN_RESIDENCY
+
+
+"""
+# Sorts (value, RID) pairs in place and returns them. The sort runs in the calling process: handing
+# the pairs to worker processes costs more in pickling than sorting them does.
+"""
+def sort_pairs(pairs):
+    pairs.sort()
+    return pairs
+
+
+# Value of a RID removed from a DeferredTree
+REMOVED = object()
+
+
+class Leaf:
+
+    def __init__(self):
+        self.keys = []
+        # values[i] is the list of RIDs holding keys[i]
+        self.values = []
+        self.next = None
+
+
+class Node:
+
+    def __init__(self):
+        self.keys = []
+        self.children = []
+
+
+class BPlusTree:
+
+    """
+    # B+ tree mapping a column value to the RIDs holding it.
+    # Leaves are chained so range scans walk them in key order.
+    # Removal is lazy: a key whose RID list empties is dropped from its leaf, but nodes are never merged.
+    """
+    def __init__(self, order=INDEX_ORDER):
+        self.order = order
+        self.root = Leaf()
+
+    """
+    # Returns the leaf that may hold key and the (node, child index) path leading to it
+    """
+    def _find_leaf(self, key):
+        node = self.root
+        path = []
+        while isinstance(node, Node):
+            i = bisect_right(node.keys, key)
+            path.append((node, i))
+            node = node.children[i]
+        return node, path
+
+    def get(self, key):
+        leaf, _ = self._find_leaf(key)
+        i = bisect_left(leaf.keys, key)
+        if i < len(leaf.keys) and leaf.keys[i] == key:
+            return leaf.values[i]
+        return []
+
+    def insert(self, key, rid):
+        leaf, path = self._find_leaf(key)
+        i = bisect_left(leaf.keys, key)
+        if i < len(leaf.keys) and leaf.keys[i] == key:
+            leaf.values[i].append(rid)
+            return
+        leaf.keys.insert(i, key)
+        leaf.values.insert(i, [rid])
+        if len(leaf.keys) > self.order:
+            self._split(leaf, path)
+
+    def remove(self, key, rid):
+        leaf, _ = self._find_leaf(key)
+        i = bisect_left(leaf.keys, key)
+        if i < len(leaf.keys) and leaf.keys[i] == key:
+            rids = leaf.values[i]
+            if rid in rids:
+                rids.remove(rid)
+            if not rids:
+                del leaf.keys[i]
+                del leaf.values[i]
+
+    """
+    # Yields (key, rids) for every key between begin and end (inclusive) in ascending order
+    """
+    def range(self, begin, end):
+        leaf, _ = self._find_leaf(begin)
+        i = bisect_left(leaf.keys, begin)
+        while leaf is not None:
+            while i < len(leaf.keys):
+                if leaf.keys[i] > end:
+                    return
+                yield leaf.keys[i], leaf.values[i]
+                i += 1
+            leaf = leaf.next
+            i = 0
+
+    """
+    # Yields (key, rids) for every key in ascending order
+    """
+    def range_all(self):
+        node = self.root
+        while isinstance(node, Node):
+            node = node.children[0]
+        while node is not None:
+            yield from zip(node.keys, node.values)
+            node = node.next
+
+    """
+    # Replaces the tree's content by building it bottom-up from (key, rid) pairs sorted by key:
+    # leaves are filled left to right, then each level of inner nodes is built over the one below.
+    """
+    def bulk_load(self, pairs):
+        leaf = Leaf()
+        leaves = [leaf]
+        for key, rid in pairs:
+            if leaf.keys and leaf.keys[-1] == key:
+                leaf.values[-1].append(rid)
+                continue
+            if len(leaf.keys) == self.order:
+                sibling = Leaf()
+                leaf.next = sibling
+                leaf = sibling
+                leaves.append(leaf)
+            leaf.keys.append(key)
+            leaf.values.append([rid])
+
+        # (node, smallest key under it)
+        level = [(leaf, leaf.keys[0] if leaf.keys else None) for leaf in leaves]
+        while len(level) > 1:
+            parents = []
+            for i in range(0, len(level), self.order + 1):
+                group = level[i:i + self.order + 1]
+                node = Node()
+                node.children = [child for child, _ in group]
+                node.keys = [low for _, low in group[1:]]
+                parents.append((node, group[0][1]))
+            level = parents
+        self.root = level[0][0]
+
+    def _split(self, node, path):
+        mid = len(node.keys) // 2
+        if isinstance(node, Leaf):
+            sibling = Leaf()
+            sibling.keys = node.keys[mid:]
+            sibling.values = node.values[mid:]
+            node.keys = node.keys[:mid]
+            node.values = node.values[:mid]
+            sibling.next = node.next
+            node.next = sibling
+            separator = sibling.keys[0]
+        else:
+            sibling = Node()
+            separator = node.keys[mid]
+            sibling.keys = node.keys[mid + 1:]
+            sibling.children = node.children[mid + 1:]
+            node.keys = node.keys[:mid]
+            node.children = node.children[:mid + 1]
+
+        if not path:
+            root = Node()
+            root.keys = [separator]
+            root.children = [node, sibling]
+            self.root = root
+            return
+        parent, i = path.pop()
+        parent.keys.insert(i, separator)
+        parent.children.insert(i + 1, sibling)
+        if len(parent.keys) > self.order:
+            self._split(parent, path)
+
+
+class DeferredTree:
+
+    """
+    # Index with the interface of BPlusTree whose writes are buffered in a delta log: the latest value
+    # of every RID written since the last merge. Tree entries of those RIDs are stale and skipped by
+    # lookups, which merge in the delta instead, so writes never touch the tree and removals need no
+    # old value (the key given to remove is ignored). Once the delta holds INDEX_DELTA_BATCH RIDs, or
+    # a quarter of the tree's size if larger, the tree is rebuilt from its live entries merged with
+    # the sorted delta, which keeps the amortized cost of a write constant.
+    """
+    def __init__(self, tree):
+        self.tree = tree
+        # RID -> latest value, or REMOVED, of records written since the last merge
+        self.moved = {}
+        # value -> RIDs of self.moved holding it
+        self.added = {}
+        # Size of the delta that triggers a merge
+        self.limit = max(INDEX_DELTA_BATCH, sum(len(rids) for _, rids in tree.range_all()) // 4)
+
+    def get(self, key):
+        rids = [rid for rid in self.tree.get(key) if rid not in self.moved]
+        rids.extend(self.added.get(key, ()))
+        return rids
+
+    def insert(self, key, rid):
+        self._move(rid, key)
+
+    def remove(self, key, rid):
+        self._move(rid, REMOVED)
+
+    """
+    # Yields (key, rids) for every key between begin and end (inclusive) in ascending order
+    """
+    def range(self, begin, end):
+        added = sorted(key for key in self.added if begin <= key <= end)
+        i = 0
+        for key, rids in self.tree.range(begin, end):
+            while i < len(added) and added[i] < key:
+                yield added[i], list(self.added[added[i]])
+                i += 1
+            rids = [rid for rid in rids if rid not in self.moved]
+            if i < len(added) and added[i] == key:
+                rids.extend(self.added[key])
+                i += 1
+            if rids:
+                yield key, rids
+        for key in added[i:]:
+            yield key, list(self.added[key])
+
+    def range_all(self):
+        return self.range(-(1 << 63), (1 << 63) - 1)
+
+    """
+    # Rebuilds the tree from its live entries and the delta, merged in key order
+    """
+    def flush(self):
+        live = ((key, rid) for key, rids in self.tree.range_all() for rid in rids if rid not in self.moved)
+        delta = sorted((key, rid) for key, rids in self.added.items() for rid in rids)
+        tree = BPlusTree(self.tree.order)
+        tree.bulk_load(heapq.merge(live, delta))
+        self.tree = tree
+        self.limit = max(INDEX_DELTA_BATCH, sum(len(rids) for _, rids in tree.range_all()) // 4)
+        self.moved = {}
+        self.added = {}
+
+    def _move(self, rid, value):
+        old = self.moved.get(rid, REMOVED)
+        if old is not REMOVED:
+            rids = self.added[old]
+            rids.discard(rid)
+            if not rids:
+                del self.added[old]
+        self.moved[rid] = value
+        if value is not REMOVED:
+            self.added.setdefault(value, set()).add(rid)
+        if len(self.moved) >= self.limit:
+            self.flush()
+
+
+"""
+# Returns the name the bufferpool stores the index images of a table under
+"""
+def index_file(table_name):
+    return table_name + '.index'
+
 
 class Index:
 
     def __init__(self, table):
         # One index for each table. All our empty initially.
+        self.table = table
         self.indices = [None] *  table.num_columns
-        pass
+        # The key column is always indexed
+        self.indices[table.key] = BPlusTree()
+        # column -> BloomFilter of the values of each indexed column, checked before its index so
+        # lookups of missing values return without searching it
+        self.filters = {table.key: BloomFilter()}
+        # column -> filter being rebuilt by refresh_filters, which writes are added to as well
+        self.rebuilding = {}
+        # column -> list of (insert?, value, rid) writes made while its index is being built
+        self.building = {}
+        # Columns whose index defers its writes (see DeferredTree)
+        self.deferred = set()
+        # Columns whose index was evicted to stay within the memory budget (see evict), and those of
+        # them being rebuilt in the background
+        self.evicted = set()
+        self.reloading = set()
+        # column -> time.monotonic() of the last lookup in its index, and of when it was last built
+        # or loaded
+        self.used = {}
+        self.built = {}
+        # Adaptive indexing (see note_scan and review): whether it is on, the columns whose index it
+        # built, rows scanned by lookups on each column without an index, and lookups and updates of
+        # each secondary index since its last review
+        self.adaptive = AUTO_INDEX
+        self.auto = set()
+        self.scanned = {}
+        self.reads = {}
+        self.writes = {}
+        # Index images: checkpoints write the entries of each index, sorted, to the pages of
+        # <table>.index.pages through the bufferpool, so reopening the table loads them instead of
+        # scanning the column (see write_images). Pages of the file, the image of each column as
+        # (value page ids, RID page ids, number of entries), columns changed since their image was
+        # written, pages of replaced images, and those of them the last checkpoint no longer points to,
+        # free once it is written.
+        self.file = index_file(table.name)
+        self.num_pages = 0
+        self.free_pages = []
+        self.images = {}
+        self.dirty = set()
+        self.superseded = []
+        self.released = []
+        # column -> image of the indexes restored from a checkpoint but not loaded yet, which the first
+        # lookup or write loads, and the RIDs whose entries in these images are stale
+        self.stored = {}
+        self.replayed = set()
+
+    """
+    # Returns True if column is indexed: its index is built, being built, or evicted and rebuilt in
+    # the background after its next lookup
+    """
+    def has_index(self, column):
+        return self.indices[column] is not None or column in self.building or column in self.evicted or column in self.stored
+
+    """
+    # Returns True if removing a record from the index of column (or moving it to another value)
+    # needs the record's current value, which deferred indexes do not
+    """
+    def needs_old_value(self, column):
+        if column in self.building:
+            return True
+        return (self.indices[column] is not None or column in self.stored) and column not in self.deferred
 
     """
     # returns the location of all records with the given value on column "column"
+    # Returns None if the column is not indexed
     """
 
     def locate(self, column, value):
-        pass
+        tree = self.tree(column)
+        if tree is None:
+            return None
+        bloom = self.filters.get(column)
+        if bloom is not None and not bloom.might_contain(value):
+            return []
+        return list(tree.get(value))
 
     """
     # Returns the RIDs of all records with values in column "column" between "begin" and "end"
+    # Returns None if the column is not indexed
     """
 
     def locate_range(self, begin, end, column):
-        pass
+        tree = self.tree(column)
+        if tree is None:
+            return None
+        rids = []
+        for _, values in tree.range(begin, end):
+            rids.extend(values)
+        return rids
+
+    """
+    # Returns the index of column for a lookup, loading it first if it was stored
+    # Returns None if the column is not indexed, or if its index was evicted: rebuilding it takes a
+    # scan and a sort of the column, so the lookup scans instead and the index is rebuilt in the
+    # background
+    """
+
+    def tree(self, column):
+        tree = self.indices[column]
+        if tree is None and column in self.stored:
+            self._load(column)
+            tree = self.indices[column]
+        if tree is None and column in self.evicted:
+            self._reload(column)
+        if tree is not None:
+            self.used[column] = time.monotonic()
+            self.reads[column] = self.reads.get(column, 0) + 1
+        return tree
+
+    """
+    # Records that a lookup on column, which has no index, scanned rows records. Once lookups on it
+    # scanned AUTO_INDEX_SCAN_ROWS records, an index is built in the background.
+    """
+
+    def note_scan(self, column, rows):
+        if column in self.evicted:
+            self._reload(column)
+            return
+        if not self.adaptive or self.has_index(column):
+            return
+        scanned = self.scanned[column] = self.scanned.get(column, 0) + rows
+        if scanned < AUTO_INDEX_SCAN_ROWS:
+            return
+        del self.scanned[column]
+        self.auto.add(column)
+        threading.Thread(target=self.create_index, args=(column,), daemon=True).start()
+
+    """
+    # Rebuilds the evicted index of column in a background thread, unless it is already being rebuilt
+    """
+
+    def _reload(self, column):
+        with self.table.lock:
+            if column in self.reloading:
+                return
+            self.reloading.add(column)
+
+        def run():
+            try:
+                self.create_index(column)
+            finally:
+                with self.table.lock:
+                    self.reloading.discard(column)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    """
+    # Drops the indexes built by note_scan that updates had to maintain AUTO_INDEX_DROP_WRITES times
+    # since a lookup last read them. Called by the merge thread after each merge.
+    """
+
+    def review(self):
+        with self.table.lock:
+            for column in list(self.auto):
+                if self.reads.get(column):
+                    self.reads[column] = 0
+                    self.writes[column] = 0
+                elif self.writes.get(column, 0) >= AUTO_INDEX_DROP_WRITES and self.indices[column] is not None:
+                    self.drop_index(column)
+
+    """
+    # Adds a newly inserted record to every index. columns holds its full user column values.
+    """
+
+    def insert(self, columns, rid):
+        if self.stored:
+            self._load_stored()
+        for column, tree in enumerate(self.indices):
+            if tree is not None:
+                tree.insert(columns[column], rid)
+                self.dirty.add(column)
+        for column, bloom in self.filters.items():
+            bloom.add(columns[column])
+        for column, bloom in self.rebuilding.items():
+            bloom.add(columns[column])
+        for column, delta in self.building.items():
+            delta.append((True, columns[column], rid))
+
+    """
+    # Adds records inserted in bulk (see Table.insert_columns) to every index. columns holds the values
+    # of each user column, the records having consecutive RIDs from first_rid.
+    """
+
+    def insert_columns(self, columns, first_rid):
+        if self.stored:
+            self._load_stored()
+        rids = range(first_rid, first_rid + len(columns[0]))
+        for column, tree in enumerate(self.indices):
+            if tree is not None:
+                for value, rid in zip(columns[column], rids):
+                    tree.insert(value, rid)
+                self.dirty.add(column)
+        for column, bloom in list(self.filters.items()) + list(self.rebuilding.items()):
+            for value in columns[column]:
+                bloom.add(value)
+        for column, delta in self.building.items():
+            delta.extend((True, value, rid) for value, rid in zip(columns[column], rids))
+
+    """
+    # Removes a record from every index. columns maps each indexed column to the record's current value.
+    """
+
+    def remove(self, columns, rid):
+        if self.stored:
+            self._load_stored()
+        for column, tree in enumerate(self.indices):
+            if tree is not None:
+                tree.remove(columns[column], rid)
+                self.dirty.add(column)
+        for column, delta in self.building.items():
+            delta.append((False, columns[column], rid))
+
+    """
+    # Moves rid from old_value to new_value in the index of column (no-op if column is not indexed)
+    """
+
+    def update(self, column, old_value, new_value, rid):
+        if old_value == new_value:
+            return
+        if column in self.stored:
+            self._load(column)
+        if column in self.building:
+            self.building[column].append((False, old_value, rid))
+            self.building[column].append((True, new_value, rid))
+        tree = self.indices[column]
+        if tree is None:
+            return
+        self.writes[column] = self.writes.get(column, 0) + 1
+        self.dirty.add(column)
+        if column in self.filters:
+            self.filters[column].add(new_value)
+        if column in self.rebuilding:
+            self.rebuilding[column].add(new_value)
+        tree.remove(old_value, rid)
+        tree.insert(new_value, rid)
 
     """
     # optional: Create index on specific column
+    # The column is scanned in bulk and the tree is bulk-loaded from the sorted (value, RID) pairs.
+    # Queries keep running meanwhile: writes made during the build are logged in self.building and
+    # applied to the new tree before it is put in use.
+    # :param deferred: bool     #Buffer the index's writes and apply them in sorted batches, which makes
+    #                           #updates of the column cheaper (secondary indexes only)
+    """
+
+    def create_index(self, column_number, deferred=False):
+        with self.table.lock:
+            if self.has_index(column_number) and column_number not in self.evicted:
+                return
+            self.evicted.discard(column_number)
+            self.building[column_number] = []
+            if deferred and column_number != self.table.key:
+                self.deferred.add(column_number)
+
+        pairs = sort_pairs(self.table.scan_column(column_number))
+        tree = BPlusTree()
+        tree.bulk_load(pairs)
+        bloom = BloomFilter(2 * len(pairs))
+        previous = None
+        for value, _ in pairs:
+            if value != previous:
+                bloom.add(value)
+                previous = value
+        del pairs
+
+        with self.table.lock:
+            # The scan may or may not have seen each of these writes, so they are applied idempotently
+            for insert, value, rid in self.building.pop(column_number):
+                if not insert:
+                    tree.remove(value, rid)
+                elif rid not in tree.get(value):
+                    tree.insert(value, rid)
+                    bloom.add(value)
+            if column_number in self.deferred:
+                tree = DeferredTree(tree)
+            self.indices[column_number] = tree
+            self.filters[column_number] = bloom
+            self.used[column_number] = self.built[column_number] = time.monotonic()
+            self.dirty.add(column_number)
+        self.table.bufferpool.signal_pressure()
+
+    """
+    # Rebuilds the Bloom filters that became too full (see BloomFilter.needs_rebuild) from the
+    # table's pages. Called by the merge thread after each merge; queries keep running meanwhile.
+    """
+
+    def refresh_filters(self):
+        for column in list(self.filters):
+            with self.table.lock:
+                bloom = self.filters.get(column)
+                if bloom is None or column in self.rebuilding or not bloom.needs_rebuild():
+                    continue
+                # Records written from now on (including to ranges not created yet) are added as
+                # they are written, the others by the scan
+                fresh = self.rebuilding[column] = BloomFilter(2 * bloom.count)
+                num_ranges = len(self.table.page_ranges)
+            scanned = False
+            try:
+                for range_index in range(num_ranges):
+                    for value in {value for value, _ in self.table.scan_range(range_index, column)}:
+                        fresh.add(value)
+                scanned = True
+            finally:
+                with self.table.lock:
+                    del self.rebuilding[column]
+                    if scanned and self.filters.get(column) is bloom:
+                        self.filters[column] = fresh
+
+    """
+    # Rebuilds the key index and the given secondary indexes, deferring the writes of the deferred
+    # ones. auto lists the ones adaptive indexing built.
+    # :param stored: bool     #Restore indexes from the images of the checkpoint the table was restored
+    #                         #from (see restore_images). Entries of the records written by the log
+    #                         #records replayed since (Table.replayed) are corrected as each image is
+    #                         #loaded. Other indexes are rebuilt from the table's pages.
     """
 
-    def create_index(self, column_number):
-        pass
+    def rebuild(self, columns, deferred=(), auto=(), stored=False):
+        self.indices = [None] * self.table.num_columns
+        self.building = {}
+        self.filters = {}
+        self.deferred = set(deferred) & set(columns)
+        self.evicted = set()
+        self.auto = set(auto) & set(columns)
+        self.stored = {}
+        self.replayed = self.table.replayed
+        self.table.replayed = set()
+        columns = set(columns) | {self.table.key}
+        for column, image in list(self.images.items()):
+            if stored and column in columns:
+                self.stored[column] = image
+            else:
+                self._drop_image(column)
+        for column in columns:
+            if column not in self.stored:
+                self.create_index(column, column in self.deferred)
+        self.dirty = columns - set(self.stored)
 
     """
     # optional: Drop index of specific column
     """
 
     def drop_index(self, column_number):
-        pass
+        # The key index backs every primary key lookup and cannot be dropped
+        if column_number == self.table.key:
+            return
+        self.indices[column_number] = None
+        self.deferred.discard(column_number)
+        self.evicted.discard(column_number)
+        self.stored.pop(column_number, None)
+        self._drop_image(column_number)
+        self.auto.discard(column_number)
+        self.reads.pop(column_number, None)
+        self.writes.pop(column_number, None)
+        self.filters.pop(column_number, None)
+
+    """
+    # Frees the index of a secondary column to save memory. The column stays indexed: writes stop
+    # maintaining the index and the next lookup rebuilds it from the table in the background.
+    """
+
+    def evict(self, column_number):
+        with self.table.lock:
+            if column_number == self.table.key or self.indices[column_number] is None:
+                return
+            self.indices[column_number] = None
+            self.filters.pop(column_number, None)
+            self.evicted.add(column_number)
+            self._drop_image(column_number)
+
+    """
+    # Returns [(column, time of its last lookup)] of the built secondary indexes, which evict can free.
+    # Indexes built or loaded less than MEMORY_INDEX_MIN_RESIDENCY seconds ago are left out, so one
+    # rebuilt after its eviction is not evicted again before lookups get to use it.
+    """
+
+    def cold_indexes(self):
+        with self.table.lock:
+            resident = time.monotonic() - MEMORY_INDEX_MIN_RESIDENCY
+            return [(column, self.used.get(column, 0.0)) for column, tree in enumerate(self.indices)
+                    if tree is not None and column != self.table.key and self.built.get(column, 0.0) < resident]
+
+    """
+    # Returns an estimate of the bytes used by the indexes and Bloom filters of a table holding
+    # records records
+    """
+
+    def memory_usage(self, records):
+        usage = 0
+        for tree in self.indices:
+            if tree is not None:
+                usage += records * MEMORY_INDEX_ENTRY
+                if isinstance(tree, DeferredTree):
+                    usage += len(tree.moved) * MEMORY_INDEX_ENTRY
+        for bloom in list(self.filters.values()) + list(self.rebuilding.values()):
+            usage += sum(len(layer[0]) for layer in bloom.layers)
+        return usage
+
+    """
+    # Loads an index restored from a checkpoint from its image: the entries are read in key order,
+    # so the tree is bulk-loaded without scanning the column or sorting. Entries of the records the
+    # replayed log tail wrote are replaced by their current values.
+    """
+
+    def _load(self, column):
+        with self.table.lock:
+            image = self.stored.pop(column, None)
+            if image is None:
+                return
+            value_pages, rid_pages, count, filter_layers, filter_count = image
+            bufferpool = self.table.bufferpool
+            pairs = []
+            for value_page, rid_page in zip(value_pages, rid_pages):
+                n = min(count - len(pairs), RECORDS_PER_PAGE)
+                values = bufferpool.view_page(self.file, value_page, True)[:n]
+                rids = bufferpool.view_page(self.file, rid_page, True)[:n]
+                pairs.extend(zip(values, rids))
+            if self.replayed:
+                pairs = [pair for pair in pairs if pair[1] not in self.replayed]
+            tree = BPlusTree()
+            tree.bulk_load(pairs)
+            layers = []
+            for page_ids, bits, capacity, added, set_bits in filter_layers:
+                bit_array = bytearray()
+                for page_id in page_ids:
+                    data = bufferpool.view_page(self.file, page_id, True)
+                    if sys.byteorder == 'big':
+                        # The view holds the page's slots byte-swapped, the bit array needs its raw bytes
+                        data = array('q', data)
+                        data.byteswap()
+                    bit_array += memoryview(data).cast('B')
+                layers.append([bit_array[:(bits + 7) // 8], bits, capacity, added, set_bits])
+            bloom = BloomFilter.from_layers(layers, filter_count)
+            for value, rid in self.table.read_live(self.replayed, column):
+                tree.insert(value, rid)
+                bloom.add(value)
+            if not self.stored:
+                self.replayed = set()
+            if column in self.deferred:
+                tree = DeferredTree(tree)
+            self.indices[column] = tree
+            self.filters[column] = bloom
+            self.built[column] = time.monotonic()
+        self.table.bufferpool.signal_pressure()
+
+    def _load_stored(self):
+        for column in list(self.stored):
+            self._load(column)
+
+    def _allocate_page(self):
+        if self.free_pages:
+            return self.free_pages.pop()
+        self.num_pages += 1
+        return self.num_pages - 1
+
+    def _drop_image(self, column):
+        image = self.images.pop(column, None)
+        if image is not None:
+            self.superseded.extend(image[0])
+            self.superseded.extend(image[1])
+            for layer in image[3]:
+                self.superseded.extend(layer[0])
+
+    def _write_page(self, page):
+        page_id = self._allocate_page()
+        self.table.bufferpool.add_page(self.file, page_id, page)
+        return page_id
+
+    """
+    # Writes the indexes changed since the last checkpoint to the index file and returns what the
+    # table's snapshot records of the file. Called once the snapshot is taken: each image is written
+    # INDEX_IMAGE_CHUNK_PAGES pages at a time, each chunk under the table lock, so queries keep
+    # running. Entries written meanwhile may or may not be in the image, but their log records come
+    # after the snapshot's LSN, so they are corrected when the image is loaded (see _load). The
+    # caller flushes the file before the snapshot is written.
+    """
+
+    def write_images(self):
+        with self.table.lock:
+            for column, tree in enumerate(self.indices):
+                if tree is None and column not in self.stored:
+                    self._drop_image(column)
+            columns = [column for column, tree in enumerate(self.indices) if tree is not None and (column not in self.images or column in self.dirty)]
+            self.dirty = set()
+        for column in columns:
+            self._write_image(column)
+        with self.table.lock:
+            # The replaced images are free once this snapshot is written
+            self.released.extend(self.superseded)
+            self.superseded = []
+            return {'num_pages': self.num_pages, 'images': dict(self.images)}
+
+    def _write_image(self, column):
+        with self.table.lock:
+            tree = self.indices[column]
+        value_pages = []
+        rid_pages = []
+        values = array('q')
+        rids = array('q')
+        count = 0
+        last = None
+        while True:
+            with self.table.lock:
+                if tree is None or self.indices[column] is not tree:
+                    # Dropped, evicted or rebuilt meanwhile: the next checkpoint writes what replaced it
+                    self.superseded.extend(value_pages + rid_pages)
+                    return
+                done = True
+                for value, value_rids in tree.range(-(1 << 63) if last is None else last, (1 << 63) - 1):
+                    if value == last:
+                        continue
+                    values.extend([value] * len(value_rids))
+                    rids.extend(value_rids)
+                    last = value
+                    if len(values) >= INDEX_IMAGE_CHUNK_PAGES * RECORDS_PER_PAGE:
+                        done = False
+                        break
+                while len(values) >= RECORDS_PER_PAGE or (done and values):
+                    for pages, column_values in ((value_pages, values), (rid_pages, rids)):
+                        page = Page()
+                        page.fill(column_values[:RECORDS_PER_PAGE])
+                        pages.append(self._write_page(page))
+                    count += min(len(values), RECORDS_PER_PAGE)
+                    del values[:RECORDS_PER_PAGE]
+                    del rids[:RECORDS_PER_PAGE]
+                if not done:
+                    continue
+                # The column's Bloom filter is stored as well, its bit arrays split into pages
+                bloom = self.filters[column]
+                layers = []
+                for bit_array, bits, capacity, added, set_bits in bloom.layers:
+                    page_ids = []
+                    for start in range(0, len(bit_array), PAGE_SIZE):
+                        page = Page()
+                        page.data[:] = bit_array[start:start + PAGE_SIZE].ljust(PAGE_SIZE, b'\0')
+                        page_ids.append(self._write_page(page))
+                    layers.append((page_ids, bits, capacity, added, set_bits))
+                self._drop_image(column)
+                self.images[column] = (value_pages, rid_pages, count, layers, bloom.count)
+                return
+
+    """
+    # Called once a checkpoint is written: pages of the images it replaced can be reused
+    """
+
+    def release_images(self):
+        with self.table.lock:
+            self.free_pages.extend(self.released)
+            self.released = []
+
+    """
+    # Restores the state of the index file from a table's snapshot. Pages no image uses are free.
+    """
+
+    def restore_images(self, state):
+        self.num_pages = state['num_pages']
+        self.images = dict(state['images'])
+        used = set()
+        for value_pages, rid_pages, _, layers, _ in self.images.values():
+            used.update(value_pages)
+            used.update(rid_pages)
+            for layer in layers:
+                used.update(layer[0])
+        self.free_pages = [page_id for page_id in range(self.num_pages) if page_id not in used]
@@ -0,0 +1,140 @@
+import threading
+
+from lstore.config import LOCK_SHARDS
+from lstore import trace
+
+# Transaction running on each thread, set by Transaction.run
+_local = threading.local()
+
+
+"""
+# Returns the transaction running on the calling thread, or None outside of transactions
+"""
+def current_transaction():
+    return getattr(_local, 'transaction', None)
+
+
+def set_current_transaction(transaction):
+    _local.transaction = transaction
+
+
+"""
+# Orders the items of one table: RIDs first, then primary keys
+"""
+def item_order(item):
+    if isinstance(item, tuple):
+        return (1, item[1])
+    return (0, item)
+
+
+class LockShard:
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        # Notified whenever a lock of the shard is released
+        self.released = threading.Condition(self.mutex)
+        self.waiting = 0
+        # item -> [set of transactions holding a shared lock, transaction holding the exclusive lock]
+        self.locks = {}
+
+    """
+    # Grants the lock if it is compatible with the ones held, the mutex must be held
+    """
+    def grant(self, item, transaction, exclusive):
+        state = self.locks.get(item)
+        if state is None:
+            state = self.locks[item] = [set(), None]
+        shared, owner = state
+        if owner is not None:
+            return owner is transaction
+        if exclusive:
+            if shared and shared != {transaction}:
+                return False
+            shared.discard(transaction)
+            state[1] = transaction
+        else:
+            shared.add(transaction)
+        return True
+
+
+class LockManager:
+
+    """
+    # Shared/exclusive record locks of one table for strict two-phase locking.
+    # Queries lock with no-wait: a request that conflicts with a lock held by another transaction
+    # fails right away, so the requesting transaction aborts instead of risking a deadlock.
+    # Ordered transactions instead take their whole lock set up front with acquire_all, waiting for
+    # each lock in the canonical order (table name, shard, item); since every waiter follows that
+    # order and no-wait requests never wait, no cycle of waiting transactions can form.
+    # Items are base RIDs for existing records and ('key', value) for primary keys, which inserts
+    # and deletes lock so two transactions cannot both create (or remove and recreate) a key.
+    # The lock table is split in LOCK_SHARDS shards with their own mutex.
+    """
+    def __init__(self):
+        self.shards = [LockShard() for _ in range(LOCK_SHARDS)]
+
+    def shard_of(self, item):
+        return hash(item) % len(self.shards)
+
+    """
+    # Grants transaction a shared (or exclusive) lock on item. A shared lock held by the transaction
+    # alone is upgraded. Returns False if the lock is held by another transaction.
+    """
+    def acquire(self, item, transaction, exclusive=False):
+        shard = self.shards[self.shard_of(item)]
+        with shard.mutex:
+            return shard.grant(item, transaction, exclusive)
+
+    """
+    # Returns the (item, exclusive) requests sorted in the order acquire_all takes them
+    """
+    def canonical_order(self, requests):
+        return sorted(requests, key=lambda request: (self.shard_of(request[0]), item_order(request[0])))
+
+    """
+    # Grants transaction every (item, exclusive) lock of requests, waiting for locks held by other
+    # transactions. Shards are visited once each, in order, and the locks of a shard are taken in
+    # item order while holding its mutex.
+    """
+    def acquire_all(self, requests, transaction):
+        current = None
+        try:
+            for item, exclusive in self.canonical_order(requests):
+                shard = self.shards[self.shard_of(item)]
+                if shard is not current:
+                    if current is not None:
+                        current.mutex.release()
+                    shard.mutex.acquire()
+                    current = shard
+                if shard.grant(item, transaction, exclusive):
+                    continue
+                with trace.span('wait record lock', item=item, exclusive=exclusive):
+                    while not shard.grant(item, transaction, exclusive):
+                        shard.waiting += 1
+                        shard.released.wait()
+                        shard.waiting -= 1
+        finally:
+            if current is not None:
+                current.mutex.release()
+
+    """
+    # Releases every lock transaction holds on items
+    """
+    def release(self, items, transaction):
+        by_shard = {}
+        for item in items:
+            by_shard.setdefault(self.shard_of(item), []).append(item)
+        for index, shard_items in by_shard.items():
+            shard = self.shards[index]
+            with shard.mutex:
+                for item in shard_items:
+                    state = shard.locks.get(item)
+                    if state is None:
+                        continue
+                    state[0].discard(transaction)
+                    if state[1] is transaction:
+                        state[1] = None
+                    if not state[0] and state[1] is None:
+                        del shard.locks[item]
+                if shard.waiting:
+                    shard.released.notify_all()
@@ -0,0 +1,116 @@
+import os
+import pickle
+import threading
+
+from lstore.config import CHECKPOINT_LOG_RECORDS
+from lstore import trace
+
+
+class Log:
+
+    """
+    # Redo log shared by every table of a database.
+    # Records are (lsn, table name, operation, args) tuples pickled back to back into numbered
+    # segment files <path>/log.<segment>. A checkpoint rotates to a new segment and, once it is
+    # written, deletes the segments before it, so recovery only ever reads the log tail.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        trace.register_lock(self, 'lock', 'log')
+        segments = self.segments()
+        self.segment = segments[-1] if segments else 1
+        self.next_lsn = 1
+        # Every record up to this LSN is on disk
+        self.flushed_lsn = 0
+        self.records_since_checkpoint = 0
+        # Called (outside the log lock) once enough records were written to warrant a checkpoint
+        self.on_full = None
+        self.file = open(self._segment_path(self.segment), 'ab')
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, 'log.%08d' % segment)
+
+    def segments(self):
+        found = []
+        for name in os.listdir(self.path):
+            if name.startswith('log.'):
+                found.append(int(name[4:]))
+        return sorted(found)
+
+    """
+    # Appends a record and returns its LSN
+    """
+    def append(self, table, operation, *args):
+        with self.lock:
+            lsn = self.next_lsn
+            self.next_lsn += 1
+            pickle.dump((lsn, table, operation, args), self.file, pickle.HIGHEST_PROTOCOL)
+            self.records_since_checkpoint += 1
+            full = self.records_since_checkpoint == CHECKPOINT_LOG_RECORDS
+        if full and self.on_full is not None:
+            self.on_full()
+        return lsn
+
+    def last_lsn(self):
+        with self.lock:
+            return self.next_lsn - 1
+
+    """
+    # Forces the log to disk, or only up to lsn: nothing is written if that record already is
+    """
+    def flush(self, lsn=None):
+        if lsn is not None and lsn <= self.flushed_lsn:
+            return
+        with self.lock, trace.span('log flush'):
+            if lsn is not None and lsn <= self.flushed_lsn:
+                return
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.flushed_lsn = self.next_lsn - 1
+
+    """
+    # Starts a new segment and returns its number. Every record appended afterwards goes to it.
+    """
+    def rotate(self):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.flushed_lsn = self.next_lsn - 1
+            self.file.close()
+            self.segment += 1
+            self.file = open(self._segment_path(self.segment), 'ab')
+            self.records_since_checkpoint = 0
+            return self.segment
+
+    """
+    # Deletes every segment older than segment
+    """
+    def truncate(self, segment):
+        for old in self.segments():
+            if old < segment:
+                os.remove(self._segment_path(old))
+
+    """
+    # Yields every record from segment onwards in LSN order. A torn record at the end of the
+    # last segment (crash in the middle of a write) ends the log.
+    """
+    def read(self, segment):
+        for current in self.segments():
+            if current < segment:
+                continue
+            with open(self._segment_path(current), 'rb') as f:
+                while True:
+                    try:
+                        record = pickle.load(f)
+                    except (EOFError, ValueError, pickle.UnpicklingError):
+                        break
+                    self.next_lsn = max(self.next_lsn, record[0] + 1)
+                    self.flushed_lsn = self.next_lsn - 1
+                    yield record
+
+    def close(self):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
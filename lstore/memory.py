@@ -0,0 +1,94 @@
+import threading
+
+from lstore.config import PAGE_SIZE, MEMORY_MIN_BUFFERPOOL_PAGES, MEMORY_CHECK_INTERVAL
+from lstore.shard import ShardedTable
+from lstore import trace
+
+
+class MemoryBudget:
+
+    """
+    # Shares one memory limit (in bytes) among everything a database keeps in memory: the page
+    # directories, indexes, Bloom filters and time-travel version caches of its tables, and its
+    # bufferpool.
+    # Tables report estimates of what they use (see Table.memory_usage) and the bufferpool gets the
+    # rest, so it shrinks as indexes grow and grows back as they are evicted. Once the rest falls below
+    # MEMORY_MIN_BUFFERPOOL_PAGES, version caches are dropped first (they are rebuilt on demand), then
+    # the least recently used secondary indexes are evicted until it fits again, skipping those built
+    # less than MEMORY_INDEX_MIN_RESIDENCY seconds ago; an evicted index stays declared and is rebuilt
+    # in the background once a lookup needs it. Page directories and key indexes
+    # are never evicted, so a limit too small for them is exceeded rather than failing queries.
+    # Tables signal growth with signal(); the budget is rebalanced by its own thread, which also checks
+    # every MEMORY_CHECK_INTERVAL seconds.
+    # :param limit: int           #Bytes
+    # :param bufferpool: BufferPool
+    # :param tables: dict         #name -> Table of the database, read on every rebalance
+    """
+    def __init__(self, limit, bufferpool, tables):
+        self.limit = limit
+        self.bufferpool = bufferpool
+        self.tables = tables
+        self.lock = threading.Lock()
+        self.pressure = threading.Event()
+        self.closing = False
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    """
+    # Tells the budget that memory use grew
+    """
+    def signal(self):
+        self.pressure.set()
+
+    def _worker(self):
+        while True:
+            self.pressure.wait(MEMORY_CHECK_INTERVAL)
+            self.pressure.clear()
+            if self.closing:
+                return
+            self.rebalance()
+
+    def _used(self):
+        return sum(table.memory_usage() for table in list(self.tables.values()))
+
+    """
+    # Evicts caches and cold indexes if the bufferpool would get less than its minimum, then resizes
+    # the bufferpool to what is left. Returns the bytes used outside of the bufferpool.
+    """
+    def rebalance(self):
+        with self.lock, trace.span('memory rebalance') as span:
+            evicted = []
+            floor = MEMORY_MIN_BUFFERPOOL_PAGES * PAGE_SIZE
+            used = self._used()
+            if self.limit - used < floor:
+                for table in list(self.tables.values()):
+                    table.drop_caches()
+                used = self._used()
+            if self.limit - used < floor:
+                # Least recently used first, across every table
+                candidates = sorted((last_used, name, column) for name, table in list(self.tables.items()) for column, last_used in table.cold_indexes())
+                for _, name, column in candidates:
+                    if self.limit - used >= floor:
+                        break
+                    table = self.tables.get(name)
+                    if table is not None:
+                        table.index.evict(column)
+                        evicted.append((name, column))
+                        used = self._used()
+            pages = max(MEMORY_MIN_BUFFERPOOL_PAGES, (self.limit - used) // PAGE_SIZE)
+            self.bufferpool.resize(pages)
+            span.set(used=used, bufferpool_pages=pages, evicted=evicted)
+            return used
+
+    """
+    # Returns the limit of each shard process of a table split in num_shards shards. Together they
+    # get num_shards / (num_shards + 1) of what other sharded tables left over.
+    """
+    def shard_limit(self, num_shards):
+        reserved = sum(table.memory_usage() for table in list(self.tables.values()) if isinstance(table, ShardedTable))
+        return max(0, self.limit - reserved) // (num_shards + 1)
+
+    def close(self):
+        self.closing = True
+        self.pressure.set()
+        self.thread.join()
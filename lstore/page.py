@@ -1,29 +1,61 @@
-import pickle
+import struct
+import sys
+from array import array
+
+from lstore.config import PAGE_SIZE, RECORD_SIZE, RECORDS_PER_PAGE
+
+# Values are packed as little-endian signed 64-bit integers
+SLOT = struct.Struct('<q')
+ALL_SLOTS = struct.Struct('<%dq' % RECORDS_PER_PAGE)
 
 class Page:
 
     def __init__(self):
         self.num_records = 0
-        self.data = {}
+        self.data = bytearray(PAGE_SIZE)
 
     def has_capacity(self):
-        # Returns size of dictionary as bytes
-        return len(pickle.dumps(self.data))
+        return self.num_records < RECORDS_PER_PAGE
 
+    """
+    # Appends value to the next free slot
+    # Returns the slot the value was written to
+    """
     def write(self, value):
+        slot = self.num_records
+        SLOT.pack_into(self.data, slot * RECORD_SIZE, value)
         self.num_records += 1
-        
-        # Size of current bytes in page
-        size_data = self.has_capacity()
-        
-        # Size of value being inserted
-        size_value = len(pickle.dumps(value))
-
-        # 4096 Bytes is ideal
-        if(size_data + size_value) >= 4096:
-            # Make another page handled by table.py
-            return "Error Code???"
-        else:
-            self.data[len(self.data)+1] = value
-        pass
+        return slot
+
+    def read(self, slot):
+        return SLOT.unpack_from(self.data, slot * RECORD_SIZE)[0]
+
+    """
+    # Writes values to the first len(values) slots of an empty page (used by bulk inserts)
+    """
+    def fill(self, values):
+        struct.pack_into('<%dq' % len(values), self.data, 0, *values)
+        self.num_records = len(values)
+
+    """
+    # Returns every slot of the page as a tuple
+    """
+    def read_all(self):
+        return ALL_SLOTS.unpack_from(self.data)
+
+    """
+    # Returns a read-only view of every slot as signed 64-bit integers, sharing the page's buffer
+    """
+    def view(self):
+        if sys.byteorder == 'little':
+            return memoryview(self.data).cast('q').toreadonly()
+        # Pages are little-endian: big-endian hosts get a byte-swapped copy
+        values = array('q', bytes(self.data))
+        values.byteswap()
+        return memoryview(values).toreadonly()
 
+    """
+    # Overwrites an existing slot in place (used for the indirection, RID and schema columns)
+    """
+    def update(self, slot, value):
+        SLOT.pack_into(self.data, slot * RECORD_SIZE, value)
@@ -0,0 +1,201 @@
+"""
+Cost-based choice of the access path of selects and sums.
+For a predicate column in [begin, end] the planner estimates how many records match from per-column
+statistics (row count, number of distinct values and an equi-depth histogram, sampled from a few page
+ranges) and compares the cost of
+- index lookup: a point lookup in the column's index, checked against its Bloom filter first,
+- index range: a range probe of the column's B+ tree,
+both followed by reading each matching record, with the cost of
+- zone scan: reading whole pages of the page ranges whose zone map overlaps [begin, end] (see
+  Table.filter_range), skipping the others,
+- full scan: the same when no range can be skipped.
+Index paths pay for every record they read while scans pay for every record they pass over, so
+predicates matching a large share of the table are scanned even when the column is indexed.
+Costs are estimates in microseconds, see the PLAN_ constants of lstore/config.py.
+
+Example:
+plan = Query(grades_table).explain(Query.sum, 0, 5000, 2)
+print(plan.access, plan.rows, plan.cost)
+"""
+from lstore.config import STATS_SAMPLE_RANGES, STATS_BUCKETS, STATS_REFRESH_RATIO, STATS_REFRESH_ROWS
+from lstore.config import PLAN_PROBE_COST, PLAN_FETCH_COST, PLAN_COLUMN_COST, PLAN_SCAN_COST, PLAN_SCAN_COST_NUMPY
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ColumnStatistics:
+
+    """
+    # Statistics of one column, as of the table's size and writes when they were sampled
+    # :param rows: int        #Estimated live records
+    # :param distinct: int    #Estimated number of distinct values
+    # :param bounds: list     #STATS_BUCKETS + 1 bounds of an equi-depth histogram, [] without records
+    # :param size: int        #Base records of the table (deleted ones included) when sampled
+    # :param writes: int      #Sum of the writes counters of its page ranges when sampled
+    """
+    def __init__(self, rows, distinct, bounds, size, writes):
+        self.rows = rows
+        self.distinct = distinct
+        self.bounds = bounds
+        self.size = size
+        self.writes = writes
+
+    """
+    # Returns the estimated share of the records whose value lies in [begin, end]
+    """
+    def selectivity(self, begin, end):
+        bounds = self.bounds
+        if not bounds or end < bounds[0] or begin > bounds[-1]:
+            return 0.0
+        buckets = len(bounds) - 1
+        share = 0.0
+        for i in range(buckets):
+            low, high = bounds[i], bounds[i + 1]
+            if high < begin or low > end:
+                continue
+            # Values are assumed to spread evenly over each bucket
+            share += (min(high, end) - max(low, begin) + 1) / (high - low + 1)
+        share /= buckets
+        if begin == end:
+            share = max(share, 1 / max(self.distinct, 1))
+        return min(share, 1.0)
+
+
+class Plan:
+
+    """
+    # Access path chosen for a predicate, returned by Planner.plan and Query.explain
+    # :param access: str      #'index lookup', 'index range', 'zone scan' or 'full scan'
+    # :param ranges: list     #Page ranges scanned, None for index paths
+    # :param rows: float      #Estimated matching records
+    # :param cost: float      #Estimated cost of the chosen path
+    # :param costs: dict      #access -> estimated cost of every path considered
+    """
+    def __init__(self, access, column, begin, end, ranges, rows, cost, costs):
+        self.access = access
+        self.column = column
+        self.begin = begin
+        self.end = end
+        self.ranges = ranges
+        self.rows = rows
+        self.cost = cost
+        self.costs = costs
+
+    def __repr__(self):
+        scanned = '' if self.ranges is None else ', %d ranges' % len(self.ranges)
+        return 'Plan(%s on column %d in [%s, %s]%s, rows=%.1f, cost=%.1f, costs=%s)' % (
+            self.access, self.column, self.begin, self.end, scanned, self.rows, self.cost,
+            {access: round(cost, 1) for access, cost in self.costs.items()})
+
+
+class Planner:
+
+    """
+    # Plans the lookups of one table. Statistics of a column are sampled the first time a plan needs
+    # them and again once the table grew or was written by STATS_REFRESH_RATIO of its size since.
+    """
+    def __init__(self, table):
+        self.table = table
+        # column -> ColumnStatistics
+        self.statistics = {}
+
+    """
+    # Samples the statistics of column from up to STATS_SAMPLE_RANGES page ranges spread over the
+    # table. Must be called under the table lock.
+    """
+    def analyze(self, column):
+        table = self.table
+        num_ranges = len(table.page_ranges)
+        size = sum(page_range.num_base_records for page_range in table.page_ranges)
+        writes = sum(page_range.writes for page_range in table.page_ranges)
+        sampled = sorted({i * num_ranges // STATS_SAMPLE_RANGES for i in range(min(num_ranges, STATS_SAMPLE_RANGES))})
+        sample = []
+        for range_index in sampled:
+            sample.extend(value for value, _ in table.scan_range(range_index, column))
+        sample.sort()
+        n = len(sample)
+        if len(sampled) == num_ranges:
+            rows = n
+        else:
+            # Scaled by the share of the base records sampled, deleted ones included
+            sampled_size = sum(table.page_ranges[range_index].num_base_records for range_index in sampled)
+            rows = round(size * n / max(sampled_size, 1))
+        counts = {}
+        for value in sample:
+            counts[value] = counts.get(value, 0) + 1
+        distinct = len(counts)
+        if 0 < n < rows:
+            # Duj1 estimator: values seen once in the sample stand for the unseen ones
+            once = sum(1 for count in counts.values() if count == 1)
+            distinct = round(n * distinct / (n - once + once * n / rows))
+        bounds = [sample[min(i * n // STATS_BUCKETS, n - 1)] for i in range(STATS_BUCKETS)] + [sample[-1]] if n else []
+        if column == table.key:
+            distinct = rows
+        statistics = self.statistics[column] = ColumnStatistics(rows, min(max(distinct, 1), max(rows, 1)), bounds, size, writes)
+        return statistics
+
+    """
+    # Returns the statistics of column, sampling them if they are missing or stale. Must be called
+    # under the table lock.
+    """
+    def statistics_of(self, column):
+        statistics = self.statistics.get(column)
+        if statistics is None:
+            return self.analyze(column)
+        size = sum(page_range.num_base_records for page_range in self.table.page_ranges)
+        writes = sum(page_range.writes for page_range in self.table.page_ranges)
+        changed = abs(size - statistics.size) + writes - statistics.writes
+        if changed > max(STATS_REFRESH_RATIO * statistics.size, STATS_REFRESH_ROWS):
+            return self.analyze(column)
+        return statistics
+
+    """
+    # Returns the Plan finding the records whose column lies in [begin, end]. Must be called under
+    # the table lock.
+    # :param columns: int     #Columns read from every matching record afterwards, which scans read
+    #                         #from whole pages and index paths record by record
+    """
+    def plan(self, begin, end, column, columns=1):
+        table = self.table
+        index = table.index
+        indexed = index.has_index(column)
+        if indexed and column == table.key and begin == end:
+            # A key matches at most one record, nothing is cheaper than looking it up
+            return Plan('index lookup', column, begin, end, None, 1, PLAN_PROBE_COST + PLAN_FETCH_COST + PLAN_COLUMN_COST * columns, {})
+        statistics = self.statistics_of(column)
+        ranges = []
+        scanned = 0
+        updated = 0
+        # Records of the overlapping ranges, assuming their values spread evenly over each zone, which
+        # corrects histograms sampled from ranges other than the ones overlapping [begin, end]
+        in_zones = 0.0
+        for range_index, page_range in enumerate(table.page_ranges):
+            if not table.may_contain(range_index, column, begin, end):
+                continue
+            ranges.append(range_index)
+            scanned += page_range.num_base_records
+            updated += page_range.pending
+            zone = page_range.zones[column] if page_range.zones is not None else None
+            if zone is None:
+                in_zones += page_range.num_base_records
+            else:
+                in_zones += page_range.num_base_records * (min(zone[1], end) - max(zone[0], begin) + 1) / (zone[1] - zone[0] + 1)
+        rows = min(statistics.rows * statistics.selectivity(begin, end), in_zones)
+        scan_cost = PLAN_SCAN_COST_NUMPY if numpy is not None else PLAN_SCAN_COST
+        # The predicate column and then every projected one are read for each record passed over;
+        # records updated since their range's last merge are read one by one as well
+        costs = {'zone scan' if len(ranges) < len(table.page_ranges) else 'full scan':
+                 (scanned * scan_cost + min(updated, scanned) * (PLAN_FETCH_COST + PLAN_COLUMN_COST)) * (1 + columns)}
+        # An evicted index serves no lookup until it is rebuilt in the background (see Index.tree)
+        if indexed and not (index.indices[column] is None and column in index.evicted):
+            if columns:
+                cost = PLAN_PROBE_COST + rows * (PLAN_FETCH_COST + PLAN_COLUMN_COST * columns)
+            else:
+                # Only the RIDs are wanted, the records are read the same way whichever path finds them
+                cost = PLAN_PROBE_COST + rows * scan_cost
+            costs['index lookup' if begin == end else 'index range'] = cost
+        access = min(costs, key=costs.get)
+        return Plan(access, column, begin, end, ranges if access.endswith('scan') else None, rows, costs[access], costs)
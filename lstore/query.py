@@ -1,5 +1,12 @@
 from lstore.table import Table, Record
 from lstore.index import Index
+from lstore.lock_manager import current_transaction
+from lstore.config import SELECT_RANGE_BATCH
+from lstore import trace
+
+
+def _add_one(value):
+    return value + 1
 
 
 class Query:
@@ -9,6 +16,13 @@ class Query:
     Queries that succeed should return the result or True
     Any query that crashes (due to exceptions) should return False
     """
+    def __new__(cls, table):
+        # Queries on a sharded table are routed to its shard processes
+        if cls is Query and getattr(table, 'shard_bounds', None):
+            from lstore.shard import ShardedQuery
+            return super().__new__(ShardedQuery)
+        return super().__new__(cls)
+
     def __init__(self, table):
         self.table = table
         pass
@@ -20,8 +34,20 @@ class Query:
     # Returns True upon succesful deletion
     # Return False if record doesn't exist or is locked due to 2PL
     """
+    @trace.traced
     def delete(self, primary_key):
-        pass
+        with self.table.lock:
+            rids = self.table.index.locate(self.table.key, primary_key)
+            if not rids:
+                return False
+            rid = rids[0]
+            if not self._lock([rid, ('key', primary_key)], True):
+                return False
+            if current_transaction() is not None:
+                self._undo(rid, self._undo_delete, rid, self.table.read_record(rid, range(self.table.num_columns)))
+            self.table.index.remove(self._indexed_values(rid), rid)
+            self.table.delete_record(rid)
+            return True
     
     
     """
@@ -29,9 +55,21 @@ class Query:
     # Return True upon succesful insertion
     # Returns False if insert fails for whatever reason
     """
+    @trace.traced
     def insert(self, *columns):
-        schema_encoding = '0' * self.table.num_columns
-        pass
+        if len(columns) != self.table.num_columns:
+            return False
+        with self.table.lock:
+            key = columns[self.table.key]
+            if not self._lock([('key', key)], True):
+                return False
+            if self.table.index.locate(self.table.key, key):
+                return False
+            rid = self.table.insert_record(columns)
+            self.table.index.insert(columns, rid)
+            self._lock([rid], True)
+            self._undo(rid, self._undo_insert, rid, list(columns))
+            return True
 
     
     """
@@ -43,8 +81,9 @@ class Query:
     # Returns False if record locked by TPL
     # Assume that select will never be called on a key that doesn't exist
     """
+    @trace.traced
     def select(self, search_key, search_key_index, projected_columns_index):
-        pass
+        return self.select_version(search_key, search_key_index, projected_columns_index, 0)
 
     
     """
@@ -56,9 +95,147 @@ class Query:
     # Returns a list of Record objects upon success
     # Returns False if record locked by TPL
     # Assume that select will never be called on a key that doesn't exist
+    # Records are found the way the planner estimates cheapest (see explain); scans return them in
+    # storage order.
     """
+    @trace.traced
     def select_version(self, search_key, search_key_index, projected_columns_index, relative_version):
-        pass
+        with self.table.lock:
+            columns = [i for i, projected in enumerate(projected_columns_index) if projected]
+            # Scans read the latest values from whole pages, older versions are read record by record
+            plan = self.table.planner.plan(search_key, search_key, search_key_index, len(columns) + 1 if relative_version == 0 else 0)
+            if relative_version == 0 and plan.ranges is not None:
+                rids, rows = self._scan(plan, columns + [self.table.key])
+                if not rids or not self._lock(rids):
+                    return False
+                records = []
+                for rid, row in zip(rids, rows):
+                    projected = [None] * self.table.num_columns
+                    for column, value in zip(columns, row):
+                        projected[column] = value
+                    records.append(Record(rid, row[-1], projected))
+                return records
+            rids = self._locate(search_key, search_key, search_key_index, plan)
+            if not rids or not self._lock(rids):
+                return False
+            return [self._record(rid, columns, relative_version) for rid in rids]
+
+    
+    """
+    # Read matching records as they were at an absolute point in time
+    # :param search_key: the value you want to search based on (records are found by their current value)
+    # :param search_key_index: the column index you want to search based on
+    # :param projected_columns_index: what columns to return. array of 1 or 0 values.
+    # :param time_stamp: the point in time, in microseconds since the epoch (see lstore.table.timestamp)
+    # Returns a list of Record objects upon success, leaving out records inserted after time_stamp
+    # Returns False if no record matches or if a record is locked by TPL
+    """
+    @trace.traced
+    def select_as_of(self, search_key, search_key_index, projected_columns_index, time_stamp):
+        with self.table.lock:
+            rids = self._locate(search_key, search_key, search_key_index)
+            if not rids or not self._lock(rids):
+                return False
+            columns = [i for i, projected in enumerate(projected_columns_index) if projected]
+            records = []
+            for rid in rids:
+                values = self.table.read_record_as_of(rid, columns + [self.table.key], time_stamp)
+                if values is None:
+                    continue
+                projected = [None] * self.table.num_columns
+                for column, value in zip(columns, values):
+                    projected[column] = value
+                records.append(Record(rid, values[-1], projected))
+            return records
+
+    
+    """
+    # Yields the records whose column lies between begin and end (inclusive). Records are read
+    # lazily, so memory use does not grow with the number of matches and the caller can stop early.
+    # They come in ascending order of column when it is indexed, otherwise in storage order.
+    # :param begin: the lowest value to select
+    # :param end: the highest value to select
+    # :param column: the column index the range applies to
+    # :param projected_columns_index: what columns to return. array of 1 or 0 values.
+    # :param batch_size: when given, lists of up to batch_size Record objects are yielded instead of
+    #                    single records
+    # Each batch is read under the table lock; a record changed between two batches is seen either
+    # before or after the change. Stops if a record is locked by another transaction (2PL).
+    """
+    def select_range(self, begin, end, column, projected_columns_index, batch_size=None):
+        columns = [i for i, projected in enumerate(projected_columns_index) if projected]
+        if self.table.index.has_index(column):
+            batches = self._index_batches(begin, end, column, columns, batch_size or SELECT_RANGE_BATCH)
+        else:
+            batches = self._scan_batches(begin, end, column, columns, batch_size or SELECT_RANGE_BATCH)
+        for records in batches:
+            if records is False:
+                return
+            if batch_size:
+                yield records
+            else:
+                yield from records
+
+    
+    """
+    # internal Method
+    # Yields lists of at most batch_size records in index order, walking the index again from the last
+    # key read for each batch since it may have changed in between. Yields False if a record is locked.
+    # A key holding more records than fit in the batch is split: the rest of its RIDs are carried to
+    # the next batches, leaving out those moved to another key or deleted in between.
+    # Indexes stored in an image are loaded first (see Index.tree). Without an index to walk (still
+    # being built, evicted, or dropped in between) the remaining records are scanned instead.
+    """
+    def _index_batches(self, begin, end, column, columns, batch_size):
+        last = None
+        carry = []
+        while True:
+            with self.table.lock:
+                rids = [rid for value, rid in self.table.read_live(carry[:batch_size], column) if value == last]
+                carry = carry[batch_size:]
+                tree = self.table.index.tree(column)
+                if tree is not None and not carry:
+                    for key, values in tree.range(begin if last is None else last, end):
+                        if key == last:
+                            continue
+                        last = key
+                        room = batch_size - len(rids)
+                        rids.extend(values[:room])
+                        carry = values[room:]
+                        if len(rids) >= batch_size:
+                            break
+                if not rids:
+                    if carry:
+                        continue
+                    if tree is None:
+                        break
+                    return
+                if not self._lock(rids):
+                    yield False
+                    return
+                records = [self._record(rid, columns) for rid in rids]
+            yield records
+        # Every record of the keys read so far was yielded
+        yield from self._scan_batches(begin if last is None else last + 1, end, column, columns, batch_size)
+
+    
+    """
+    # internal Method
+    # Yields lists of records page range by page range. Yields False if a record is locked.
+    """
+    def _scan_batches(self, begin, end, column, columns, batch_size):
+        for range_index in range(len(self.table.page_ranges)):
+            with self.table.lock:
+                if not self.table.may_contain(range_index, column, begin, end):
+                    continue
+                pairs = self.table.scan_range(range_index, column)
+                self.table.index.note_scan(column, len(pairs))
+                rids = [rid for value, rid in pairs if begin <= value <= end]
+                if not self._lock(rids):
+                    yield False
+                    return
+                batches = [[self._record(rid, columns) for rid in rids[i:i + batch_size]] for i in range(0, len(rids), batch_size)]
+            yield from batches
 
     
     """
@@ -66,8 +243,35 @@ class Query:
     # Returns True if update is succesful
     # Returns False if no records exist with given key or if the target record cannot be accessed due to 2PL locking
     """
+    @trace.traced
     def update(self, primary_key, *columns):
-        pass
+        if len(columns) != self.table.num_columns:
+            return False
+        with self.table.lock:
+            rids = self.table.index.locate(self.table.key, primary_key)
+            if not rids:
+                return False
+            rid = rids[0]
+            new_key = columns[self.table.key]
+            items = [rid]
+            if new_key is not None and new_key != primary_key:
+                items += [('key', primary_key), ('key', new_key)]
+            if not self._lock(items, True):
+                return False
+            if new_key is not None and new_key != primary_key and self.table.index.locate(self.table.key, new_key):
+                return False
+
+            if current_transaction() is not None:
+                previous = self.table.read_record(rid, range(self.table.num_columns))
+                state = self.table.version_state(rid)
+            changed = [column for column, value in enumerate(columns) if value is not None and self.table.index.has_index(column)]
+            old_values = self._indexed_values(rid, changed)
+            tail_rid = self.table.update_record(rid, columns)
+            for column in changed:
+                self.table.index.update(column, old_values[column], columns[column], rid)
+            if current_transaction() is not None:
+                self._undo(rid, self._undo_update, rid, state, tail_rid, previous, columns)
+            return True
 
     
     """
@@ -78,8 +282,9 @@ class Query:
     # Returns the summation of the given range upon success
     # Returns False if no record exists in the given range
     """
+    @trace.traced
     def sum(self, start_range, end_range, aggregate_column_index):
-        pass
+        return self.sum_version(start_range, end_range, aggregate_column_index, 0)
 
     
     """
@@ -91,23 +296,252 @@ class Query:
     # Returns the summation of the given range upon success
     # Returns False if no record exists in the given range
     """
+    @trace.traced
     def sum_version(self, start_range, end_range, aggregate_column_index, relative_version):
-        pass
+        with self.table.lock:
+            plan = self.table.planner.plan(start_range, end_range, self.table.key, 1 if relative_version == 0 else 0)
+            if relative_version == 0 and plan.ranges is not None:
+                rids, rows = self._scan(plan, [aggregate_column_index])
+                if not rids or not self._lock(rids):
+                    return False
+                return sum(row[0] for row in rows)
+            rids = self._locate(start_range, end_range, self.table.key, plan)
+            if not rids or not self._lock(rids):
+                return False
+            total = 0
+            for rid in rids:
+                total += self.table.read_record(rid, [aggregate_column_index], relative_version)[0]
+            return total
+
+    
+    """
+    :param start_range: int         # Start of the key range to aggregate
+    :param end_range: int           # End of the key range to aggregate
+    :param aggregate_columns: int  # Index of desired column to aggregate
+    :param time_stamp: the point in time, in microseconds since the epoch (see lstore.table.timestamp)
+    # Sums the values the records of the key range held at time_stamp, leaving out records inserted
+    # after it
+    # Returns the summation of the given range upon success
+    # Returns False if no record exists in the given range
+    """
+    @trace.traced
+    def sum_as_of(self, start_range, end_range, aggregate_column_index, time_stamp):
+        with self.table.lock:
+            rids = self._locate(start_range, end_range, self.table.key)
+            if not rids or not self._lock(rids):
+                return False
+            total = 0
+            for rid in rids:
+                values = self.table.read_record_as_of(rid, [aggregate_column_index], time_stamp)
+                if values is not None:
+                    total += values[0]
+            return total
 
     
     """
     incremenets one column of the record
-    this implementation should work if your select and update queries already work
     :param key: the primary of key of the record to increment
     :param column: the column to increment
     # Returns True is increment is successful
     # Returns False if no record matches key or if target record is locked by 2PL.
     """
+    @trace.traced
     def increment(self, key, column):
-        r = self.select(key, self.table.key, [1] * self.table.num_columns)[0]
-        if r is not False:
-            updated_columns = [None] * self.table.num_columns
-            updated_columns[column] = r[column] + 1
-            u = self.update(key, *updated_columns)
-            return u
-        return False
+        return self.apply(key, column, _add_one)
+
+    
+    """
+    # Read-modify-write of one column: sets column of the record with the given primary key to
+    # fn(current value). The record is found, locked, read and updated in a single pass under the table
+    # lock, reading only that column and appending a single tail record (plus the snapshot record on a
+    # record's first update).
+    # :param fn: function     #Called with the current value, returns the new one (picklable on
+    #                         #sharded tables)
+    # Returns True if the update is successful
+    # Returns False if no record matches key, if the target record is locked by 2PL or if fn raises
+    # (the record is left unchanged).
+    """
+    @trace.traced
+    def apply(self, key, column, fn):
+        if column == self.table.key:
+            # Changing the key has to check and lock the new one
+            columns = [None] * self.table.num_columns
+            try:
+                columns[column] = fn(key)
+            except Exception:
+                return False
+            return self.update(key, *columns)
+        with self.table.lock:
+            rids = self.table.index.locate(self.table.key, key)
+            if not rids:
+                return False
+            rid = rids[0]
+            if not self._lock([rid], True):
+                return False
+            old_value = self.table.read_record(rid, [column])[0]
+            columns = [None] * self.table.num_columns
+            try:
+                columns[column] = fn(old_value)
+            except Exception:
+                return False
+            if current_transaction() is not None:
+                previous = [None] * self.table.num_columns
+                previous[column] = old_value
+                state = self.table.version_state(rid)
+            tail_rid = self.table.update_record(rid, columns)
+            if self.table.index.has_index(column):
+                self.table.index.update(column, old_value, columns[column], rid)
+            if current_transaction() is not None:
+                self._undo(rid, self._undo_update, rid, state, tail_rid, previous, columns)
+            return True
+
+    
+    """
+    # Returns the Plan a query would run, with its estimated cost and the cost of the other access
+    # paths it was chosen over. Takes the query method (or its name) and its arguments, like
+    # Transaction.add_query; only selects and sums are planned.
+    # Example:
+    # query.explain(query.select, 90, 2, [1, 1, 1, 1, 1])
+    # query.explain(query.sum, 0, 5000, 2)
+    """
+    def explain(self, query, *args):
+        name = getattr(query, '__name__', query)
+        planner = self.table.planner
+        with self.table.lock:
+            if name in ('select', 'select_version'):
+                columns = sum(1 for projected in args[2] if projected) + 1
+                latest = name == 'select' or args[3] == 0
+                return planner.plan(args[0], args[0], args[1], columns if latest else 0)
+            if name == 'select_as_of':
+                return planner.plan(args[0], args[0], args[1], 0)
+            if name in ('sum', 'sum_version'):
+                latest = name == 'sum' or args[3] == 0
+                return planner.plan(args[0], args[1], self.table.key, 1 if latest else 0)
+            if name == 'sum_as_of':
+                return planner.plan(args[0], args[1], self.table.key, 0)
+        raise ValueError('only selects and sums are planned, not %s' % name)
+
+    
+    """
+    # internal Method
+    # Returns the RIDs of the records whose column lies in [begin, end], through the index or a scan
+    # as plan (by default the planner's choice for finding them) says
+    """
+    def _locate(self, begin, end, column, plan=None):
+        if plan is None:
+            plan = self.table.planner.plan(begin, end, column, 0)
+        if plan.ranges is not None:
+            return self._scan(plan, [])[0]
+        if begin == end:
+            rids = self.table.index.locate(column, begin)
+        else:
+            rids = self.table.index.locate_range(begin, end, column)
+        if rids is None:
+            # The index is still being built
+            rids = self.table.find_rids(column, begin, end)
+        return rids
+
+    
+    """
+    # internal Method
+    # Runs the scan of a plan. Returns (rids, rows): the RIDs of the matching records and, for each,
+    # a tuple of its latest values of columns.
+    """
+    def _scan(self, plan, columns):
+        rids = []
+        rows = []
+        scanned = 0
+        for range_index in plan.ranges:
+            range_rids, values = self.table.filter_range(range_index, plan.column, plan.begin, plan.end, columns)
+            rids.extend(range_rids)
+            rows.extend(zip(*values) if columns else [()] * len(range_rids))
+            scanned += self.table.page_ranges[range_index].num_base_records
+        self.table.index.note_scan(plan.column, scanned)
+        return rids, rows
+
+    
+    """
+    # internal Method
+    # Reads the given columns of a base record into a Record (None for the other columns)
+    """
+    def _record(self, rid, columns, relative_version=0):
+        values = self.table.read_record(rid, columns + [self.table.key], relative_version)
+        projected = [None] * self.table.num_columns
+        for column, value in zip(columns, values):
+            projected[column] = value
+        return Record(rid, values[-1], projected)
+
+    
+    """
+    # internal Method
+    # Locks items (RIDs or ('key', primary key)) for the transaction running on this thread, if any.
+    # Returns False if another transaction holds one of them.
+    """
+    def _lock(self, items, exclusive=False):
+        transaction = current_transaction()
+        return transaction is None or transaction.lock(self.table, items, exclusive)
+
+    
+    """
+    # internal Method
+    # Records how to roll back a write to the record rid for the transaction running on this thread,
+    # if any: rollback(*args) is called on abort. The record's page range is not merged meanwhile
+    # (see Table.hold), so the rollback can restore the record in place.
+    """
+    def _undo(self, rid, rollback, *args):
+        transaction = current_transaction()
+        if transaction is not None:
+            self.table.hold(rid)
+            transaction.undo.append((self.table, rid, rollback, args))
+
+    
+    """
+    # internal Method
+    # Rolls back an insert: the record is deleted, it never was visible to other transactions
+    """
+    def _undo_insert(self, rid, columns):
+        with self.table.lock:
+            self.table.index.remove(columns, rid)
+            self.table.delete_record(rid)
+
+    
+    """
+    # internal Method
+    # Rolls back a delete: the record gets its RID, and so its version history, back
+    """
+    def _undo_delete(self, rid, columns):
+        with self.table.lock:
+            self.table.undelete_record(rid)
+            self.table.index.insert(columns, rid)
+
+    
+    """
+    # internal Method
+    # Rolls back an update: the record points at its previous version again and the tail records of
+    # the update are invalidated (see Table.rollback_update), then the indexes move back
+    # :param state: tuple     #Table.version_state of the record before the update
+    # :param previous: list   #Values of the record before the update (at least of the updated columns)
+    """
+    def _undo_update(self, rid, state, tail_rid, previous, columns):
+        with self.table.lock:
+            self.table.rollback_update(rid, state[0], state[1], tail_rid)
+            for column, value in enumerate(columns):
+                if value is not None:
+                    self.table.index.update(column, value, previous[column], rid)
+
+    
+    """
+    # internal Method
+    # Returns the current values of the record's indexed columns (of the given ones if any), None for
+    # the other columns and those whose index does not need them (see Index.needs_old_value)
+    """
+    def _indexed_values(self, rid, columns=None):
+        if columns is None:
+            columns = range(self.table.num_columns)
+        indexed = [column for column in columns if self.table.index.needs_old_value(column)]
+        values = [None] * self.table.num_columns
+        if not indexed:
+            return values
+        for column, value in zip(indexed, self.table.read_record(rid, indexed)):
+            values[column] = value
+        return values
@@ -0,0 +1,91 @@
+import heapq
+from bisect import bisect_left, bisect_right
+
+from lstore.transaction_worker import TransactionWorker
+
+
+"""
+# Groups transactions whose queued queries may conflict (one writes a record the other reads or
+# writes, as told by Transaction.access_set) and spreads the groups over num_workers workers.
+# Conflicting transactions end up on the same worker, where they run one after the other in the
+# order they are given, instead of aborting each other under no-wait locking; independent groups
+# run in parallel. The largest groups are placed first, each on the least loaded worker.
+# Returns num_workers TransactionWorkers, some possibly empty.
+"""
+def schedule(transactions, num_workers):
+    parent = list(range(len(transactions)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        i, j = find(i), find(j)
+        if i != j:
+            parent[max(i, j)] = min(i, j)
+
+    accesses = [transaction.access_set() for transaction in transactions]
+
+    # (table name, key) -> first transaction writing it
+    writers = {}
+    # table name -> first transaction writing records of the table that cannot be told from its queries
+    table_writers = {}
+    for i, (_, writes, _) in enumerate(accesses):
+        for item in writes:
+            if item[1] is None:
+                item = item[0]
+                if item in table_writers:
+                    union(i, table_writers[item])
+                else:
+                    table_writers[item] = i
+            elif item in writers:
+                union(i, writers[item])
+            else:
+                writers[item] = i
+
+    # table name -> sorted written keys and the transaction writing each
+    written = {}
+    for (table, key), i in writers.items():
+        written.setdefault(table, []).append((key, i))
+    for keys in written.values():
+        keys.sort()
+
+    for i, (reads, writes, scans) in enumerate(accesses):
+        tables = set()
+        for item in reads:
+            if item in writers:
+                union(i, writers[item])
+            tables.add(item[0])
+        for table, _ in writes:
+            tables.add(table)
+        for table, low, high in scans:
+            tables.add(table)
+            keys = written.get(table, [])
+            if low is None:
+                begin, end = 0, len(keys)
+            else:
+                begin = bisect_left(keys, (low,))
+                end = bisect_right(keys, (high, len(transactions)))
+            for _, j in keys[begin:end]:
+                union(i, j)
+        for table in tables:
+            if table in table_writers:
+                union(i, table_writers[table])
+
+    groups = {}
+    for i in range(len(transactions)):
+        groups.setdefault(find(i), []).append(i)
+
+    workers = [TransactionWorker() for _ in range(num_workers)]
+    # (queued queries, worker index) of every worker
+    load = [(0, worker) for worker in range(num_workers)]
+    by_size = sorted(groups.values(), key=lambda group: -sum(len(transactions[i].queries) for i in group))
+    for group in by_size:
+        queries, worker = heapq.heappop(load)
+        for i in group:
+            workers[worker].add_transaction(transactions[i])
+            queries += len(transactions[i].queries)
+        heapq.heappush(load, (queries, worker))
+    return workers
@@ -0,0 +1,311 @@
+import multiprocessing
+import os
+import shutil
+import threading
+from bisect import bisect_right
+from itertools import count
+
+from lstore.config import PROCESS_START_METHOD, SELECT_RANGE_BATCH
+from lstore.lock_manager import current_transaction
+from lstore.query import Query
+
+# Ids of the range select cursors opened on shards
+_cursor_ids = count(1)
+
+
+"""
+# Entry point of a shard process: owns one Database holding its slice of the table and answers
+# (target, method, args) requests sent by the coordinator until it receives None.
+# Range selects are served through cursors so they stay lazy: 'open' starts a select_range, each
+# 'next' returns its next batch (None once done) and 'close' drops it.
+"""
+def _serve(conn, name, num_columns, key, path, cumulative=True, memory_limit=None):
+    from lstore.db import Database
+
+    db = Database()
+    table = None
+    if path is not None:
+        db.open(path, memory_limit)
+        table = db.get_table(name)
+    if table is None:
+        table = db.create_table(name, num_columns, key, cumulative=cumulative)
+    query = Query(table)
+    # cursor id -> select_range generator yielding batches
+    cursors = {}
+
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        target, method, args = request
+        try:
+            if target == 'index':
+                result = getattr(table.index, method)(*args)
+            elif target == 'table':
+                result = getattr(table, method)(*args)
+            elif target == 'cursor':
+                if method == 'open':
+                    cursors[args[0]] = query.select_range(*args[1:])
+                    result = True
+                elif method == 'next':
+                    result = next(cursors[args[0]], None)
+                    if result is None:
+                        del cursors[args[0]]
+                else:
+                    cursor = cursors.pop(args[0], None)
+                    if cursor is not None:
+                        cursor.close()
+                    result = True
+            else:
+                result = getattr(query, method)(*args)
+        except Exception:
+            # Any query that crashes should return False
+            result = False
+        conn.send(result)
+
+    db.close()
+    conn.send(True)
+    conn.close()
+
+
+class ShardedTable:
+
+    """
+    # Coordinator of a table split by primary key ranges across worker processes.
+    # Shard i holds the keys k with shard_bounds[i - 1] <= k < shard_bounds[i]; every shard process
+    # has its own page ranges, indexes, merge thread and (when the database is on disk) its own
+    # log and checkpoints under <path>/<name>.shard<i>.
+    # The shard processes are started with PROCESS_START_METHOD.
+    :param shard_bounds: list   #Sorted split keys, len(shard_bounds) + 1 shards are started
+    :param path: string         #Directory of the database, None for an in-memory database
+    :param cumulative: bool     #Tail record mode of every shard (see Table)
+    :param memory_limit: int    #Memory limit of each shard process (see MemoryBudget), on disk only
+    """
+    def __init__(self, name, num_columns, key, shard_bounds, path=None, cumulative=True, memory_limit=None):
+        self.name = name
+        self.num_columns = num_columns
+        self.key = key
+        self.shard_bounds = list(shard_bounds)
+        self.path = path
+        self.memory_limit = memory_limit
+        self.index = ShardedIndex(self)
+        # One (process, connection, lock) per shard; the lock keeps requests and replies paired
+        self.shards = []
+        context = multiprocessing.get_context(PROCESS_START_METHOD)
+        for i in range(len(self.shard_bounds) + 1):
+            parent, child = context.Pipe()
+            process = context.Process(target=_serve, args=(child, name, num_columns, key, self.shard_path(i), cumulative, memory_limit), daemon=True)
+            process.start()
+            child.close()
+            self.shards.append((process, parent, threading.Lock()))
+
+    """
+    # Memory budget interface (see Table.memory_usage): the shard processes have budgets of their own,
+    # so the coordinator's budget only counts what they were given
+    """
+    def memory_usage(self):
+        if self.memory_limit is None or self.path is None:
+            return 0
+        return self.memory_limit * len(self.shards)
+
+    def drop_caches(self):
+        pass
+
+    def cold_indexes(self):
+        return []
+
+    def shard_path(self, shard):
+        if self.path is None:
+            return None
+        return os.path.join(self.path, '%s.shard%d' % (self.name, shard))
+
+    """
+    # Returns the shard holding key
+    """
+    def shard_of(self, key):
+        return bisect_right(self.shard_bounds, key)
+
+    """
+    # Returns the shards holding keys between begin and end (inclusive)
+    """
+    def shards_between(self, begin, end):
+        return range(self.shard_of(begin), self.shard_of(end) + 1)
+
+    """
+    # Raises ValueError when called by a running transaction: shard processes hold no locks for it
+    # and cannot roll its writes back, so its queries on sharded tables would run unprotected
+    """
+    def _check_transaction(self):
+        if current_transaction() is not None:
+            raise ValueError('transactions do not support sharded table %s' % self.name)
+
+    def call(self, shard, target, method, *args):
+        self._check_transaction()
+        _, conn, lock = self.shards[shard]
+        with lock:
+            conn.send((target, method, args))
+            return conn.recv()
+
+    """
+    # Sends the same request to several shards before waiting for any reply, so they run in parallel.
+    # Returns the replies in shard order.
+    """
+    def broadcast(self, shards, target, method, *args):
+        self._check_transaction()
+        shards = sorted(shards)
+        # Locks are always taken in shard order so concurrent broadcasts cannot deadlock
+        for shard in shards:
+            self.shards[shard][2].acquire()
+        try:
+            for shard in shards:
+                self.shards[shard][1].send((target, method, args))
+            return [self.shards[shard][1].recv() for shard in shards]
+        finally:
+            for shard in shards:
+                self.shards[shard][2].release()
+
+    def close(self):
+        for process, conn, lock in self.shards:
+            with lock:
+                conn.send(None)
+                conn.recv()
+                conn.close()
+            process.join()
+        self.shards = []
+
+    """
+    # Removes the files of every shard of a (closed) sharded table
+    """
+    @staticmethod
+    def remove_files(name, num_shards, path):
+        if path is None:
+            return
+        for shard in range(num_shards):
+            shutil.rmtree(os.path.join(path, '%s.shard%d' % (name, shard)), ignore_errors=True)
+
+
+class ShardedIndex:
+
+    """
+    # Index interface of a sharded table: every shard indexes its own records
+    """
+    def __init__(self, table):
+        self.table = table
+
+    def create_index(self, column_number, deferred=False):
+        self.table.broadcast(range(len(self.table.shards)), 'index', 'create_index', column_number, deferred)
+
+    def drop_index(self, column_number):
+        self.table.broadcast(range(len(self.table.shards)), 'index', 'drop_index', column_number)
+
+
+class ShardedQuery(Query):
+
+    """
+    # Query on a ShardedTable (Query(table) returns one automatically).
+    # Point queries on the primary key go to the shard owning the key; selects on other columns and
+    # aggregates run on every shard involved in parallel and their results are combined.
+    """
+    def __init__(self, table):
+        self.table = table
+
+    def _all_shards(self):
+        return range(len(self.table.shards))
+
+    def insert(self, *columns):
+        if len(columns) != self.table.num_columns:
+            return False
+        return self.table.call(self.table.shard_of(columns[self.table.key]), 'query', 'insert', *columns)
+
+    def delete(self, primary_key):
+        return self.table.call(self.table.shard_of(primary_key), 'query', 'delete', primary_key)
+
+    def update(self, primary_key, *columns):
+        shard = self.table.shard_of(primary_key)
+        new_key = columns[self.table.key] if len(columns) == self.table.num_columns else None
+        # A record never moves between shards
+        if new_key is not None and self.table.shard_of(new_key) != shard:
+            return False
+        return self.table.call(shard, 'query', 'update', primary_key, *columns)
+
+    def select(self, search_key, search_key_index, projected_columns_index):
+        return self.select_version(search_key, search_key_index, projected_columns_index, 0)
+
+    def select_version(self, search_key, search_key_index, projected_columns_index, relative_version):
+        if search_key_index == self.table.key:
+            return self.table.call(self.table.shard_of(search_key), 'query', 'select_version', search_key, search_key_index, projected_columns_index, relative_version)
+        records = []
+        for result in self.table.broadcast(self._all_shards(), 'query', 'select_version', search_key, search_key_index, projected_columns_index, relative_version):
+            if result is not False:
+                records.extend(result)
+        return records if records else False
+
+    def select_as_of(self, search_key, search_key_index, projected_columns_index, time_stamp):
+        if search_key_index == self.table.key:
+            return self.table.call(self.table.shard_of(search_key), 'query', 'select_as_of', search_key, search_key_index, projected_columns_index, time_stamp)
+        records = []
+        for result in self.table.broadcast(self._all_shards(), 'query', 'select_as_of', search_key, search_key_index, projected_columns_index, time_stamp):
+            if result is not False:
+                records.extend(result)
+        return records if records else False
+
+    def sum(self, start_range, end_range, aggregate_column_index):
+        return self.sum_version(start_range, end_range, aggregate_column_index, 0)
+
+    def sum_version(self, start_range, end_range, aggregate_column_index, relative_version):
+        partials = self.table.broadcast(self.table.shards_between(start_range, end_range), 'query', 'sum_version', start_range, end_range, aggregate_column_index, relative_version)
+        partials = [partial for partial in partials if partial is not False]
+        if not partials:
+            return False
+        return sum(partials)
+
+    def sum_as_of(self, start_range, end_range, aggregate_column_index, time_stamp):
+        partials = self.table.broadcast(self.table.shards_between(start_range, end_range), 'query', 'sum_as_of', start_range, end_range, aggregate_column_index, time_stamp)
+        partials = [partial for partial in partials if partial is not False]
+        if not partials:
+            return False
+        return sum(partials)
+
+    """
+    # Yields the records whose column lies between begin and end (see Query.select_range), reading
+    # the shards one after the other, in shard order, a batch at a time. Each shard's records come in
+    # ascending order of column when it is indexed there; on the primary key the shards hold
+    # consecutive key ranges, so the whole result is in key order and only the shards overlapping
+    # [begin, end] are read.
+    """
+    def select_range(self, begin, end, column, projected_columns_index, batch_size=None):
+        shards = self.table.shards_between(begin, end) if column == self.table.key else self._all_shards()
+        for shard in shards:
+            cursor = next(_cursor_ids)
+            if not self.table.call(shard, 'cursor', 'open', cursor, begin, end, column, projected_columns_index, batch_size or SELECT_RANGE_BATCH):
+                continue
+            try:
+                while True:
+                    records = self.table.call(shard, 'cursor', 'next', cursor)
+                    if not records:
+                        break
+                    if batch_size:
+                        yield records
+                    else:
+                        yield from records
+            finally:
+                self.table.call(shard, 'cursor', 'close', cursor)
+
+    """
+    # Returns the plans of the shards the query runs on, in shard order (see Query.explain)
+    """
+    def explain(self, query, *args):
+        name = getattr(query, '__name__', query)
+        if name in ('sum', 'sum_version', 'sum_as_of'):
+            shards = self.table.shards_between(args[0], args[1])
+        elif args[1] == self.table.key:
+            shards = [self.table.shard_of(args[0])]
+        else:
+            shards = self._all_shards()
+        return self.table.broadcast(shards, 'query', 'explain', name, *args)
+
+    def increment(self, key, column):
+        return self.table.call(self.table.shard_of(key), 'query', 'increment', key, column)
+
+    def apply(self, key, column, fn):
+        return self.table.call(self.table.shard_of(key), 'query', 'apply', key, column, fn)
@@ -0,0 +1,247 @@
+"""
+Read-only snapshots of a table published in shared memory, for analytical scans run by worker
+processes that do not compete with queries for the GIL.
+A snapshot holds the latest value of every column of every live record, page range by page range:
+one shared memory segment per range, holding each user column as consecutive signed 64-bit values.
+Workers attach to the segments by name and read them in place (through numpy when it is installed),
+without copying or unpickling them.
+Snapshots are published in generations. The state of a generation is captured under the table lock,
+so it is consistent, and copied to the segments once the lock is released; only ranges written since
+the previous generation are copied, the others share its segments. Every reader holds a reference to the generation it reads and a segment is unlinked once no
+generation holding it is referenced anymore.
+
+Example:
+snapshots = SharedSnapshots(grades_table)
+total = snapshots.sum(0, 1000, 2)
+snapshots.close()
+"""
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+from lstore.config import PROCESS_START_METHOD, SHARED_PUBLISH_INTERVAL
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Segment:
+
+    """
+    # One page range of a snapshot: the shared memory block, the number of records it holds and the
+    # writes counter of the range it was copied at (see PageRange.writes)
+    """
+    def __init__(self, columns, writes):
+        self.count = len(columns[0])
+        self.writes = writes
+        self.references = 0
+        self.memory = shared_memory.SharedMemory(create=True, size=max(1, self.count * 8 * len(columns)))
+        for i, values in enumerate(columns):
+            self.memory.buf[i * self.count * 8:(i + 1) * self.count * 8] = memoryview(values).cast('B')
+
+    def release(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+class Generation:
+
+    def __init__(self, number, segments):
+        self.number = number
+        # One segment per page range, None for ranges without live records
+        self.segments = segments
+        self.references = 0
+
+    """
+    # Returns (segment name, record count) of each non-empty range, which is what workers attach to
+    """
+    def parts(self):
+        return [(segment.memory.name, segment.count) for segment in self.segments if segment is not None]
+
+
+"""
+# Runs in a worker process: sums column over the records of a segment whose key lies in [begin, end]
+# Returns (number of records in the range, sum)
+"""
+def _sum_segment(name, count, num_columns, key, column, begin, end):
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        if numpy is not None:
+            values = numpy.ndarray((num_columns, count), dtype=numpy.int64, buffer=memory.buf)
+            keys = values[key]
+            selected = (keys >= begin) & (keys <= end)
+            result = int(selected.sum()), int(values[column][selected].sum())
+            del values, keys, selected
+            return result
+        view = memory.buf.cast('q')
+        keys = view[key * count:(key + 1) * count]
+        aggregated = view[column * count:(column + 1) * count]
+        found = total = 0
+        for i in range(count):
+            if begin <= keys[i] <= end:
+                found += 1
+                total += aggregated[i]
+        del keys, aggregated
+        view.release()
+        return found, total
+    finally:
+        memory.close()
+
+
+class SharedSnapshots:
+
+    """
+    # Publishes shared memory snapshots of table and runs parallel scans over them.
+    # A first generation is published right away; the table's merge thread publishes a new one once
+    # its queue of merges is empty (see refresh), and publish() does so on demand. Scans read the
+    # latest published generation, so they see the table as of that point.
+    # :param table: Table
+    # :param workers: int     #Worker processes (all cores if None)
+    """
+    def __init__(self, table, workers=None):
+        self.table = table
+        self.workers = workers or os.cpu_count() or 1
+        self.lock = threading.Lock()
+        self.current = None
+        self.generations = 0
+        self.pool = None
+        # time.monotonic() of the last publish, and the timer of the publish refresh() delayed
+        self.published = 0.0
+        self.timer = None
+        self.closed = False
+        self.publish()
+        table.shared = self
+
+    """
+    # Publishes a new generation reflecting the table as it is now and returns its number
+    """
+    def publish(self):
+        table = self.table
+        # Keeps the base pages captured below from being reclaimed until they are copied
+        with table.epochs.pin():
+            with table.lock:
+                # Under the table lock: another publish could otherwise replace the generation the
+                # segments are taken from and unlink those it does not share before they are referenced
+                with self.lock:
+                    self.generations += 1
+                    number = self.generations
+                    self.published = time.monotonic()
+                    previous = self.current.segments if self.current is not None else []
+                    segments = []
+                    for range_index, page_range in enumerate(table.page_ranges):
+                        segment = previous[range_index] if range_index < len(previous) else None
+                        if segment is not None and segment.writes == page_range.writes:
+                            segment.references += 1
+                            segments.append(segment)
+                        else:
+                            segments.append((table.capture_range(range_index), page_range.writes))
+            for range_index, segment in enumerate(segments):
+                if isinstance(segment, tuple):
+                    state, writes = segment
+                    columns = table.build_columns(state)
+                    segments[range_index] = segment = Segment(columns, writes) if columns[0] else None
+                    if segment is not None:
+                        segment.references += 1
+        with self.lock:
+            generation = Generation(number, segments)
+            generation.references += 1
+            # A publish that captured the table later may have finished first
+            if self.closed or (self.current is not None and self.current.number > number):
+                self._release(generation)
+                return number
+            old, self.current = self.current, generation
+            if old is not None:
+                self._release(old)
+            return number
+
+    """
+    # Called by the table's merge thread once its queue of merges is empty: publishes a generation,
+    # at most one every SHARED_PUBLISH_INTERVAL seconds. One asked for sooner is published by a timer
+    # once the interval is over, so scans never read a generation older than that.
+    """
+    def refresh(self):
+        with self.lock:
+            if self.closed or self.timer is not None:
+                return
+            delay = self.published + SHARED_PUBLISH_INTERVAL - time.monotonic()
+            if delay > 0:
+                self.timer = threading.Timer(delay, self._refresh_later)
+                self.timer.daemon = True
+                self.timer.start()
+                return
+        self.publish()
+
+    def _refresh_later(self):
+        with self.lock:
+            self.timer = None
+            if self.closed:
+                return
+        self.publish()
+
+    """
+    # Returns the latest generation, which stays valid until it is passed to release()
+    """
+    def acquire(self):
+        with self.lock:
+            self.current.references += 1
+            return self.current
+
+    def release(self, generation):
+        with self.lock:
+            self._release(generation)
+
+    def _release(self, generation):
+        generation.references -= 1
+        if generation.references:
+            return
+        for segment in generation.segments:
+            if segment is not None:
+                segment.references -= 1
+                if not segment.references:
+                    segment.release()
+
+    """
+    # Sums aggregate_column_index over the records whose key lies in [start_range, end_range], the
+    # ranges of the snapshot being scanned by the worker processes in parallel
+    # Returns False if no record exists in the given range, like Query.sum
+    """
+    def sum(self, start_range, end_range, aggregate_column_index):
+        generation = self.acquire()
+        try:
+            table = self.table
+            tasks = [(name, count, table.num_columns, table.key, aggregate_column_index, start_range, end_range) for name, count in generation.parts()]
+            if self.workers < 2 or len(tasks) < 2:
+                results = [_sum_segment(*task) for task in tasks]
+            else:
+                if self.pool is None:
+                    self.pool = multiprocessing.get_context(PROCESS_START_METHOD).Pool(self.workers)
+                results = self.pool.starmap(_sum_segment, tasks)
+        finally:
+            self.release(generation)
+        if not sum(found for found, _ in results):
+            return False
+        return sum(total for _, total in results)
+
+    """
+    # Stops the worker processes and unlinks the segments no scan is reading
+    """
+    def close(self):
+        if self.table.shared is self:
+            self.table.shared = None
+        with self.lock:
+            self.closed = True
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        with self.lock:
+            if self.current is not None:
+                self._release(self.current)
+                self.current = None
@@ -1,11 +1,64 @@
 from lstore.index import Index
+from lstore.planner import Planner
+from lstore.page import Page
+from lstore.bufferpool import BufferPool
+from lstore.epoch import EpochManager
+from lstore.lock_manager import LockManager
+from lstore import trace
+from lstore.config import RECORDS_PER_PAGE, BASE_PAGES_PER_RANGE, RANGE_CAPACITY, MERGE_THRESHOLD, TAIL_COMPACTION_RATIO
+from lstore.config import MEMORY_DIRECTORY_ENTRY, MEMORY_VERSION_ENTRY
 from time import time
+from array import array
+from itertools import compress
+import threading
+import queue
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 INDIRECTION_COLUMN = 0
 RID_COLUMN = 1
 TIMESTAMP_COLUMN = 2
 SCHEMA_ENCODING_COLUMN = 3
 
+# User column i is stored in physical column i + NUM_METADATA_COLUMNS
+NUM_METADATA_COLUMNS = 4
+
+# RID 0 marks a deleted base record and an empty indirection pointer
+INVALID_RID = 0
+
+
+# Last timestamp handed out or recovered, so that timestamps never go backwards
+_last_timestamp = 0
+_timestamp_lock = threading.Lock()
+
+
+"""
+# Returns the time in microseconds since the epoch, greater than every timestamp returned or recovered
+# before: versions stay in commit order (and select_as_of stays correct) when the wall clock steps
+# back, in which case timestamps run ahead of it by a microsecond each until it catches up
+"""
+def timestamp():
+    global _last_timestamp
+    with _timestamp_lock:
+        _last_timestamp = max(int(time() * 1000000), _last_timestamp + 1)
+        return _last_timestamp
+
+
+"""
+# Makes every later timestamp greater than time_stamp, which a recovered record or checkpoint carries
+"""
+def observe_timestamp(time_stamp):
+    global _last_timestamp
+    with _timestamp_lock:
+        _last_timestamp = max(_last_timestamp, time_stamp)
+
+
+def last_timestamp():
+    return _last_timestamp
+
 
 class Record:
 
@@ -14,22 +67,1186 @@ class Record:
         self.key = key
         self.columns = columns
 
+
+class PageRange:
+
+    """
+    # A page range owns a fixed number of base pages and all tail pages holding their updates.
+    # base_pages and tail_pages are lists of page sets: one page id per physical column.
+    # Merges (and the compaction of deleted records) work on one range at a time.
+    """
+    def __init__(self):
+        self.base_pages = []
+        self.tail_pages = []
+        self.num_base_records = 0
+        self.num_tail_records = 0
+        # Tail-page sequence number: every tail RID <= tps has been merged into the base pages
+        self.tps = 0
+        self.last_tail_rid = 0
+        # Tail records and deletes since the last merge
+        self.pending = 0
+        # Base RIDs deleted since the last merge, their slots are reclaimed by the merge
+        self.deleted = []
+        # Tail records left behind by deleted records, reclaimed once they make up enough of the tail
+        self.dead_tails = 0
+        self.merge_queued = False
+        # Records of the range written by running transactions. Their writes may still be rolled back,
+        # so the range is not merged until it drops to 0 (see Table.hold).
+        self.uncommitted = 0
+        # Time-travel index, built on first use by Table.read_record_as_of: base RID -> RIDs of its tail
+        # records oldest first (the snapshot record first), and [lowest, highest] timestamp of the
+        # update records of each tail page. None until built, and again once tail pages are compacted.
+        self.versions = None
+        self.tail_bounds = None
+        # Writes to the range's records, which tell the ranges changed since a shared snapshot was
+        # published (see lstore/shared.py)
+        self.writes = 0
+        # Zone map: [lowest, highest] value ever written to each user column of the range (None for
+        # columns without values yet), which scans skip ranges by. Deletes and merges leave it as is,
+        # so it may be wider than the values the range holds. None when unknown (ranges restored from
+        # checkpoints written before zone maps existed).
+        self.zones = None
+
+    def has_capacity(self):
+        return self.num_base_records < RANGE_CAPACITY
+
+
 class Table:
 
     """
     :param name: string         #Table name
     :param num_columns: int     #Number of Columns: all columns are integer
     :param key: int             #Index of table key in columns
+    :param bufferpool: BufferPool #Shared bufferpool of the database (a private in-memory one if None)
+    :param log: Log             #Redo log of the database, None when the database is not persisted
+    :param cumulative: bool     #Whether tail records carry every column updated since the last merge
     """
-    def __init__(self, name, num_columns, key):
+    def __init__(self, name, num_columns, key, bufferpool=None, log=None, cumulative=True):
         self.name = name
         self.key = key
         self.num_columns = num_columns
+        # Cumulative tails make latest reads one hop; non-cumulative tails only hold the updated columns
+        self.cumulative = cumulative
+        # rid -> (range index, is tail, offset of the record inside the range's base or tail pages)
         self.page_directory = {}
+        self.page_ranges = []
+        self.bufferpool = bufferpool if bufferpool is not None else BufferPool()
+        self.log = log
+        self.num_pages = 0
+        # Page ids free for reuse by _add_page
+        self.free_pages = []
+        # Page ids no reader uses anymore but that the last checkpoint may still point to. They join
+        # free_pages once a checkpoint not referencing them is written.
+        self.released = []
+        # Pages replaced by a merge are retired here and reclaimed once no reader can still be using them.
+        # Readers that keep views of base pages after releasing the table lock (scan_range, live_columns)
+        # pin an epoch before taking them; reads done entirely under the lock need no pin.
+        self.epochs = EpochManager()
+        self.next_rid = 1
+        # Guards the page directory, the page ranges and the indexes. Queries hold it for one operation.
+        self.lock = threading.RLock()
+        # Held for a whole merge, so a checkpoint never sees pages freed under it
+        self.merge_lock = threading.Lock()
+        trace.register_lock(self, 'lock', 'table ' + name)
+        trace.register_lock(self, 'merge_lock', 'merge lock ' + name)
         self.index = Index(self)
-        pass
+        self.planner = Planner(self)
+        # Record locks of the transactions running on this table
+        self.lock_manager = LockManager()
+        self.merge_queue = queue.Queue()
+        self.merge_thread = None
+        # SharedSnapshots publishing this table, if any
+        self.shared = None
+        # True while the redo log is replayed into the table. Pages flushed after the checkpoint can
+        # be ahead of the replayed records until the replay is over, so merges wait until then.
+        self.replaying = False
+        # Base RIDs of the records the replayed log records wrote, whose entries in the index images of
+        # the checkpoint may be stale (see Index.rebuild)
+        self.replayed = set()
+
+    """
+    # Page helpers
+    """
+    def _new_page_set(self):
+        page_set = []
+        for _ in range(self.num_columns + NUM_METADATA_COLUMNS):
+            page_set.append(self._add_page(Page()))
+        return page_set
+
+    def _add_page(self, page):
+        if self.free_pages:
+            page_id = self.free_pages.pop()
+        else:
+            page_id = self.num_pages
+            self.num_pages += 1
+        self.bufferpool.add_page(self.name, page_id, page)
+        return page_id
+
+    """
+    # Drops the retired pages no reader can still be using from the bufferpool. Without a log there is
+    # no checkpoint to wait for and they are reused right away.
+    """
+    def reclaim_pages(self):
+        page_ids = self.epochs.reclaim()
+        if not page_ids:
+            return
+        with self.lock:
+            for page_id in page_ids:
+                self.bufferpool.free_page(self.name, page_id)
+            if self.log is None:
+                self.free_pages.extend(page_ids)
+            else:
+                self.released.extend(page_ids)
+
+    """
+    # Returns an estimate of the bytes this table keeps in memory outside of the bufferpool: page
+    # directory, indexes, Bloom filters and time-travel indexes (see MemoryBudget)
+    """
+    def memory_usage(self):
+        with self.lock:
+            records = sum(page_range.num_base_records for page_range in self.page_ranges)
+            usage = len(self.page_directory) * MEMORY_DIRECTORY_ENTRY + self.index.memory_usage(records)
+            for page_range in self.page_ranges:
+                if page_range.versions is not None:
+                    usage += len(page_range.versions) * MEMORY_VERSION_ENTRY + page_range.num_tail_records * 8
+            return usage
+
+    """
+    # Drops the time-travel indexes, which are rebuilt on demand
+    """
+    def drop_caches(self):
+        with self.lock:
+            for page_range in self.page_ranges:
+                page_range.versions = None
+                page_range.tail_bounds = None
+
+    """
+    # Returns [(column, time of its last lookup)] of the indexes the memory budget may evict
+    """
+    def cold_indexes(self):
+        return self.index.cold_indexes()
+
+    """
+    # Called once a checkpoint whose snapshot lists page_ids as free is written: released pages among
+    # them can be reused
+    """
+    def recycle(self, page_ids):
+        with self.lock:
+            page_ids = set(page_ids)
+            self.free_pages.extend(page_id for page_id in self.released if page_id in page_ids)
+            self.released = [page_id for page_id in self.released if page_id not in page_ids]
+        self.index.release_images()
+
+    def _read(self, page_set, column, offset, scan=False):
+        return self.bufferpool.read(self.name, page_set[column], offset % RECORDS_PER_PAGE, scan)
+
+    def _write(self, page_set, column, offset, value):
+        self.bufferpool.write(self.name, page_set[column], offset % RECORDS_PER_PAGE, value)
+
+    """
+    # Returns (page range, page set, offset) of a base or tail record
+    """
+    def _locate(self, rid):
+        range_index, is_tail, offset = self.page_directory[rid]
+        page_range = self.page_ranges[range_index]
+        if is_tail:
+            return page_range, page_range.tail_pages[offset // RECORDS_PER_PAGE], offset
+        return page_range, page_range.base_pages[offset // RECORDS_PER_PAGE], offset
+
+    def _append(self, page_sets, offset, values):
+        if offset % RECORDS_PER_PAGE == 0:
+            page_sets.append(self._new_page_set())
+        page_set = page_sets[offset // RECORDS_PER_PAGE]
+        self.bufferpool.write_row(self.name, page_set, offset % RECORDS_PER_PAGE, values)
+
+    def _add_range(self):
+        page_range = PageRange()
+        page_range.zones = [None] * self.num_columns
+        self.page_ranges.append(page_range)
+        # The page directory and indexes grow with the table
+        self.bufferpool.signal_pressure()
+
+    """
+    # Widens the zone map of a range's column to include [low, high]
+    """
+    def _widen(self, page_range, column, low, high):
+        zones = page_range.zones
+        if zones is None:
+            return
+        zone = zones[column]
+        if zone is None:
+            zones[column] = [low, high]
+            return
+        if low < zone[0]:
+            zone[0] = low
+        if high > zone[1]:
+            zone[1] = high
+
+    """
+    # Returns False if the zone map of a page range shows that none of its records has column in
+    # [begin, end]
+    """
+    def may_contain(self, range_index, column, begin, end):
+        zones = self.page_ranges[range_index].zones
+        if zones is None:
+            return True
+        zone = zones[column]
+        return zone is not None and zone[0] <= end and begin <= zone[1]
+
+    def _new_rid(self):
+        rid = self.next_rid
+        self.next_rid += 1
+        return rid
+
+    """
+    # Appends a redo record for this table to the database log
+    """
+    def _log(self, operation, *args):
+        if self.log is not None:
+            self.log.append(self.name, operation, *args)
+
+    """
+    # Writes a new base record and returns its RID
+    # :param columns: list of user column values
+    """
+    def insert_record(self, columns):
+        with self.lock:
+            rid = self._new_rid()
+            time_stamp = timestamp()
+            self._log('insert', rid, time_stamp, list(columns))
+            self._apply_insert(rid, time_stamp, list(columns))
+            return rid
+
+    """
+    # Bulk insert path: writes whole base pages at once from columnar data and logs one redo record
+    # for all of it. Records whose key is already in the table (or earlier in columns) are skipped.
+    # Bulk inserts do not take part in transactions.
+    # :param columns: list of num_columns sequences of equal length, the values of each user column
+    # Returns the number of records inserted
+    """
+    def insert_columns(self, columns):
+        with self.lock:
+            seen = set()
+            keep = []
+            for key in columns[self.key]:
+                keep.append(key not in seen and not self.index.locate(self.key, key))
+                seen.add(key)
+            columns = [array('q', compress(values, keep) if not all(keep) else values) for values in columns]
+            count = len(columns[self.key])
+            if not count:
+                return 0
+            first_rid = self.next_rid
+            self.next_rid += count
+            time_stamp = timestamp()
+            self._log('insert_columns', first_rid, time_stamp, columns)
+            self._apply_insert_columns(first_rid, time_stamp, columns)
+            self.index.insert_columns(columns, first_rid)
+            return count
+
+    def _apply_insert_columns(self, first_rid, time_stamp, columns):
+        count = len(columns[0])
+        done = 0
+        while done < count:
+            if not self.page_ranges or not self.page_ranges[-1].has_capacity():
+                self._add_range()
+            range_index = len(self.page_ranges) - 1
+            page_range = self.page_ranges[range_index]
+            offset = page_range.num_base_records
+            # Up to the end of the last base page
+            n = min(count - done, RECORDS_PER_PAGE - offset % RECORDS_PER_PAGE)
+            rids = range(first_rid + done, first_rid + done + n)
+            values = [[INVALID_RID] * n, rids, [time_stamp] * n, [0] * n] + [column[done:done + n] for column in columns]
+            if offset % RECORDS_PER_PAGE == 0:
+                page_set = []
+                for column_values in values:
+                    page = Page()
+                    page.fill(column_values)
+                    page_set.append(self._add_page(page))
+                page_range.base_pages.append(page_set)
+            else:
+                page_set = page_range.base_pages[offset // RECORDS_PER_PAGE]
+                for column, column_values in enumerate(values):
+                    for i, value in enumerate(column_values):
+                        self._write(page_set, column, offset + i, value)
+            for i, rid in enumerate(rids):
+                self.page_directory[rid] = (range_index, False, offset + i)
+            for column, column_values in enumerate(values[NUM_METADATA_COLUMNS:]):
+                self._widen(page_range, column, min(column_values), max(column_values))
+            page_range.num_base_records += n
+            page_range.writes += 1
+            done += n
+
+    def _apply_insert(self, rid, time_stamp, columns):
+        if not self.page_ranges or not self.page_ranges[-1].has_capacity():
+            self._add_range()
+        range_index = len(self.page_ranges) - 1
+        page_range = self.page_ranges[range_index]
+        offset = page_range.num_base_records
+        self._append(page_range.base_pages, offset, [INVALID_RID, rid, time_stamp, 0] + columns)
+        for column, value in enumerate(columns):
+            self._widen(page_range, column, value, value)
+        page_range.num_base_records += 1
+        page_range.writes += 1
+        self.page_directory[rid] = (range_index, False, offset)
+
+    """
+    # Appends a full tail record (metadata columns first) to a page range
+    """
+    def _append_tail(self, page_range, range_index, record):
+        rid = record[RID_COLUMN]
+        offset = page_range.num_tail_records
+        self._append(page_range.tail_pages, offset, record)
+        page_range.num_tail_records += 1
+        page_range.last_tail_rid = rid
+        self.page_directory[rid] = (range_index, True, offset)
+
+    """
+    # Appends a tail record holding the non-None entries of columns to the base record's version chain.
+    # In cumulative tables tail records also carry every column updated since the last merge, so the
+    # latest version of any column is at most one hop away from the base record. Otherwise they only
+    # hold the updated columns and reads walk the chain back to each column's last update.
+    # The first update of a record also writes a snapshot tail record holding the original values,
+    # so older versions survive merges overwriting the base pages.
+    """
+    def update_record(self, base_rid, columns):
+        with self.lock:
+            page_range, page_set, offset = self._locate(base_rid)
+            indirection = self._read(page_set, INDIRECTION_COLUMN, offset)
+            tails = []
+
+            if indirection == INVALID_RID:
+                original = [self._read(page_set, column + NUM_METADATA_COLUMNS, offset) for column in range(self.num_columns)]
+                all_columns = (1 << self.num_columns) - 1
+                base_time = self._read(page_set, TIMESTAMP_COLUMN, offset)
+                snapshot_rid = self._new_rid()
+                tails.append([base_rid, snapshot_rid, base_time, all_columns] + original)
+                indirection = snapshot_rid
 
-    def __merge(self):
-        print("merge is happening")
-        pass
- 
+            schema = 0
+            values = [0] * self.num_columns
+            for column, value in enumerate(columns):
+                if value is not None:
+                    schema |= 1 << column
+                    values[column] = value
+
+            update_schema = schema
+            # Carry forward the columns of the previous tail record unless it is already merged or is the snapshot
+            if self.cumulative and not tails and indirection > page_range.tps:
+                _, prev_set, prev_offset = self._locate(indirection)
+                if self._read(prev_set, INDIRECTION_COLUMN, prev_offset) != base_rid:
+                    prev_schema = self._read(prev_set, SCHEMA_ENCODING_COLUMN, prev_offset)
+                    for column in range(self.num_columns):
+                        if prev_schema & (1 << column) and not schema & (1 << column):
+                            values[column] = self._read(prev_set, column + NUM_METADATA_COLUMNS, prev_offset)
+                    schema |= prev_schema
+
+            tail_rid = self._new_rid()
+            tails.append([indirection, tail_rid, timestamp(), schema] + values)
+            self._log('update', base_rid, tails, update_schema)
+            self._apply_update(base_rid, tails, update_schema)
+            return tail_rid
+
+    """
+    # Appends the given tail records and points the base record at the last one
+    """
+    def _apply_update(self, base_rid, tails, update_schema):
+        range_index = self.page_directory[base_rid][0]
+        page_range, page_set, offset = self._locate(base_rid)
+        for record in tails:
+            self._append_tail(page_range, range_index, record)
+        if page_range.versions is not None:
+            self._add_version(page_range, base_rid, tails)
+        self._write(page_set, INDIRECTION_COLUMN, offset, tails[-1][RID_COLUMN])
+        base_schema = self._read(page_set, SCHEMA_ENCODING_COLUMN, offset)
+        self._write(page_set, SCHEMA_ENCODING_COLUMN, offset, base_schema | update_schema)
+        record = tails[-1]
+        for column in range(self.num_columns):
+            if update_schema & (1 << column):
+                value = record[column + NUM_METADATA_COLUMNS]
+                self._widen(page_range, column, value, value)
+        page_range.writes += 1
+        self._add_pending(range_index, page_range)
+
+    """
+    # Marks a base record as deleted by invalidating its RID. Its base and tail slots and its page
+    # directory entries are reclaimed by the next merge of its page range.
+    """
+    def delete_record(self, base_rid):
+        with self.lock:
+            self._log('delete', base_rid)
+            self._apply_delete(base_rid)
+
+    def _apply_delete(self, base_rid):
+        range_index = self.page_directory[base_rid][0]
+        page_range, page_set, offset = self._locate(base_rid)
+        self._write(page_set, RID_COLUMN, offset, INVALID_RID)
+        page_range.deleted.append(base_rid)
+        page_range.writes += 1
+        self._add_pending(range_index, page_range)
+
+    """
+    # Returns (indirection, schema encoding) of a base record, the state rollback_update restores
+    """
+    def version_state(self, base_rid):
+        with self.lock:
+            _, page_set, offset = self._locate(base_rid)
+            return self._read(page_set, INDIRECTION_COLUMN, offset), self._read(page_set, SCHEMA_ENCODING_COLUMN, offset)
+
+    """
+    # Rolls back an update of a base record (see update_record) by pointing the record back at the
+    # version it had and invalidating the tail records the update appended, so that no version chain,
+    # time-travel read or merge sees them again.
+    # :param indirection: int     #Indirection of the base record before the update
+    # :param schema: int          #Schema encoding of the base record before the update
+    # :param tail_rid: int        #RID returned by update_record
+    """
+    def rollback_update(self, base_rid, indirection, schema, tail_rid):
+        with self.lock:
+            self._log('rollback_update', base_rid, indirection, schema, tail_rid)
+            self._apply_rollback_update(base_rid, indirection, schema, tail_rid)
+
+    def _apply_rollback_update(self, base_rid, indirection, schema, tail_rid):
+        page_range, page_set, offset = self._locate(base_rid)
+        # The update record, then the snapshot record if the update wrote one
+        aborted = []
+        while tail_rid != indirection and tail_rid != base_rid:
+            _, tail_set, tail_offset = self._locate(tail_rid)
+            aborted.append(tail_rid)
+            previous = self._read(tail_set, INDIRECTION_COLUMN, tail_offset)
+            self._write(tail_set, RID_COLUMN, tail_offset, INVALID_RID)
+            del self.page_directory[tail_rid]
+            tail_rid = previous
+        self._write(page_set, INDIRECTION_COLUMN, offset, indirection)
+        self._write(page_set, SCHEMA_ENCODING_COLUMN, offset, schema)
+        if page_range.versions is not None and base_rid in page_range.versions:
+            versions = page_range.versions[base_rid]
+            del versions[len(versions) - len(aborted):]
+            if not versions:
+                del page_range.versions[base_rid]
+        page_range.dead_tails += len(aborted)
+        page_range.writes += 1
+
+    """
+    # Rolls back the delete of a base record: the record gets its RID back, with its version chain
+    """
+    def undelete_record(self, base_rid):
+        with self.lock:
+            self._log('undelete', base_rid)
+            self._apply_undelete(base_rid)
+
+    def _apply_undelete(self, base_rid):
+        page_range, page_set, offset = self._locate(base_rid)
+        self._write(page_set, RID_COLUMN, offset, base_rid)
+        page_range.deleted.remove(base_rid)
+        page_range.writes += 1
+
+    """
+    # Keeps the page range of a record written by a running transaction from being merged until
+    # release is called for it, so that its writes can still be rolled back in place
+    """
+    def hold(self, base_rid):
+        with self.lock:
+            self.page_ranges[self.page_directory[base_rid][0]].uncommitted += 1
+
+    def release(self, base_rid):
+        with self.lock:
+            range_index = self.page_directory[base_rid][0]
+            page_range = self.page_ranges[range_index]
+            page_range.uncommitted -= 1
+            self._queue_merge(range_index, page_range)
+
+    """
+    # Re-applies a record of the redo log during recovery
+    """
+    def redo(self, operation, args):
+        with self.lock:
+            if operation == 'insert_columns':
+                self.replayed.update(range(args[0], args[0] + len(args[2][0])))
+            else:
+                self.replayed.add(args[0])
+            if operation == 'insert':
+                self._apply_insert(*args)
+                rid = args[0]
+                observe_timestamp(args[1])
+            elif operation == 'insert_columns':
+                self._apply_insert_columns(*args)
+                rid = args[0] + len(args[2][0]) - 1
+                observe_timestamp(args[1])
+            elif operation == 'update':
+                self._apply_update(*args)
+                rid = args[1][-1][RID_COLUMN]
+                observe_timestamp(args[1][-1][TIMESTAMP_COLUMN])
+            elif operation == 'rollback_update':
+                self._apply_rollback_update(*args)
+                rid = 0
+            elif operation == 'undelete':
+                self._apply_undelete(*args)
+                rid = 0
+            else:
+                self._apply_delete(*args)
+                rid = 0
+            self.next_rid = max(self.next_rid, rid + 1)
+
+    """
+    # Returns the table's metadata for a checkpoint together with the LSN of the last log record
+    # it reflects. Pages are not included: the checkpoint flushes them through the bufferpool, and
+    # adds the index images (see Index.write_images) once the table lock is released.
+    """
+    def snapshot(self):
+        with self.lock:
+            page_ranges = []
+            for page_range in self.page_ranges:
+                state = dict(vars(page_range))
+                state['base_pages'] = list(page_range.base_pages)
+                state['tail_pages'] = list(page_range.tail_pages)
+                state['deleted'] = list(page_range.deleted)
+                state['merge_queued'] = False
+                state['uncommitted'] = 0
+                # The time-travel index is rebuilt on demand
+                state['versions'] = None
+                state['tail_bounds'] = None
+                if page_range.zones is not None:
+                    state['zones'] = [list(zone) if zone is not None else None for zone in page_range.zones]
+                page_ranges.append(state)
+            return {
+                'name': self.name,
+                'num_columns': self.num_columns,
+                'key': self.key,
+                'cumulative': self.cumulative,
+                'next_rid': self.next_rid,
+                'num_pages': self.num_pages,
+                # Pages still retired are free as well once the database is reopened
+                'free_pages': self.free_pages + self.released + self.epochs.pending(),
+                'page_directory': dict(self.page_directory),
+                'page_ranges': page_ranges,
+                'indexed': [column for column in range(self.num_columns) if self.index.has_index(column)],
+                'deferred': sorted(self.index.deferred),
+                'auto': sorted(self.index.auto),
+                'lsn': self.log.last_lsn() if self.log is not None else 0,
+            }
+
+    """
+    # Rebuilds a table from a checkpoint snapshot. Its indexes are rebuilt by the caller once the
+    # log tail has been replayed.
+    """
+    @classmethod
+    def restore(cls, snapshot, bufferpool, log):
+        table = cls(snapshot['name'], snapshot['num_columns'], snapshot['key'], bufferpool, log, snapshot.get('cumulative', True))
+        table.next_rid = snapshot['next_rid']
+        table.num_pages = snapshot['num_pages']
+        table.free_pages = list(snapshot.get('free_pages', []))
+        table.page_directory = snapshot['page_directory']
+        for state in snapshot['page_ranges']:
+            page_range = PageRange()
+            vars(page_range).update(state)
+            table.page_ranges.append(page_range)
+        if 'index_file' in snapshot:
+            table.index.restore_images(snapshot['index_file'])
+        return table
+
+    """
+    # Reads the given user columns of a base record
+    # :param relative_version: 0 for the latest version, -1 for the one before it and so on
+    # Returns a list of values, one for each entry of columns
+    """
+    def read_record(self, base_rid, columns, relative_version=0):
+        with self.lock:
+            range_index = self.page_directory[base_rid][0]
+            page_range, page_set, offset = self._locate(base_rid)
+            # Reads walking the base pages in order (range sums, scans) are detected by the bufferpool
+            position = range_index * BASE_PAGES_PER_RANGE + offset // RECORDS_PER_PAGE
+            scan = self.bufferpool.note_access(self, INDIRECTION_COLUMN, position)
+            indirection = self._read(page_set, INDIRECTION_COLUMN, offset, scan)
+            values = {}
+
+            if relative_version == 0:
+                # Columns never updated since the last merge are read straight from the base page
+                scan = self.bufferpool.note_access(self, SCHEMA_ENCODING_COLUMN, position)
+                schema = self._read(page_set, SCHEMA_ENCODING_COLUMN, offset, scan)
+                pending = [column for column in columns if schema & (1 << column)]
+                if indirection > page_range.tps and pending:
+                    self._resolve(base_rid, indirection, pending, values, page_range.tps)
+            else:
+                tail_rid = indirection
+                for _ in range(-relative_version):
+                    if tail_rid == INVALID_RID:
+                        break
+                    previous = self._read_tail(tail_rid, INDIRECTION_COLUMN)
+                    if previous == base_rid:
+                        # The snapshot record is the oldest version
+                        break
+                    tail_rid = previous
+                if tail_rid != INVALID_RID:
+                    self._resolve(base_rid, tail_rid, columns, values, 0)
+
+            result = []
+            for column in columns:
+                if column in values:
+                    result.append(values[column])
+                else:
+                    physical = column + NUM_METADATA_COLUMNS
+                    scan = self.bufferpool.note_access(self, physical, position)
+                    result.append(self._read(page_set, physical, offset, scan))
+            return result
+
+    """
+    # Reads the given user columns of a base record as they were at time_stamp (in the unit of
+    # timestamp()). Returns a list of values, one for each entry of columns, or None if the record
+    # was inserted after time_stamp.
+    # The version is found by a binary search over the record's tail records, which are ordered by
+    # TIMESTAMP_COLUMN; the timestamp bounds of each tail page settle most comparisons without
+    # reading the page. The values are then resolved from that version as for relative versions.
+    """
+    def read_record_as_of(self, base_rid, columns, time_stamp):
+        with self.lock:
+            page_range, page_set, offset = self._locate(base_rid)
+            indirection = self._read(page_set, INDIRECTION_COLUMN, offset)
+            if indirection == INVALID_RID:
+                # Never updated: the base record is the only version
+                if self._read(page_set, TIMESTAMP_COLUMN, offset) > time_stamp:
+                    return None
+                return self.read_record(base_rid, columns)
+            if self._read_tail(indirection, TIMESTAMP_COLUMN) <= time_stamp:
+                return self.read_record(base_rid, columns)
+
+            versions = self._time_index(page_range)[base_rid]
+            # Number of versions made at or before time_stamp, the snapshot record (the version the
+            # record was inserted with) being versions[0]
+            low, high = 1, len(versions)
+            while low < high:
+                middle = (low + high) // 2
+                if self._made_by(page_range, versions[middle], time_stamp):
+                    low = middle + 1
+                else:
+                    high = middle
+            if low == 1 and self._read_tail(versions[0], TIMESTAMP_COLUMN) > time_stamp:
+                return None
+            # Columns never updated still hold their original value in the base record
+            schema = self._read(page_set, SCHEMA_ENCODING_COLUMN, offset)
+            values = {}
+            for column in columns:
+                if not schema & (1 << column):
+                    values[column] = self._read(page_set, column + NUM_METADATA_COLUMNS, offset)
+            self._resolve(base_rid, versions[low - 1], [column for column in columns if column not in values], values, 0)
+            return [values[column] for column in columns]
+
+    """
+    # Returns True if the update record tail_rid was written at or before time_stamp
+    """
+    def _made_by(self, page_range, tail_rid, time_stamp):
+        offset = self.page_directory[tail_rid][2]
+        lowest, highest = page_range.tail_bounds[offset // RECORDS_PER_PAGE]
+        if highest <= time_stamp:
+            return True
+        if lowest > time_stamp:
+            return False
+        return self._read_tail(tail_rid, TIMESTAMP_COLUMN) <= time_stamp
+
+    """
+    # Returns the versions of the records of a page range (see PageRange.versions), building the
+    # time-travel index from its tail pages on first use
+    """
+    def _time_index(self, page_range):
+        if page_range.versions is not None:
+            return page_range.versions
+        versions = {}
+        # tail RID -> base RID
+        owners = {}
+        page_range.tail_bounds = []
+        remaining = page_range.num_tail_records
+        for page_set in page_range.tail_pages:
+            rids, previous, times = (self.bufferpool.read_page(self.name, page_set[column]) for column in (RID_COLUMN, INDIRECTION_COLUMN, TIMESTAMP_COLUMN))
+            bounds = [float('inf'), float('-inf')]
+            for slot in range(min(remaining, RECORDS_PER_PAGE)):
+                if rids[slot] == INVALID_RID:
+                    # Rolled back
+                    continue
+                base_rid = owners.get(previous[slot])
+                if base_rid is None:
+                    # Snapshot record, pointing at the base record
+                    base_rid = previous[slot]
+                    versions[base_rid] = array('q')
+                else:
+                    bounds[0] = min(bounds[0], times[slot])
+                    bounds[1] = max(bounds[1], times[slot])
+                versions[base_rid].append(rids[slot])
+                owners[rids[slot]] = base_rid
+            page_range.tail_bounds.append(bounds)
+            remaining -= RECORDS_PER_PAGE
+        page_range.versions = versions
+        self.bufferpool.signal_pressure()
+        return versions
+
+    """
+    # Adds the tail records just appended for an update to the time-travel index
+    """
+    def _add_version(self, page_range, base_rid, tails):
+        if base_rid not in page_range.versions:
+            page_range.versions[base_rid] = array('q')
+        for record in tails:
+            page_range.versions[base_rid].append(record[RID_COLUMN])
+        # tails holds the snapshot record first, if any, and the update record last
+        record = tails[-1]
+        page = self.page_directory[record[RID_COLUMN]][2] // RECORDS_PER_PAGE
+        while len(page_range.tail_bounds) <= page:
+            page_range.tail_bounds.append([float('inf'), float('-inf')])
+        bounds = page_range.tail_bounds[page]
+        bounds[0] = min(bounds[0], record[TIMESTAMP_COLUMN])
+        bounds[1] = max(bounds[1], record[TIMESTAMP_COLUMN])
+
+    """
+    # Returns the page ids of a physical column for the count base pages following position,
+    # where position numbers base pages in scan order (range by range)
+    """
+    def upcoming_pages(self, column, position, count):
+        page_ids = []
+        for next_position in range(position + 1, position + 1 + count):
+            range_index, page_index = divmod(next_position, BASE_PAGES_PER_RANGE)
+            if range_index >= len(self.page_ranges):
+                break
+            base_pages = self.page_ranges[range_index].base_pages
+            # Compacted ranges may hold fewer base pages
+            if page_index < len(base_pages):
+                page_ids.append(base_pages[page_index][column])
+        return page_ids
+
+    def _read_tail(self, tail_rid, column):
+        _, page_set, offset = self._locate(tail_rid)
+        return self._read(page_set, column, offset)
+
+    """
+    # Walks the version chain starting at tail_rid until every column in pending is found, the chain
+    # reaches the base record, or it reaches tail records already merged (RID <= cutoff).
+    # Found values are stored in values.
+    """
+    def _resolve(self, base_rid, tail_rid, pending, values, cutoff):
+        pending = list(pending)
+        while pending and tail_rid != base_rid and tail_rid > cutoff:
+            _, page_set, offset = self._locate(tail_rid)
+            schema = self._read(page_set, SCHEMA_ENCODING_COLUMN, offset)
+            remaining = []
+            for column in pending:
+                if schema & (1 << column):
+                    values[column] = self._read(page_set, column + NUM_METADATA_COLUMNS, offset)
+                else:
+                    remaining.append(column)
+            pending = remaining
+            tail_rid = self._read(page_set, INDIRECTION_COLUMN, offset)
+
+    """
+    # Returns (latest value of column, rid) for every live base record.
+    # Base pages are read a whole page at a time; only records updated since the last merge of
+    # their range are resolved one by one. The table lock is held for one page range at a time.
+    """
+    def scan_column(self, column):
+        pairs = []
+        for range_index in range(len(self.page_ranges)):
+            pairs.extend(self.scan_range(range_index, column))
+        return pairs
+
+    """
+    # Returns (latest value of column, rid) for every live base record of one page range. The range
+    # is captured under the table lock (see capture_range) and the pairs are built once it is released.
+    """
+    def scan_range(self, range_index, column):
+        pairs = []
+        with self.epochs.pin():
+            pages, latest = self.capture_range(range_index, [column])
+            for page_index, (rids, views) in enumerate(pages):
+                first = page_index * RECORDS_PER_PAGE
+                values = views[0]
+                for slot, rid in enumerate(rids):
+                    if rid == INVALID_RID:
+                        continue
+                    row = latest.get(first + slot)
+                    pairs.append((row[0] if row is not None else values[slot], rid))
+        return pairs
+
+    """
+    # Returns read-only views over the base pages of a page range, for bulk readers that should not
+    # create a Python object per record: (views, overlay).
+    # views lists (rids, values) for each base page: views of the RID column and of the user column,
+    # cut to the records the page holds, as memoryviews or, with as_numpy, read-only NumPy arrays.
+    # Deleted records have RID 0. The RID views are copies, so they keep the deletes as of the call;
+    # merges swap in new pages and leave the viewed value pages untouched.
+    # Base values are stale for records updated since the last merge of the range: overlay lazily
+    # iterates over (offset, latest value) for those, offset being the record's position in the range
+    # (page offset // RECORDS_PER_PAGE, slot offset % RECORDS_PER_PAGE). Each value is read when the
+    # iterator reaches it, so callers wanting the range as of the call iterate under the table lock.
+    # Callers using the views after releasing the table lock keep an epoch pinned meanwhile, so the
+    # pages of a merge are not reclaimed under them.
+    """
+    def column_views(self, range_index, column, as_numpy=False):
+        if as_numpy and numpy is None:
+            raise ImportError('column_views(as_numpy=True) requires NumPy')
+        physical = column + NUM_METADATA_COLUMNS
+        views = []
+        # (offset, base RID) of the records updated since the last merge
+        pending = []
+        with self.lock:
+            page_range = self.page_ranges[range_index]
+            remaining = page_range.num_base_records
+            for page_index, page_set in enumerate(page_range.base_pages):
+                count = min(remaining, RECORDS_PER_PAGE)
+                position = range_index * BASE_PAGES_PER_RANGE + page_index
+                pages = []
+                for page_column in (RID_COLUMN, physical, INDIRECTION_COLUMN, SCHEMA_ENCODING_COLUMN):
+                    scan = self.bufferpool.note_access(self, page_column, position)
+                    pages.append(self.bufferpool.view_page(self.name, page_set[page_column], scan)[:count])
+                # Deletes write the RID column in place
+                pages[0] = memoryview(pages[0].tobytes()).cast('q')
+                rids, values, indirections, schemas = pages
+                if numpy is not None:
+                    rids, values, indirections, schemas = (numpy.frombuffer(page, dtype=numpy.int64) for page in pages)
+                    updated = numpy.flatnonzero((indirections > page_range.tps) & ((schemas >> column) & 1 == 1) & (rids != INVALID_RID)).tolist()
+                else:
+                    updated = [slot for slot in range(count) if indirections[slot] > page_range.tps and schemas[slot] & (1 << column) and rids[slot] != INVALID_RID]
+                pending.extend((page_index * RECORDS_PER_PAGE + slot, int(rids[slot])) for slot in updated)
+                views.append((rids, values) if as_numpy else (pages[0], pages[1]))
+                remaining -= RECORDS_PER_PAGE
+        return views, self._overlay(pending, column)
+
+    """
+    # Yields (offset, latest value of column) of the records of pending, skipping those deleted and
+    # merged away since (see column_views)
+    """
+    def _overlay(self, pending, column):
+        for offset, rid in pending:
+            with self.lock:
+                if rid not in self.page_directory:
+                    continue
+                value = self.read_record(rid, [column])[0]
+            yield offset, value
+
+    """
+    # Returns (rids, values) for the live records of a page range whose column lies in [begin, end]:
+    # their base RIDs and, for each entry of columns, a list of their latest values, in storage order.
+    # Pages are read whole through column_views (as NumPy arrays when NumPy is installed); only records
+    # updated since the last merge of the range are read one by one.
+    """
+    def filter_range(self, range_index, column, begin, end, columns):
+        with self.lock:
+            views, overlay = self.column_views(range_index, column, numpy is not None)
+            latest = dict(overlay)
+            offsets = []
+            for page_index, (rids, values) in enumerate(views):
+                first = page_index * RECORDS_PER_PAGE
+                if numpy is not None:
+                    slots = numpy.flatnonzero((values >= begin) & (values <= end) & (rids != INVALID_RID)).tolist()
+                else:
+                    slots = [slot for slot, value in enumerate(values) if begin <= value <= end and rids[slot] != INVALID_RID]
+                offsets.extend(first + slot for slot in slots if first + slot not in latest)
+            updated = [offset for offset, value in latest.items() if begin <= value <= end]
+            if updated:
+                offsets.extend(updated)
+                offsets.sort()
+            rids = [int(views[offset // RECORDS_PER_PAGE][0][offset % RECORDS_PER_PAGE]) for offset in offsets]
+            filtered = views, latest
+            results = []
+            for projected in columns:
+                if projected != column:
+                    views, overlay = self.column_views(range_index, projected, numpy is not None)
+                    latest = dict(overlay)
+                else:
+                    views, latest = filtered
+                values = []
+                for offset in offsets:
+                    value = latest.get(offset)
+                    if value is None:
+                        value = int(views[offset // RECORDS_PER_PAGE][1][offset % RECORDS_PER_PAGE])
+                    values.append(value)
+                results.append(values)
+            return rids, results
+
+    """
+    # Returns the latest values of every live base record of a page range, as one array('q') per user
+    # column, in storage order, or None past the last range. The state of the range is captured under
+    # the table lock (see capture_range), so that records are never torn by a concurrent update, and
+    # the columns are copied from it once the lock is released.
+    """
+    def live_columns(self, range_index):
+        with self.epochs.pin():
+            return self.build_columns(self.capture_range(range_index))
+
+    """
+    # Captures what build_columns needs to copy the latest values of a page range, or returns None
+    # past the last range: views of its base pages, a copy of their RID column (which deletes write in
+    # place), and the latest values of the records updated since the last merge, as
+    # ([(rids, [view of each column])] for each base page, {offset in the range: [latest values]}).
+    # Base values are only replaced by merges, which retire the pages, so the views stay valid outside
+    # the table lock as long as the caller keeps an epoch pinned while it reads them.
+    # :param columns: list     #User columns to capture, all of them if None
+    """
+    def capture_range(self, range_index, columns=None):
+        if columns is None:
+            columns = list(range(self.num_columns))
+        with self.lock:
+            if range_index >= len(self.page_ranges):
+                return None
+            page_range = self.page_ranges[range_index]
+            remaining = page_range.num_base_records
+            pages = []
+            updated = []
+            for page_index, page_set in enumerate(page_range.base_pages):
+                count = min(remaining, RECORDS_PER_PAGE)
+                position = range_index * BASE_PAGES_PER_RANGE + page_index
+                views = []
+                for page_column in [RID_COLUMN, INDIRECTION_COLUMN] + [column + NUM_METADATA_COLUMNS for column in columns]:
+                    scan = self.bufferpool.note_access(self, page_column, position)
+                    views.append(self.bufferpool.view_page(self.name, page_set[page_column], scan)[:count])
+                rids = memoryview(views[0].tobytes()).cast('q')
+                indirections = views[1]
+                if not page_range.pending:
+                    # No record of the range was updated since its last merge
+                    slots = []
+                elif numpy is not None:
+                    slots = numpy.flatnonzero((numpy.frombuffer(indirections, dtype=numpy.int64) > page_range.tps) & (numpy.frombuffer(rids, dtype=numpy.int64) != INVALID_RID)).tolist()
+                else:
+                    slots = [slot for slot, indirection in enumerate(indirections) if indirection > page_range.tps and rids[slot] != INVALID_RID]
+                updated.extend((page_index * RECORDS_PER_PAGE + slot, rids[slot]) for slot in slots)
+                pages.append((rids, views[2:]))
+                remaining -= RECORDS_PER_PAGE
+            latest = {offset: self.read_record(rid, columns) for offset, rid in updated}
+        return pages, latest
+
+    """
+    # Returns the columns of a state returned by capture_range, like live_columns. Runs without the
+    # table lock.
+    """
+    def build_columns(self, state):
+        if state is None:
+            return None
+        pages, latest = state
+        live = array('q')
+        for rids, _ in pages:
+            live.frombytes(rids.cast('B'))
+        columns = []
+        for column in range(self.num_columns):
+            values = array('q')
+            for _, views in pages:
+                values.frombytes(views[column].cast('B'))
+            for offset, row in latest.items():
+                values[offset] = row[column]
+            if INVALID_RID in live:
+                values = array('q', compress(values, live))
+            columns.append(values)
+        return columns
+
+    """
+    # Returns the RIDs of every live base record whose latest value of column lies in [begin, end]
+    # Used for columns without an index
+    """
+    def find_rids(self, column, begin, end):
+        pairs = self.scan_column(column)
+        self.index.note_scan(column, len(pairs))
+        return [rid for value, rid in pairs if begin <= value <= end]
+
+    """
+    # Returns (latest value of column, rid) for the records among base_rids that exist and are not deleted
+    """
+    def read_live(self, base_rids, column):
+        pairs = []
+        with self.lock:
+            for rid in base_rids:
+                if rid not in self.page_directory:
+                    continue
+                _, page_set, offset = self._locate(rid)
+                if self._read(page_set, RID_COLUMN, offset) != INVALID_RID:
+                    pairs.append((self.read_record(rid, [column])[0], rid))
+        return pairs
+
+    """
+    # Queues the merges held back while the redo log was replayed
+    """
+    def end_replay(self):
+        with self.lock:
+            self.replaying = False
+            for range_index, page_range in enumerate(self.page_ranges):
+                self._queue_merge(range_index, page_range)
+
+    def _add_pending(self, range_index, page_range):
+        page_range.pending += 1
+        self._queue_merge(range_index, page_range)
+
+    def _queue_merge(self, range_index, page_range):
+        if page_range.pending >= MERGE_THRESHOLD and not page_range.merge_queued and not self.replaying and not page_range.uncommitted:
+            page_range.merge_queued = True
+            if self.merge_thread is None:
+                self.merge_thread = threading.Thread(target=self._merge_worker, daemon=True)
+                self.merge_thread.start()
+            self.merge_queue.put(range_index)
+
+    def _merge_worker(self):
+        while True:
+            range_index = self.merge_queue.get()
+            if range_index is None:
+                self.merge_queue.task_done()
+                return
+            try:
+                with self.merge_lock, trace.span('merge', table=self.name, range=range_index):
+                    self.__merge(range_index)
+                with trace.span('refresh filters', table=self.name):
+                    self.index.refresh_filters()
+                self.index.review()
+                # One generation per round of merges rather than per merge, rate-limited by refresh
+                if self.shared is not None and self.merge_queue.empty():
+                    with trace.span('publish snapshot', table=self.name):
+                        self.shared.refresh()
+            finally:
+                self.merge_queue.task_done()
+
+    """
+    # Stops the merge thread once all queued merges are done
+    """
+    def close(self):
+        if self.merge_thread is not None:
+            self.merge_queue.put(None)
+            self.merge_thread.join()
+            self.merge_thread = None
+        if self.shared is not None:
+            self.shared.close()
+
+    """
+    # Merges the tail records of a page range into fresh base pages and reclaims deleted records.
+    # The new pages are built from a snapshot without holding the table lock; the lock is only taken
+    # to take the snapshot and to swap the new pages in.
+    # The replaced pages are retired rather than freed, and are reused once every reader that could
+    # have found them is done (and, on disk, once a checkpoint no longer points to them).
+    """
+    def __merge(self, range_index):
+        page_range = self.page_ranges[range_index]
+        num_physical = self.num_columns + NUM_METADATA_COLUMNS
+
+        with self.lock:
+            page_range.merge_queued = False
+            if page_range.uncommitted:
+                # Queued again once the transactions writing to the range are done
+                return
+            pending = page_range.pending
+            tps = page_range.tps
+            boundary = page_range.last_tail_rid
+            num_base = page_range.num_base_records
+            num_tails = page_range.num_tail_records
+            deleted = set(page_range.deleted)
+            snapshot = []
+            for offset in range(num_base):
+                page_set = page_range.base_pages[offset // RECORDS_PER_PAGE]
+                snapshot.append((self._read(page_set, RID_COLUMN, offset),
+                                 self._read(page_set, INDIRECTION_COLUMN, offset),
+                                 self._read(page_set, SCHEMA_ENCODING_COLUMN, offset)))
+            old_base = list(page_range.base_pages)
+            old_tails = list(page_range.tail_pages)
+
+        # Tail records reachable from deleted records are dead
+        dead_tails = []
+        for offset, (rid, indirection, _) in enumerate(snapshot):
+            if rid != INVALID_RID:
+                continue
+            tail_rid = indirection
+            while tail_rid != INVALID_RID and tail_rid in self.page_directory:
+                if not self.page_directory[tail_rid][1]:
+                    break
+                dead_tails.append(tail_rid)
+                tail_rid = self._read_tail(tail_rid, INDIRECTION_COLUMN)
+        dead_tail_set = set(dead_tails)
+        compact_tails = page_range.dead_tails + len(dead_tails) >= TAIL_COMPACTION_RATIO * max(num_tails, 1)
+
+        # Build the merged base pages for the live records
+        new_base = []
+        moved = []
+        for offset, (rid, indirection, schema) in enumerate(snapshot):
+            if rid == INVALID_RID:
+                continue
+            page_set = old_base[offset // RECORDS_PER_PAGE]
+            values = [self._read(page_set, column, offset) for column in range(num_physical)]
+            if indirection > tps:
+                merged = {}
+                columns = [column for column in range(self.num_columns) if schema & (1 << column)]
+                self._resolve(rid, indirection, columns, merged, tps)
+                for column, value in merged.items():
+                    values[column + NUM_METADATA_COLUMNS] = value
+            new_offset = len(moved)
+            if new_offset % RECORDS_PER_PAGE == 0:
+                new_base.append([Page() for _ in range(num_physical)])
+            for column, value in enumerate(values):
+                new_base[-1][column].write(value)
+            moved.append((rid, offset, new_offset))
+
+        # Copy the tail records that are still reachable
+        new_tails = []
+        moved_tails = []
+        if compact_tails:
+            for offset in range(num_tails):
+                page_set = old_tails[offset // RECORDS_PER_PAGE]
+                tail_rid = self._read(page_set, RID_COLUMN, offset)
+                if tail_rid in dead_tail_set or tail_rid not in self.page_directory:
+                    continue
+                self._copy_record(page_set, offset, new_tails, len(moved_tails), num_physical)
+                moved_tails.append((tail_rid, len(moved_tails)))
+
+        with self.lock:
+            # Records inserted into the range while the new pages were built are copied as they are
+            for offset in range(num_base, page_range.num_base_records):
+                page_set = page_range.base_pages[offset // RECORDS_PER_PAGE]
+                rid = self._read(page_set, RID_COLUMN, offset)
+                self._copy_record(page_set, offset, new_base, len(moved), num_physical)
+                moved.append((rid, offset, len(moved)))
+
+            # Pick up updates and deletes that happened after the snapshot
+            for rid, old_offset, new_offset in moved:
+                page_set = page_range.base_pages[old_offset // RECORDS_PER_PAGE]
+                new_set = new_base[new_offset // RECORDS_PER_PAGE]
+                slot = new_offset % RECORDS_PER_PAGE
+                for column in (INDIRECTION_COLUMN, RID_COLUMN, SCHEMA_ENCODING_COLUMN):
+                    new_set[column].update(slot, self._read(page_set, column, old_offset))
+
+            if compact_tails:
+                for offset in range(num_tails, page_range.num_tail_records):
+                    page_set = page_range.tail_pages[offset // RECORDS_PER_PAGE]
+                    tail_rid = self._read(page_set, RID_COLUMN, offset)
+                    if tail_rid == INVALID_RID:
+                        # Rolled back meanwhile
+                        continue
+                    self._copy_record(page_set, offset, new_tails, len(moved_tails), num_physical)
+                    moved_tails.append((tail_rid, len(moved_tails)))
+
+            # Swap in the new pages. Pages added to the range after the snapshot are retired as well.
+            retired = [page_id for page_set in page_range.base_pages for page_id in page_set]
+            page_range.base_pages = [[self._add_page(page) for page in page_set] for page_set in new_base]
+            for rid, _, new_offset in moved:
+                self.page_directory[rid] = (range_index, False, new_offset)
+            page_range.num_base_records = len(moved)
+
+            if compact_tails:
+                retired.extend(page_id for page_set in page_range.tail_pages for page_id in page_set)
+                page_range.tail_pages = [[self._add_page(page) for page in page_set] for page_set in new_tails]
+                for tail_rid, new_offset in moved_tails:
+                    self.page_directory[tail_rid] = (range_index, True, new_offset)
+                page_range.num_tail_records = len(moved_tails)
+                page_range.dead_tails = 0
+                page_range.versions = None
+                page_range.tail_bounds = None
+            else:
+                page_range.dead_tails += len(dead_tails)
+
+            # Free the page directory entries of deleted records
+            for rid in deleted:
+                self.page_directory.pop(rid, None)
+            for tail_rid in dead_tails:
+                self.page_directory.pop(tail_rid, None)
+
+            page_range.deleted = [rid for rid in page_range.deleted if rid not in deleted]
+            page_range.tps = max(tps, boundary)
+            page_range.pending = max(page_range.pending - pending, 0)
+            # Readers that found the old pages before the swap may still be reading them
+            self.epochs.retire(retired)
+        self.reclaim_pages()
+
+    """
+    # Appends a copy of the record at offset to page_sets, a list of page sets made of Page objects
+    """
+    def _copy_record(self, page_set, offset, page_sets, new_offset, num_physical):
+        if new_offset % RECORDS_PER_PAGE == 0:
+            page_sets.append([Page() for _ in range(num_physical)])
+        for column in range(num_physical):
+            page_sets[-1][column].write(self._read(page_set, column, offset))
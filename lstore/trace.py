@@ -0,0 +1,226 @@
+"""
+Opt-in tracer of the storage engine. Queries, transactions, transaction workers, the bufferpool, merges
+and log flushes record spans (name, begin, end, thread, attributes) once start() is called; the last
+TRACE_BUFFER_EVENTS of them are kept in a ring buffer and dump() writes them as Chrome trace JSON, which
+chrome://tracing and https://ui.perfetto.dev display as one timeline per thread.
+Waits are recorded as spans of their own: for the table, bufferpool and log locks (only when the lock
+is held by another thread), for the lock manager's ordered acquisition and for retry backoffs.
+While tracing is off a span costs a single check.
+
+Example:
+trace.start()
+... run the workload ...
+trace.dump('trace.json')
+"""
+import collections
+import json
+import os
+import threading
+import time
+import weakref
+from functools import wraps
+
+from lstore.config import TRACE_BUFFER_EVENTS
+
+# Ring buffer of (phase, name, begin, end, thread id, attributes), None while tracing is off
+_events = None
+# Events of the last run once stopped
+_recorded = []
+_origin = 0.0
+# thread id -> thread name, for the threads that recorded something
+_threads = {}
+# Bufferpool pages accessed by the calling thread, counted while tracing
+_local = threading.local()
+# owner -> {attribute: name} of the locks registered with register_lock, forgotten with their owner
+_locks = weakref.WeakKeyDictionary()
+
+
+def enabled():
+    return _events is not None
+
+
+"""
+# Starts recording, dropping whatever was recorded before
+# :param capacity: int     #Spans kept; older ones are overwritten
+"""
+def start(capacity=TRACE_BUFFER_EVENTS):
+    global _events, _origin
+    _threads.clear()
+    _origin = time.perf_counter()
+    _events = collections.deque(maxlen=capacity)
+    for owner, attribute, name in _registered():
+        lock = getattr(owner, attribute)
+        if not isinstance(lock, TracedLock):
+            setattr(owner, attribute, TracedLock(lock, name))
+
+
+"""
+# Stops recording. What was recorded can still be dumped.
+"""
+def stop():
+    global _events
+    for owner, attribute, _ in _registered():
+        lock = getattr(owner, attribute)
+        if isinstance(lock, TracedLock):
+            setattr(owner, attribute, lock.lock)
+    if _events is not None:
+        _recorded[:] = list(_events)
+    _events = None
+
+
+"""
+# Writes what was recorded (so far, if still tracing) to path as Chrome trace JSON
+"""
+def dump(path):
+    events = list(_events) if _events is not None else list(_recorded)
+    pid = os.getpid()
+    trace = []
+    for tid, name in list(_threads.items()):
+        trace.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+    for phase, name, begin, end, tid, attributes in events:
+        event = {'name': name, 'ph': phase, 'ts': (begin - _origin) * 1e6, 'pid': pid, 'tid': tid, 'args': attributes}
+        if phase == 'X':
+            event['dur'] = (end - begin) * 1e6
+        else:
+            event['s'] = 't'
+        trace.append(event)
+    with open(path, 'w') as file:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file, default=repr)
+
+
+class Span:
+
+    """
+    # Records its block as a span. Attributes known once the block ran are added with set().
+    """
+    __slots__ = ('name', 'attributes', 'begin', 'pages')
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.pages = getattr(_local, 'pages', 0)
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        pages = getattr(_local, 'pages', 0) - self.pages
+        if pages:
+            self.attributes['pages'] = pages
+        _record('X', self.name, self.begin, end, self.attributes)
+
+
+class _NoSpan:
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def _record(phase, name, begin, end, attributes):
+    events = _events
+    if events is None:
+        return
+    ident = threading.get_ident()
+    if ident not in _threads:
+        _threads[ident] = threading.current_thread().name
+    events.append((phase, name, begin, end, ident, attributes))
+
+
+"""
+# Returns a context manager recording its block as a span with the given attributes
+"""
+def span(name, **attributes):
+    if _events is None:
+        return _NO_SPAN
+    return Span(name, attributes)
+
+
+"""
+# Records an instant event (a point in time rather than a span)
+"""
+def instant(name, **attributes):
+    if _events is not None:
+        now = time.perf_counter()
+        _record('i', name, now, now, attributes)
+
+
+"""
+# Counts a bufferpool page access of the calling thread, reported as the pages attribute of its spans
+"""
+def page_accessed():
+    if _events is not None:
+        _local.pages = getattr(_local, 'pages', 0) + 1
+
+
+"""
+# Decorator recording each call of a method as a span named after it, with the call's arguments
+# (self excluded) and its result when it is True or False
+"""
+def traced(method):
+    name = method.__qualname__
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        if _events is None:
+            return method(*args, **kwargs)
+        with Span(name, {'args': args[1:]}) as current:
+            result = method(*args, **kwargs)
+            if result is True or result is False:
+                current.set(result=result)
+            return result
+    return wrapper
+
+
+class TracedLock:
+
+    """
+    # Wraps a lock while tracing so that acquiring it records a wait span whenever it is held by
+    # another thread. Both the wrapper and the lock it wraps can be used to acquire and release it.
+    """
+    def __init__(self, lock, name):
+        self.lock = lock
+        self.name = name
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        with span('wait ' + self.name):
+            return self.lock.acquire(True, timeout)
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+
+"""
+# Registers the lock stored in owner.attribute, which is wrapped in a TracedLock while tracing
+"""
+def register_lock(owner, attribute, name):
+    _locks.setdefault(owner, {})[attribute] = name
+    if _events is not None:
+        setattr(owner, attribute, TracedLock(getattr(owner, attribute), name))
+
+
+def _registered():
+    return [(owner, attribute, name) for owner, locks in list(_locks.items()) for attribute, name in locks.items()]
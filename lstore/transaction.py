@@ -1,14 +1,28 @@
 from lstore.table import Table, Record
 from lstore.index import Index
+from lstore.lock_manager import set_current_transaction
+from lstore import trace
 
 class Transaction:
 
     """
     # Creates a transaction object.
+    # Transactions use strict two-phase locking: queries lock the records they touch as they run
+    # (without waiting, see LockManager) and every lock is held until commit or abort.
+    # :param ordered: bool     #Take the locks of every queued query before running the first one,
+    #                          #waiting for them in canonical order instead of aborting on conflicts
     """
-    def __init__(self):
+    def __init__(self, ordered=False):
+        self.ordered = ordered
         self.queries = []
-        pass
+        # table -> items locked in it by this run
+        self.locks = {}
+        # (table, RID, rollback, args) for each write done so far: rollback(*args) undoes it, in reverse
+        # order on abort (see Query._undo)
+        self.undo = []
+        # True if the last run aborted because a lock was held by another transaction, in which case
+        # running it again may commit
+        self.conflicted = False
 
     """
     # Adds the given query to this transaction
@@ -16,28 +30,160 @@ class Transaction:
     # q = Query(grades_table)
     # t = Transaction()
     # t.add_query(q.update, grades_table, 0, *[None, 1, None, 2, None])
+    # Sharded tables are rejected: their shard processes hold no locks for transactions and cannot
+    # roll their writes back.
     """
     def add_query(self, query, table, *args):
-        self.queries.append((query, args))
+        if getattr(table, 'shard_bounds', None):
+            raise ValueError('transactions do not support sharded table %s' % table.name)
         # use grades_table for aborting
+        self.queries.append((query, table, args))
+
+    """
+    # Returns what the queued queries access, as far as their arguments tell:
+    # (reads, writes, scans) where reads and writes are sets of (table name, primary key) and scans is
+    # a list of (table name, low key, high key) ranges read by aggregates. Selects on other columns
+    # scan the whole table (low and high are None), and writes to (table name, None) stand for
+    # queries whose footprint is unknown.
+    """
+    def access_set(self):
+        reads = set()
+        writes = set()
+        scans = []
+        for query, table, args in self.queries:
+            name = getattr(query, '__name__', None)
+            if name == 'insert':
+                writes.add((table.name, args[table.key]))
+            elif name == 'update':
+                writes.add((table.name, args[0]))
+                if len(args) > table.key + 1 and args[table.key + 1] is not None:
+                    writes.add((table.name, args[table.key + 1]))
+            elif name in ('delete', 'increment', 'apply'):
+                writes.add((table.name, args[0]))
+                if name == 'apply' and args[1] == table.key:
+                    # The new key is only known once fn runs
+                    writes.add((table.name, None))
+            elif name in ('select', 'select_version', 'select_as_of'):
+                if args[1] == table.key:
+                    reads.add((table.name, args[0]))
+                else:
+                    scans.append((table.name, None, None))
+            elif name in ('sum', 'sum_version', 'sum_as_of'):
+                scans.append((table.name, args[0], args[1]))
+            else:
+                writes.add((table.name, None))
+        return reads, writes, scans
+
+    """
+    # Returns {table: {item: exclusive}}, the locks the queued queries will ask for, found by looking
+    # up the records they name as the database is now. Records a query finds later on (inserted by
+    # others meanwhile) are still locked as it runs.
+    """
+    def lock_set(self):
+        requests = {}
+
+        def request(table, items, exclusive):
+            held = requests.setdefault(table, {})
+            for item in items:
+                held[item] = held.get(item, False) or exclusive
+
+        for query, table, args in self.queries:
+            name = getattr(query, '__name__', None)
+            with table.lock:
+                if name == 'insert':
+                    request(table, [('key', args[table.key])], True)
+                elif name in ('update', 'delete', 'increment', 'apply'):
+                    key = args[0]
+                    new_key = None
+                    if name == 'update' and len(args) > table.key + 1 and args[table.key + 1] not in (None, key):
+                        new_key = args[table.key + 1]
+                    request(table, table.index.locate(table.key, key), True)
+                    # Keeping the key locked stops others from deleting and recreating it meanwhile
+                    request(table, [('key', key)], name == 'delete' or new_key is not None)
+                    if new_key is not None:
+                        request(table, [('key', new_key)], True)
+                elif name in ('select', 'select_version', 'select_as_of'):
+                    key, column = args[0], args[1]
+                    rids = table.index.locate(column, key)
+                    if rids is None:
+                        rids = table.find_rids(column, key, key)
+                    request(table, rids, False)
+                    if column == table.key:
+                        request(table, [('key', key)], False)
+                elif name in ('sum', 'sum_version', 'sum_as_of'):
+                    request(table, table.index.locate_range(args[0], args[1], table.key), False)
+        return requests
+
+    """
+    # Locks items of table for this transaction. Returns False (and marks the transaction as
+    # conflicted) if one of them is held by another transaction.
+    """
+    def lock(self, table, items, exclusive=False):
+        held = self.locks.setdefault(table, set())
+        for item in items:
+            if not table.lock_manager.acquire(item, self, exclusive):
+                trace.instant('lock conflict', table=table.name, item=item, exclusive=exclusive)
+                self.conflicted = True
+                return False
+            held.add(item)
+        return True
 
-        
     # If you choose to implement this differently this method must still return True if transaction commits or False on abort
+    @trace.traced
     def run(self):
-        for query, args in self.queries:
-            result = query(*args)
-            # If the query has failed the transaction should abort
-            if result == False:
-                return self.abort()
-        return self.commit()
-
-    
+        self.locks = {}
+        self.undo = []
+        self.conflicted = False
+        if self.ordered:
+            # Tables are locked in name order, each in its lock manager's canonical order
+            for table, requests in sorted(self.lock_set().items(), key=lambda entry: entry[0].name):
+                with trace.span('acquire locks', table=table.name, locks=len(requests)):
+                    table.lock_manager.acquire_all(requests.items(), self)
+                self.locks[table] = set(requests)
+        set_current_transaction(self)
+        try:
+            for query, table, args in self.queries:
+                try:
+                    result = query(*args)
+                except Exception:
+                    result = False
+                # If the query has failed the transaction should abort
+                if result is False:
+                    return self.abort()
+            return self.commit()
+        finally:
+            set_current_transaction(None)
+
+    """
+    # Rolls back the writes of this run in place, then releases its locks
+    """
+    @trace.traced
     def abort(self):
-        #TODO: do roll-back and any other necessary operations
+        # The rollbacks touch records this transaction still holds exclusive locks on
+        set_current_transaction(None)
+        for table, rid, rollback, args in reversed(self.undo):
+            rollback(*args)
+        self._release()
         return False
 
-    
+    """
+    # Makes the writes of this run durable, then releases its locks
+    """
+    @trace.traced
     def commit(self):
-        # TODO: commit to database
+        for table in self.locks:
+            if getattr(table, 'log', None) is not None:
+                table.log.flush()
+        self._release()
         return True
 
+    """
+    # Lets the page ranges this run wrote to be merged again and releases its locks
+    """
+    def _release(self):
+        for table, rid, _, _ in self.undo:
+            table.release(rid)
+        self.undo = []
+        for table, items in self.locks.items():
+            table.lock_manager.release(items, self)
+        self.locks = {}
@@ -1,44 +1,71 @@
 from lstore.table import Table, Record
 from lstore.index import Index
+from lstore.config import RETRY_BACKOFF, MAX_RETRY_BACKOFF
+from lstore import trace
+import random
+import threading
+import time
 
 class TransactionWorker:
 
     """
     # Creates a transaction worker object.
     """
-    def __init__(self, transactions = []):
+    def __init__(self, transactions = None):
         self.stats = []
-        self.transactions = transactions
+        self.transactions = list(transactions) if transactions is not None else []
         self.result = 0
-        pass
+        # Runs that aborted on a lock conflict and were retried
+        self.aborts = 0
+        # For each transaction run: seconds from its first run to its commit or final abort, and the
+        # number of times it was retried
+        self.latencies = []
+        self.retries = []
+        self.thread = None
+
 
-    
     """
     Appends t to transactions
     """
     def add_transaction(self, t):
         self.transactions.append(t)
 
-        
+
     """
     Runs all transaction as a thread
     """
     def run(self):
-        pass
-        # here you need to create a thread and call __run
-    
+        self.thread = threading.Thread(target=self.__run)
+        self.thread.start()
+
 
     """
     Waits for the worker to finish
     """
     def join(self):
-        pass
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
 
 
     def __run(self):
         for transaction in self.transactions:
+            start = time.perf_counter()
+            retries = 0
             # each transaction returns True if committed or False if aborted
-            self.stats.append(transaction.run())
+            committed = transaction.run()
+            # Transactions aborted by a lock conflict are retried after a randomized, growing backoff
+            # until they commit; the ones whose queries failed stay aborted
+            backoff = RETRY_BACKOFF
+            while not committed and transaction.conflicted:
+                self.aborts += 1
+                retries += 1
+                with trace.span('backoff', limit=backoff):
+                    time.sleep(random.uniform(0, backoff))
+                backoff = min(backoff * 2, MAX_RETRY_BACKOFF)
+                committed = transaction.run()
+            self.latencies.append(time.perf_counter() - start)
+            self.retries.append(retries)
+            self.stats.append(committed)
         # stores the number of transactions that committed
         self.result = len(list(filter(lambda x: x, self.stats)))
-
@@ -0,0 +1,68 @@
+from lstore.db import Database
+from lstore.query import Query
+
+from random import randint, seed
+import shutil
+import time
+
+# Checks that indexes keep serving range selects after a reopen and after an eviction.
+# Indexes are saved as images on close and only loaded when first used, and evicted ones are rebuilt
+# in the background after a lookup scanned the column: either way select_range must then walk the
+# index and return records in ascending order of the column, not fall back to a scan in storage order.
+# Usage: python reopen_tester.py
+
+path = './REOPEN'
+number_of_records = 5000
+shutil.rmtree(path, ignore_errors=True)
+
+seed(7301)
+records = {}
+db = Database()
+db.open(path)
+grades_table = db.create_table('Grades', 5, 0)
+query = Query(grades_table)
+grades_table.index.create_index(2)
+for i in range(number_of_records):
+    key = 92106429 + i
+    records[key] = [key, randint(0, 1000), randint(0, 100000), randint(0, 1000), randint(0, 1000)]
+    query.insert(*records[key])
+db.close()
+
+errors = 0
+
+
+def check_order(query, label):
+    global errors
+    begin, end = 20000, 80000
+    expected = sorted((values[2], key) for key, values in records.items() if begin <= values[2] <= end)
+    found = [(record.columns[2], record.columns[0]) for record in query.select_range(begin, end, 2, [1, 1, 1, 1, 1], batch_size=None)]
+    if [value for value, _ in found] != [value for value, _ in expected]:
+        print(label, 'select_range did not return the records in index order')
+        errors += 1
+    if sorted(found) != expected:
+        print(label, 'select_range returned', len(found), 'records instead of', len(expected))
+        errors += 1
+
+
+db = Database()
+db.open(path)
+grades_table = db.get_table('Grades')
+query = Query(grades_table)
+if 2 not in grades_table.index.stored:
+    print('index of column 2 was not reopened from its image')
+    errors += 1
+check_order(query, 'reopened:')
+grades_table.index.evict(2)
+if query.select(20000, 2, [1, 1, 1, 1, 1]) is None:
+    print('select on an evicted index failed')
+    errors += 1
+for _ in range(100):
+    if grades_table.index.indices[2] is not None:
+        break
+    time.sleep(0.05)
+check_order(query, 'evicted:')
+db.close()
+shutil.rmtree(path, ignore_errors=True)
+
+print('Reopen with index images', 'passed' if not errors else 'failed')
+exit(1 if errors else 0)
@@ -0,0 +1,64 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.transaction import Transaction
+
+from itertools import islice
+from random import randint, seed
+
+# Checks range selects on a table split over several shard processes.
+# On the primary key the shards hold consecutive key ranges, so select_range returns every record in
+# key order. On another indexed column, each shard's records come in order of that column, the shards
+# following each other in shard order. Transactions refuse sharded tables.
+# Usage: python shard_tester.py
+
+number_of_records = 4000
+first_key = 92106429
+bounds = [first_key + 1000, first_key + 2000, first_key + 3000]
+
+if __name__ == '__main__':
+    db = Database()
+    grades_table = db.create_table('Grades', 5, 0, shard_bounds=bounds)
+    query = Query(grades_table)
+    grades_table.index.create_index(2)
+
+    seed(5113)
+    records = {}
+    for i in range(number_of_records):
+        key = first_key + i
+        records[key] = [key, randint(0, 20), randint(0, 1000), randint(0, 20), randint(0, 20)]
+        query.insert(*records[key])
+
+    errors = 0
+    begin, end = first_key + 500, first_key + 3500
+    found = [record.columns for record in query.select_range(begin, end, 0, [1, 1, 1, 1, 1])]
+    if found != [records[key] for key in range(begin, end + 1)]:
+        print('select_range on the key returned', len(found), 'records, not every record in key order')
+        errors += 1
+
+    found = [record.columns for batch in query.select_range(100, 900, 2, [1, 1, 1, 1, 1], batch_size=100) for record in batch]
+    expected = sorted((grades_table.shard_of(values[0]), values[2]) for values in records.values() if 100 <= values[2] <= 900)
+    if [(grades_table.shard_of(values[0]), values[2]) for values in found] != expected:
+        print('select_range on column 2 returned', len(found), 'records, not every record in shard then column order')
+        errors += 1
+
+    # Stopping early closes the cursor, the shards keep answering
+    first = list(islice(query.select_range(begin, end, 0, [1, 1, 1, 1, 1]), 10))
+    if [record.columns for record in first] != [records[key] for key in range(begin, begin + 10)]:
+        print('select_range stopped early returned', [record.columns for record in first])
+        errors += 1
+    if query.select(end, 0, [1, 1, 1, 1, 1])[0].columns != records[end]:
+        print('select after an unfinished select_range failed')
+        errors += 1
+
+    # Transactions cannot lock or roll back records held by shard processes, so they are refused
+    transaction = Transaction()
+    try:
+        transaction.add_query(query.update, grades_table, begin, None, 1, None, None, None)
+        print('a transaction accepted a query on a sharded table')
+        errors += 1
+    except ValueError:
+        pass
+
+    db.close()
+    print('Sharded range select', 'passed' if not errors else 'failed')
+    exit(1 if errors else 0)
@@ -0,0 +1,78 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.shared import SharedSnapshots
+
+from random import Random
+import os
+import sys
+import threading
+import time
+
+# Publishes shared memory snapshots from several threads while the table is updated and scanned.
+# Every scan must attach to segments that are still alive, and once the snapshots are closed no
+# segment may be left in shared memory.
+# Usage: python snapshot_tester.py
+
+number_of_records = 20000
+number_of_publishers = 4
+rounds = 50
+
+if __name__ == '__main__':
+    db = Database()
+    grades_table = db.create_table('Grades', 5, 0)
+    query = Query(grades_table)
+    for key in range(number_of_records):
+        query.insert(key, 1, 0, 0, 0)
+    before = set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else set()
+    snapshots = SharedSnapshots(grades_table, workers=1)
+
+    errors = []
+    # Other threads get to run before every acquisition of the snapshots' lock, so publishes and
+    # updates interleave as much as they can
+    sys.setswitchinterval(0.00001)
+
+    class YieldingLock:
+
+        def __init__(self, lock):
+            self.lock = lock
+
+        def __enter__(self):
+            time.sleep(0.001)
+            self.lock.acquire()
+
+        def __exit__(self, *exc):
+            self.lock.release()
+
+    snapshots.lock = YieldingLock(snapshots.lock)
+
+    def update():
+        rng = Random(1)
+        for _ in range(rounds * 20):
+            query.update(rng.randrange(number_of_records), None, None, rng.randrange(100), None, None)
+
+    def publish():
+        try:
+            for _ in range(rounds):
+                snapshots.publish()
+                # Every record has 1 in column 1, whatever generation the sum reads
+                total = snapshots.sum(0, number_of_records - 1, 1)
+                if total != number_of_records:
+                    errors.append('sum returned %s instead of %d' % (total, number_of_records))
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=update)] + [threading.Thread(target=publish) for _ in range(number_of_publishers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    snapshots.close()
+    db.close()
+
+    left = (set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else set()) - before
+    if left:
+        errors.append('%d segments left in shared memory' % len(left))
+    for error in errors[:10]:
+        print(error)
+    print('Concurrent snapshot publishing', 'passed' if not errors else 'failed')
+    exit(1 if errors else 0)
@@ -0,0 +1,49 @@
+from lstore.db import Database
+from lstore.query import Query
+from time import process_time
+from random import choice, randrange, seed
+
+# Compares cumulative and non-cumulative tail records on the same sparse update workload:
+# every update sets one of the 4 grades, and merges are left out so the version chains grow.
+import lstore.table
+lstore.table.MERGE_THRESHOLD = 1 << 62
+
+for cumulative in (True, False):
+    seed(3)
+    db = Database()
+    grades_table = db.create_table('Grades', 5, 0, cumulative=cumulative)
+    query = Query(grades_table)
+    keys = [906659671 + i for i in range(0, 10000)]
+    for key in keys:
+        query.insert(key, 93, 0, 0, 0)
+
+    print("Cumulative tail records:" if cumulative else "Non-cumulative tail records:")
+
+    update_time_0 = process_time()
+    for i in range(0, 50000):
+        update = [None, None, None, None, None]
+        update[randrange(1, 5)] = randrange(0, 100)
+        query.update(choice(keys), *update)
+    update_time_1 = process_time()
+    print("Updating 50k records took:  \t\t\t", update_time_1 - update_time_0)
+
+    select_time_0 = process_time()
+    for i in range(0, 10000):
+        query.select(choice(keys), 0, [1, 1, 1, 1, 1])
+    select_time_1 = process_time()
+    print("Selecting 10k records took:  \t\t\t", select_time_1 - select_time_0)
+
+    version_time_0 = process_time()
+    for i in range(0, 10000):
+        query.select_version(choice(keys), 0, [1, 1, 1, 1, 1], -2)
+    version_time_1 = process_time()
+    print("Selecting 10k version -2 records took:  \t", version_time_1 - version_time_0)
+
+    agg_time_0 = process_time()
+    for i in range(0, 10000, 100):
+        start_value = 906659671 + i
+        end_value = start_value + 100
+        query.sum(start_value, end_value - 1, randrange(0, 5))
+    agg_time_1 = process_time()
+    print("Aggregate 10k of 100 record batch took:\t", agg_time_1 - agg_time_0)
+    print()
@@ -0,0 +1,134 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.transaction import Transaction
+from lstore.transaction_worker import TransactionWorker
+from bisect import bisect_left
+from itertools import accumulate
+from time import perf_counter
+import argparse
+import json
+import random
+
+# Measures how transactional throughput scales with the number of workers.
+# Every combination of worker count, key skew and read ratio runs the same number of transactions on a
+# freshly loaded table. Each transaction holds --queries point queries on keys drawn from a Zipfian
+# distribution (exponent --skew, 0 being uniform): a select with probability --reads, otherwise an
+# update of one column. Workers retry transactions aborted by lock conflicts (see TransactionWorker).
+# Reported: committed transactions per second, share of runs that aborted, and the latency of
+# transactions overall and of the ones that had to be retried.
+# Example:
+# python transaction_benchmark.py --workers 1,2,4,8 --skew 0,0.99 --reads 0.5,0.9 --json scaling.json
+
+
+"""
+# Returns a function drawing record indexes in [0, records) with a Zipfian skew. Ranks are shuffled
+# over the records so hot keys are spread over the table.
+"""
+def zipf_sampler(records, skew, rng):
+    cumulative = list(accumulate(1 / (rank ** skew) for rank in range(1, records + 1)))
+    ranks = list(range(records))
+    rng.shuffle(ranks)
+    total = cumulative[-1]
+
+    def draw():
+        return ranks[min(bisect_left(cumulative, rng.random() * total), records - 1)]
+    return draw
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+"""
+# Loads a table, runs one configuration and returns its measurements
+"""
+def run(workers, skew, reads, args):
+    db = Database()
+    table = db.create_table('Bench', 5, 0)
+    query = Query(table)
+    keys = [92106429 + i for i in range(args.records)]
+    for key in keys:
+        query.insert(key, 0, 0, 0, 0)
+
+    rng = random.Random(args.seed)
+    draw = zipf_sampler(args.records, skew, rng)
+    pool = [TransactionWorker() for _ in range(workers)]
+    for i in range(args.transactions):
+        transaction = Transaction(ordered=args.ordered)
+        for _ in range(args.queries):
+            key = keys[draw()]
+            if rng.random() < reads:
+                transaction.add_query(query.select, table, key, 0, [1, 1, 1, 1, 1])
+            else:
+                columns = [None, None, None, None, None]
+                columns[rng.randrange(1, 5)] = rng.randrange(1000)
+                transaction.add_query(query.update, table, key, *columns)
+        pool[i % workers].add_transaction(transaction)
+
+    start = perf_counter()
+    for worker in pool:
+        worker.run()
+    for worker in pool:
+        worker.join()
+    elapsed = perf_counter() - start
+    db.close()
+
+    committed = sum(worker.result for worker in pool)
+    aborts = sum(worker.aborts for worker in pool)
+    latencies = [latency for worker in pool for latency in worker.latencies]
+    retried = [latency for worker in pool for latency, retries in zip(worker.latencies, worker.retries) if retries]
+    return {
+        'workers': workers,
+        'skew': skew,
+        'reads': reads,
+        'transactions': args.transactions,
+        'committed': committed,
+        'seconds': elapsed,
+        'throughput': committed / elapsed,
+        # Aborted runs over all runs, retries included
+        'abort_rate': aborts / (aborts + args.transactions),
+        'retried': len(retried),
+        'latency_p50_ms': percentile(latencies, 0.5) * 1000,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1000,
+        'retry_latency_mean_ms': sum(retried) / len(retried) * 1000 if retried else 0.0,
+        'retry_latency_p99_ms': percentile(retried, 0.99) * 1000,
+    }
+
+
+def numbers(text, kind):
+    return [kind(value) for value in text.split(',')]
+
+
+parser = argparse.ArgumentParser(description='Transactional throughput across worker counts, key skews and read ratios')
+parser.add_argument('--workers', default='1,2,4,8,16,32,64', help='comma separated worker counts')
+parser.add_argument('--skew', default='0,0.99', help='comma separated Zipfian exponents (0 is uniform)')
+parser.add_argument('--reads', default='0.5,0.95', help='comma separated shares of selects among the queries')
+parser.add_argument('--records', type=int, default=10000)
+parser.add_argument('--transactions', type=int, default=2000, help='transactions per configuration')
+parser.add_argument('--queries', type=int, default=5, help='queries per transaction')
+parser.add_argument('--ordered', action='store_true', help='take every lock up front (Transaction(ordered=True))')
+parser.add_argument('--seed', type=int, default=3)
+parser.add_argument('--json', help='also write the results to this file')
+args = parser.parse_args()
+
+results = []
+header = '%8s %6s %6s %12s %8s %10s %10s %10s %12s' % ('workers', 'skew', 'reads', 'commits/s', 'aborts', 'p50 ms', 'p99 ms', 'retried', 'retry p99 ms')
+print(header)
+print('-' * len(header))
+for skew in numbers(args.skew, float):
+    for reads in numbers(args.reads, float):
+        for workers in numbers(args.workers, int):
+            result = run(workers, skew, reads, args)
+            results.append(result)
+            print('%8d %6.2f %6.2f %12.0f %7.1f%% %10.2f %10.2f %10d %12.2f' % (
+                workers, skew, reads, result['throughput'], result['abort_rate'] * 100, result['latency_p50_ms'],
+                result['latency_p99_ms'], result['retried'], result['retry_latency_p99_ms']))
+        print()
+
+print(json.dumps(results, indent=2))
+if args.json:
+    with open(args.json, 'w') as file:
+        json.dump(results, file, indent=2)